@@ -10,7 +10,114 @@ BOT_TOKEN = os.getenv("BOT_TOKEN")
 SUPPORT_CHANNEL_ID = int(os.getenv("SUPPORT_CHANNEL_ID"))
 DISCUSSION_GROUP_ID = int(os.getenv("DISCUSSION_GROUP_ID"))
 
+# "channel": tickets are posted to SUPPORT_CHANNEL_ID and discussed in the linked
+# group. "topics": every ticket gets its own forum topic in DISCUSSION_GROUP_ID
+# (the group must have topics enabled and the bot must be allowed to manage them)
+DISCUSSION_MODE = os.getenv("DISCUSSION_MODE", "channel").lower()
+
 SUPPORT_STAFF_IDS = [int(id) for id in os.getenv("SUPPORT_STAFF_IDS").split(',')]
 
 TRACKING_FILE = "Database/message_tracking.json"
-CONVERSATIONS_FILE = "Database/conversations.json"
\ No newline at end of file
+CONVERSATIONS_FILE = "Database/conversations.json"
+STATES_FILE = "Database/conversation_states.json"
+SQLITE_FILE = "Database/support.db"
+CONVERSATION_LOG_DIR = "Database/conversations"
+OUTBOX_FILE = "Database/outbox.db"
+ARCHIVE_DIR = "Database/archive"
+SEARCH_FILE = "Database/search.db"
+
+# Storage backend for tickets and conversations: "json" or "sqlite"
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "json").lower()
+
+# File format of the tracking and state snapshots: "json" (compact, orjson when
+# installed) or "msgpack" (binary, needs the msgpack package)
+SNAPSHOT_FORMAT = os.getenv("SNAPSHOT_FORMAT", "json").lower()
+
+# Size in bytes at which the closed-ticket archive starts a new segment file
+ARCHIVE_SEGMENT_SIZE = int(os.getenv("ARCHIVE_SEGMENT_SIZE", str(64 * 1024 * 1024)))
+
+# Seconds to wait after a change before the ticket store writes dirty state to disk
+STORE_FLUSH_DELAY = float(os.getenv("STORE_FLUSH_DELAY", "2"))
+
+
+# Minimum seconds between background compactions of the conversation log
+CONVERSATION_COMPACT_INTERVAL = float(os.getenv("CONVERSATION_COMPACT_INTERVAL", "300"))
+
+# Maximum number of staff notifications sent concurrently for one event
+STAFF_FANOUT_CONCURRENCY = int(os.getenv("STAFF_FANOUT_CONCURRENCY", "10"))
+
+# Outbound Telegram rate limits used by the send scheduler
+SEND_GLOBAL_RATE = float(os.getenv("SEND_GLOBAL_RATE", "30"))
+SEND_PRIVATE_RATE = float(os.getenv("SEND_PRIVATE_RATE", "1"))
+SEND_GROUP_RATE_PER_MINUTE = float(os.getenv("SEND_GROUP_RATE_PER_MINUTE", "20"))
+SEND_MAX_RETRIES = int(os.getenv("SEND_MAX_RETRIES", "3"))
+
+# Background delivery of relays and staff notifications
+OUTBOX_WORKERS = int(os.getenv("OUTBOX_WORKERS", "4"))
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "8"))
+
+# Seconds a user has to describe their issue after choosing a category
+DESCRIPTION_TIMEOUT = int(os.getenv("DESCRIPTION_TIMEOUT", "300"))
+
+# Maximum number of tickets whose updates are handled concurrently
+DISPATCH_WORKERS = int(os.getenv("DISPATCH_WORKERS", "16"))
+
+# Cached Telegram user profiles used to render display names
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "4096"))
+USER_CACHE_TTL = int(os.getenv("USER_CACHE_TTL", "3600"))
+
+# Seconds to wait for further items of an album before relaying it as one media group
+ALBUM_BUFFER_DELAY = float(os.getenv("ALBUM_BUFFER_DELAY", "1.5"))
+
+# Seconds after a staff notification during which further messages of the same
+# ticket are merged into one digest (0 notifies for every message)
+NOTIFY_DIGEST_WINDOW = float(os.getenv("NOTIFY_DIGEST_WINDOW", "60"))
+NOTIFY_DIGEST_MAX_ITEMS = int(os.getenv("NOTIFY_DIGEST_MAX_ITEMS", "10"))
+
+# Default length in minutes of a staff member's /quiet window
+STAFF_QUIET_MINUTES = int(os.getenv("STAFF_QUIET_MINUTES", "60"))
+
+# Ticket assignment: "least_loaded", "round_robin" or "broadcast" (notify every staff member)
+ASSIGNMENT_STRATEGY = os.getenv("ASSIGNMENT_STRATEGY", "least_loaded").lower()
+
+def parse_staff_categories(spec):
+    """"123456789=technical|billing,987654321=general" -> {123456789: {"technical", "billing"}, ...}.
+    Entries without "=", a numeric staff id or any category are skipped"""
+    staff_categories = {}
+    for item in spec.split(","):
+        staff_id, separator, categories = item.partition("=")
+        staff_id = staff_id.strip()
+        categories = {category.strip() for category in categories.split("|") if category.strip()}
+        if separator and staff_id.lstrip("-").isdigit() and categories:
+            staff_categories[int(staff_id)] = categories
+    return staff_categories
+
+# Categories each staff member prefers, e.g. "123456789=technical|billing,987654321=general"
+STAFF_CATEGORIES = parse_staff_categories(os.getenv("STAFF_CATEGORIES", ""))
+
+# Seconds the assignee has to answer before a ticket is escalated to all staff (0 disables)
+ASSIGNMENT_ESCALATION_TIMEOUT = float(os.getenv("ASSIGNMENT_ESCALATION_TIMEOUT", "900"))
+
+# Seconds a user message may wait for a staff reply before staff get an SLA reminder (0 disables)
+SLA_REPLY_TIMEOUT = float(os.getenv("SLA_REPLY_TIMEOUT", "1800"))
+
+# Seconds without activity before the user is warned and before the ticket is closed automatically (0 disables)
+TICKET_IDLE_WARNING = float(os.getenv("TICKET_IDLE_WARNING", "86400"))
+TICKET_IDLE_CLOSE = float(os.getenv("TICKET_IDLE_CLOSE", "172800"))
+
+# In-process health, readiness and metrics endpoint (/health, /ready, /metrics)
+HEALTH_HOST = os.getenv("HEALTH_HOST", "0.0.0.0")
+HEALTH_PORT = int(os.getenv("PORT", "8000"))
+# Unhealthy when the event loop lags more than this many seconds
+HEALTH_MAX_LOOP_LAG = float(os.getenv("HEALTH_MAX_LOOP_LAG", "2"))
+# Not ready while more outbound calls and jobs than this are waiting
+HEALTH_MAX_BACKLOG = int(os.getenv("HEALTH_MAX_BACKLOG", "1000"))
+# Unhealthy when a change has waited this many seconds for a store flush
+HEALTH_MAX_UNFLUSHED = float(os.getenv("HEALTH_MAX_UNFLUSHED", "60"))
+
+# Log level of the bot's own loggers, and per-module overrides such as
+# "utils.sender=DEBUG,handlers=INFO" (module paths as in the source tree)
+LOG_LEVEL = os.getenv("LOG_LEVEL", "CRITICAL")
+LOG_LEVELS = os.getenv("LOG_LEVELS", "")
+# "json": one JSON object per line with ticket_id, user_id and handler; "text": plain lines
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json").lower()
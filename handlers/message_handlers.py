@@ -1,47 +1,89 @@
 import logging
-from config import SUPPORT_CHANNEL_ID, DISCUSSION_GROUP_ID
-from utils.data_manager import load_tracking_data, save_tracking_data
-from utils.utils import get_timestamp
-from utils.data_manager import load_tracking_data, save_tracking_data, load_conversations_data, save_conversations_data
-from utils.ticket_manager import notify_support_staff
-from helper import logger
+import time
+from config import SUPPORT_CHANNEL_ID, DISCUSSION_GROUP_ID, ALBUM_BUFFER_DELAY
+from utils.utils import get_timestamp, format_timestamp
+from utils.ticket_store import store
+from utils.sender import send, reply, PRIORITY_RELAY
+from utils.media import (
+    extract_media, extract_media_content, describe_media, relay_message, relay_media_group, edit_relayed_message
+)
+from utils.outbox import outbox
+from utils.ticket_manager import remember_user
+from utils.assignment import assignments
+from utils.sla import record_activity
+from utils.models import Sender, MediaType, ConversationEntry
+from utils.timers import timers
+from utils.dispatcher import dispatcher
+from utils.topics import resolve_discussion_ticket
+from helper import get_logger
+
+logger = get_logger(__name__)
 
 async def process_forwarded_message(client, message, forward_from_chat_id, forward_from_message_id):
     if forward_from_chat_id != SUPPORT_CHANNEL_ID:
         return False, "Message not forwarded from our support channel"
         
-    logger.info(f"Processing forwarded message from channel to discussion group")
-    logger.info(f"Original message ID: {forward_from_message_id}")
-    logger.info(f"Discussion group message ID: {message.id}")
-
-    tracking_data = load_tracking_data()
+    logger.info("Processing forwarded message from channel to discussion group")
+    logger.info("Original message ID: %s", forward_from_message_id)
+    logger.info("Discussion group message ID: %s", message.id)
 
     channel_message_id = forward_from_message_id
-    found_user_id = None
-
-    for user_id, data in tracking_data.items():
-        if data.get("channel_message_id") == channel_message_id:
-            found_user_id = user_id
-            break
+    found_user_id = store.find_user_by_channel_message(channel_message_id)
     
     if not found_user_id:
-        logger.warning(f"Could not find user associated with channel message ID {channel_message_id}")
+        logger.warning("Could not find user associated with channel message ID %s", channel_message_id)
         return False, "Could not find associated user"
  
-    tracking_data[found_user_id].update({
-        "discussion_group_id": DISCUSSION_GROUP_ID,
-        "discussion_message_id": message.id,
-        "status": "forwarded_to_discussion",
-        "forward_timestamp": message.date.timestamp(),
-        "forward_timestamp_utc7": get_timestamp(),
-        "last_activity": get_timestamp()
-    })
-
-    save_tracking_data(tracking_data)
+    ticket_data = store.update_ticket(
+        found_user_id,
+        discussion_group_id=DISCUSSION_GROUP_ID,
+        discussion_message_id=message.id,
+        status="forwarded_to_discussion",
+        forward_timestamp=message.date.timestamp()
+    )
         
-    logger.info(f"Updated tracking for user {found_user_id} with discussion group info")
+    logger.info("Updated tracking for user %s with discussion group info", found_user_id)
+
+    if ticket_data.pending_media_message_id:
+        _, entry = store.find_entry_by_private_message(ticket_data.pending_media_message_id)
+        outbox.enqueue("relay_ticket_media", {
+            "user_id": int(found_user_id),
+            "message_id": ticket_data.pending_media_message_id,
+            "media_type": ticket_data.media_type,
+            "media_file_id": entry.media_file_id if entry else None,
+            "media_content": entry.media_content if entry else None,
+            "discussion_group_id": DISCUSSION_GROUP_ID,
+            "discussion_message_id": message.id
+        }, key=found_user_id)
+
     return True, found_user_id
 
+@outbox.job("relay_ticket_media")
+async def relay_ticket_media(client, payload):
+    """Post a ticket description that could not carry the ticket header
+    (sticker, location, poll, ...) into the ticket's discussion thread"""
+    discussion_msg, _ = await relay_message(
+        client,
+        payload["discussion_group_id"],
+        None,
+        media_type=payload["media_type"],
+        media_file_id=payload.get("media_file_id"),
+        media_content=payload.get("media_content"),
+        reply_to_message_id=payload["discussion_message_id"],
+        priority=PRIORITY_RELAY
+    )
+
+    user_id, entry = store.find_entry_by_private_message(payload["message_id"])
+    if entry is not None:
+        # Staff replies to the relayed media resolve to the description
+        store.update_message(user_id, entry, discussion_message_id=discussion_msg.id)
+    store.update_ticket(payload["user_id"], pending_media_message_id=None)
+
+# Album items waiting to be relayed together: media_group_id -> [message],
+# plus the album each user is currently sending
+_albums = {}
+_album_by_user = {}
+
 async def process_user_message(client, message, is_reply=False):
     """Process a message from a user"""
     
@@ -50,358 +92,396 @@ async def process_user_message(client, message, is_reply=False):
 async def process_user_message(client, message, is_reply=False):
     user_id = message.from_user.id
 
-    tracking_data = load_tracking_data()
-    conversations_data = load_conversations_data()
+    if not store.has_ticket(user_id):
+        await reply(message, "You don't have an active ticket. Use /create_ticket to open a new ticket.")
+        return False
+
+    record_activity(client, user_id, "user")
+
+    # Relay a buffered album before anything the user sent after it
+    pending_album = _album_by_user.get(user_id)
+    if pending_album is not None and pending_album != message.media_group_id:
+        await flush_album(client, pending_album)
+
+    if message.media_group_id:
+        buffer_album_item(client, message)
+        return True
+
+    return await relay_user_messages(client, [message], is_reply)
+
+def buffer_album_item(client, message):
+    """Hold an album item until no further item of its media group arrived for
+    ALBUM_BUFFER_DELAY seconds, then relay the whole album at once"""
+    user_id = message.from_user.id
+    media_group_id = message.media_group_id
+
+    _albums.setdefault(media_group_id, []).append(message)
+    _album_by_user[user_id] = media_group_id
 
-    if str(user_id) not in tracking_data:
-        await message.reply("You don't have an active ticket. Use /create_ticket to open a new ticket.")
+    timers.schedule(
+        ("album", media_group_id),
+        time.time() + ALBUM_BUFFER_DELAY,
+        dispatcher.submit, user_id, flush_album, client, media_group_id
+    )
+
+async def flush_album(client, media_group_id):
+    messages = _albums.pop(media_group_id, None)
+    timers.cancel(("album", media_group_id))
+    if not messages:
         return False
 
+    user_id = messages[0].from_user.id
+    if _album_by_user.get(user_id) == media_group_id:
+        del _album_by_user[user_id]
+
+    if not store.has_ticket(user_id):
+        logger.info("Dropping album %s from user %s: ticket was closed", media_group_id, user_id)
+        return False
+
+    messages.sort(key=lambda item: item.id)
+    return await relay_user_messages(client, messages, messages[0].reply_to_message is not None)
+
+def format_user_relay(user, timestamp, text, is_reply):
+    """Text of a user message as relayed to the discussion group"""
+    user_info = f"👤 {user.first_name}"
+    if user.username:
+        user_info += f" (@{user.username})"
+
+    if text:
+        if is_reply:
+            return f"{user_info} replied on {timestamp}:\n\n{text}"
+        return f"{user_info} sent a message on {timestamp}:\n\n{text}"
+
+    if is_reply:
+        return f"{user_info} replied with media on {timestamp}."
+    return f"{user_info} sent media on {timestamp}."
+
+def format_staff_relay(text):
+    """Text of a staff reply as relayed to the user"""
+    if text:
+        return f"💬 Reply from Support Staff:\n\n{text}"
+    return "💬 Reply from Support Staff:"
+
+async def relay_user_messages(client, messages, is_reply=False):
+    """Queue one message, or all items of one album, for relay to the discussion group"""
+    message = messages[0]
+    user_id = message.from_user.id
     timestamp = get_timestamp()
 
-    tracking_data[str(user_id)]["last_activity"] = timestamp
-    save_tracking_data(tracking_data)
+    ticket_data = store.get_ticket(user_id)
+    discussion_group_id = ticket_data.discussion_group_id or DISCUSSION_GROUP_ID
 
-    ticket_data = tracking_data[str(user_id)]
-    discussion_group_id = ticket_data.get("discussion_group_id", DISCUSSION_GROUP_ID)
+    media_type, media_file_id, message_text = extract_media(message)
 
-    media_type = None
-    media_file_id = None
-    message_text = None
-    
-    if message.text:
-        message_text = message.text
-        logger.info(f"User {user_id} sent text: {message_text[:20]}...")
-    elif message.photo:
-        media_type = "photo"
-        media_file_id = message.photo.file_id
-        message_text = message.caption
-        logger.info(f"User {user_id} sent photo with caption: {message_text[:20] if message_text else 'No caption'}")
-    elif message.video:
-        media_type = "video"
-        media_file_id = message.video.file_id
-        message_text = message.caption
-        logger.info(f"User {user_id} sent video with caption: {message_text[:20] if message_text else 'No caption'}")
-    elif message.document:
-        media_type = "document"
-        media_file_id = message.document.file_id
-        message_text = message.caption
-        logger.info(f"User {user_id} sent document with caption: {message_text[:20] if message_text else 'No caption'}")
-    elif message.audio:
-        media_type = "audio"
-        media_file_id = message.audio.file_id
-        message_text = message.caption
-        logger.info(f"User {user_id} sent audio with caption: {message_text[:20] if message_text else 'No caption'}")
-    elif message.voice:
-        media_type = "voice"
-        media_file_id = message.voice.file_id
-        message_text = message.caption
-        logger.info(f"User {user_id} sent voice with caption: {message_text[:20] if message_text else 'No caption'}")
-
-    if str(user_id) not in conversations_data:
-        conversations_data[str(user_id)] = []
-    
-    conversation_entry = {
-        "sender": "user",
+    conversation_entry = ConversationEntry.from_dict({
+        "sender": Sender.USER,
         "message_id": message.id,
         "text": message_text or "",
         "media_type": media_type,
         "media_file_id": media_file_id,
-        "timestamp": message.date.timestamp(),
-        "timestamp_utc7": timestamp,
-    }
+        "media_content": extract_media_content(message),
+        "timestamp": message.date.timestamp()
+    })
+
+    media_items = None
+    if len(messages) > 1:
+        media_items = [extract_media(item)[:2] for item in messages]
+        message_text = next((item.caption for item in messages if item.caption), None)
+
+        conversation_entry.update({
+            "text": message_text or "",
+            "media_type": MediaType.MEDIA_GROUP,
+            "media_file_id": None,
+            "media_types": [item_type for item_type, _ in media_items],
+            "media_file_ids": [file_id for _, file_id in media_items],
+            "message_ids": [item.id for item in messages]
+        })
+        logger.info("User %s sent an album of %s items", user_id, len(messages))
+    else:
+        logger.info("User %s sent %s", user_id, describe_media(media_type, message_text))
 
     if is_reply and message.reply_to_message:
-        conversation_entry["reply_to_message_id"] = message.reply_to_message.id
+        conversation_entry.reply_to_message_id = message.reply_to_message.id
 
         is_reply_to_staff = False
         staff_discussion_msg_id = None
 
-        for msg in conversations_data.get(str(user_id), []):
-            if msg.get("sender") == "staff" and msg.get("message_id") == message.reply_to_message.id:
-                is_reply_to_staff = True
-                staff_discussion_msg_id = msg.get("discussion_message_id")
-                logger.info(f"User replying to staff message with ID {message.reply_to_message.id}")
-                break
-                
-        conversation_entry["is_reply_to_staff"] = is_reply_to_staff
-        
-    conversations_data[str(user_id)].append(conversation_entry)
-    
-    user_info = f"👤 {message.from_user.first_name}"
-    if message.from_user.username:
-        user_info += f" (@{message.from_user.username})"
+        _, replied_entry = store.find_entry_by_private_message(message.reply_to_message.id)
+        if replied_entry is not None and replied_entry.sender == Sender.STAFF:
+            is_reply_to_staff = True
+            staff_discussion_msg_id = replied_entry.discussion_message_id
+            logger.info("User replying to staff message with ID %s", message.reply_to_message.id)
 
-    if message_text:
-        if is_reply:
-            forward_text = f"{user_info} replied on {timestamp}:\n\n{message_text}"
-        else:
-            forward_text = f"{user_info} sent a message on {timestamp}:\n\n{message_text}"
-    else:
-        if is_reply:
-            forward_text = f"{user_info} replied with media on {timestamp}."
-        else:
-            forward_text = f"{user_info} sent media on {timestamp}."
+        conversation_entry.is_reply_to_staff = is_reply_to_staff
+
+    forward_text = format_user_relay(message.from_user, timestamp, message_text, is_reply)
 
     reply_to_msg_id = None
     
-    if is_reply and conversation_entry.get("is_reply_to_staff") and staff_discussion_msg_id:
+    if is_reply and conversation_entry.is_reply_to_staff and staff_discussion_msg_id:
         reply_to_msg_id = staff_discussion_msg_id
-        logger.info(f"Will reply to staff message with ID {staff_discussion_msg_id} in discussion group")
+        logger.info("Will reply to staff message with ID %s in discussion group", staff_discussion_msg_id)
     else:
-        reply_to_msg_id = ticket_data.get("discussion_message_id")
-        logger.info(f"Will reply to original message with ID {reply_to_msg_id} in discussion group")
+        reply_to_msg_id = ticket_data.discussion_message_id
+        logger.info("Will reply to original message with ID %s in discussion group", reply_to_msg_id)
     
-    try:
-        if media_type:
-            if media_type == "photo":
-                discussion_msg = await client.send_photo(
-                    discussion_group_id,
-                    photo=media_file_id,
-                    caption=forward_text,
-                    reply_to_message_id=reply_to_msg_id
-                )
-            elif media_type == "video":
-                discussion_msg = await client.send_video(
-                    discussion_group_id,
-                    video=media_file_id,
-                    caption=forward_text,
-                    reply_to_message_id=reply_to_msg_id
-                )
-            elif media_type == "document":
-                discussion_msg = await client.send_document(
-                    discussion_group_id,
-                    document=media_file_id,
-                    caption=forward_text,
-                    reply_to_message_id=reply_to_msg_id
-                )
-            elif media_type == "audio":
-                discussion_msg = await client.send_audio(
-                    discussion_group_id,
-                    audio=media_file_id,
-                    caption=forward_text,
-                    reply_to_message_id=reply_to_msg_id
-                )
-            elif media_type == "voice":
-                discussion_msg = await client.send_voice(
-                    discussion_group_id,
-                    voice=media_file_id,
-                    caption=forward_text,
-                    reply_to_message_id=reply_to_msg_id
-                )
-        else:
-            discussion_msg = await client.send_message(
-                discussion_group_id,
-                forward_text,
-                reply_to_message_id=reply_to_msg_id
-            )
+    user_name = remember_user(message.from_user)
 
-        conversations_data[str(user_id)][-1]["discussion_message_id"] = discussion_msg.id
-        save_conversations_data(conversations_data)
-
-        user_name = f"{message.from_user.first_name}"
-        if message.from_user.username:
-            user_name += f" (@{message.from_user.username})"
-            
-        await notify_support_staff(
-            client, 
-            user_id, 
-            user_name, 
-            message_text or "", 
-            discussion_group_id,
-            discussion_msg.id
-        )
-        
-        logger.info(f"User message forwarded to discussion group - Message ID: {discussion_msg.id}")
-        await message.reply("✅ Your message has been forwarded to our support team.", quote=True)
+    try:
+        outbox.enqueue("relay_user_message", {
+            "user_id": user_id,
+            "user_name": user_name,
+            "discussion_group_id": discussion_group_id,
+            "forward_text": forward_text,
+            "media_type": conversation_entry.media_type,
+            "media_file_id": media_file_id,
+            "media_items": media_items,
+            "reply_to_message_id": reply_to_msg_id,
+            "conversation_entry": conversation_entry.to_dict()
+        }, key=user_id)
+
+        await reply(message, "✅ Your message has been forwarded to our support team.", quote=True)
         return True
     except Exception as e:
-        logger.error(f"Error processing user message: {e}")
-        await message.reply("❌ An error occurred while processing your message. Please try again later.", quote=True)
+        logger.error("Error processing user message: %s", e)
+        await reply(message, "❌ An error occurred while processing your message. Please try again later.", quote=True)
         return False
 
+@outbox.job("relay_user_message")
+async def relay_user_message(client, payload):
+    """Deliver a queued user message or album to the discussion group and notify staff"""
+    user_id = payload["user_id"]
+    discussion_group_id = payload["discussion_group_id"]
+    forward_text = payload["forward_text"]
+    reply_to_msg_id = payload["reply_to_message_id"]
+    conversation_entry = ConversationEntry.from_dict(payload["conversation_entry"])
+
+    if payload.get("media_items"):
+        discussion_msgs = await relay_media_group(
+            client,
+            discussion_group_id,
+            payload["media_items"],
+            forward_text,
+            reply_to_message_id=reply_to_msg_id,
+            priority=PRIORITY_RELAY
+        )
+        discussion_msg = discussion_msgs[0]
+        conversation_entry.discussion_message_ids = tuple(msg.id for msg in discussion_msgs)
+    else:
+        discussion_msg, header = await relay_message(
+            client,
+            discussion_group_id,
+            forward_text,
+            media_type=payload["media_type"],
+            media_file_id=payload["media_file_id"],
+            media_content=conversation_entry.media_content,
+            reply_to_message_id=reply_to_msg_id,
+            priority=PRIORITY_RELAY
+        )
+        if header is not None:
+            conversation_entry.header_message_id = header.id
+
+    conversation_entry.discussion_message_id = discussion_msg.id
+    if store.has_ticket(user_id):
+        store.append_message(user_id, conversation_entry)
+
+    outbox.enqueue("notify_support_staff", {
+        "user_id": user_id,
+        "user_name": payload["user_name"],
+        "message_text": conversation_entry.text,
+        "discussion_group_id": discussion_group_id,
+        "discussion_msg_id": discussion_msg.id
+    }, key=user_id)
+
+    logger.info("User message forwarded to discussion group - Message ID: %s", discussion_msg.id)
+
 async def process_staff_reply(client, message):
-    replied_msg_id = message.reply_to_message.id
-    logger.info(f"Staff replying to message ID {replied_msg_id} in discussion group")
+    replied_msg_id = message.reply_to_message_id
+    logger.info("Staff replying to message ID %s in discussion group", replied_msg_id)
 
-    tracking_data = load_tracking_data()
-    conversations_data = load_conversations_data()
+    media_type, media_file_id, message_text = extract_media(message)
+    logger.info("Staff sent %s as reply", describe_media(media_type, message_text))
 
-    media_type = None
-    media_file_id = None
-    message_text = None
-    
-    if message.text:
-        message_text = message.text
-        logger.info(f"Staff sent text reply: {message_text[:20]}...")
-    elif message.photo:
-        media_type = "photo"
-        media_file_id = message.photo.file_id
-        message_text = message.caption
-        logger.info(f"Staff sent photo reply with caption: {message_text[:20] if message_text else 'No caption'}")
-    elif message.video:
-        media_type = "video"
-        media_file_id = message.video.file_id
-        message_text = message.caption
-        logger.info(f"Staff sent video reply with caption: {message_text[:20] if message_text else 'No caption'}")
-    elif message.document:
-        media_type = "document"
-        media_file_id = message.document.file_id
-        message_text = message.caption
-        logger.info(f"Staff sent document reply with caption: {message_text[:20] if message_text else 'No caption'}")
-    elif message.audio:
-        media_type = "audio"
-        media_file_id = message.audio.file_id
-        message_text = message.caption
-        logger.info(f"Staff sent audio reply with caption: {message_text[:20] if message_text else 'No caption'}")
-    elif message.voice:
-        media_type = "voice"
-        media_file_id = message.voice.file_id
-        message_text = message.caption
-        logger.info(f"Staff sent voice reply with caption: {message_text[:20] if message_text else 'No caption'}")
-
-    found_user_id = None
+    found_user_id = resolve_discussion_ticket(message)
     original_user_message_id = None
 
-    for user_id, data in tracking_data.items():
-        if data.get("discussion_message_id") == replied_msg_id:
-            found_user_id = user_id
-            logger.info(f"Found user {user_id} - replying to original discussion message")
-            break
-
-    if not found_user_id:
-        for user_id, messages in conversations_data.items():
-            for msg in messages:
-                if msg.get("discussion_message_id") == replied_msg_id:
-                    found_user_id = user_id
-                    original_user_message_id = msg.get("message_id")
-                    logger.info(f"Found user {user_id} associated with message ID {replied_msg_id}")
-                    break
-            if found_user_id:
-                break
+    replied_entry = store.get_entry_by_discussion_message(replied_msg_id)
+    if replied_entry is not None:
+        original_user_message_id = replied_entry.message_id
+        logger.info("Found user %s associated with message ID %s", found_user_id, replied_msg_id)
+    elif found_user_id:
+        logger.info("Found user %s - replying to original discussion message", found_user_id)
     
     if found_user_id:
         user_id_int = int(found_user_id)
-        logger.info(f"Staff replied to message in discussion group for user {found_user_id}")
-
-        timestamp = get_timestamp()
+        logger.info("Staff replied to message in discussion group for user %s", found_user_id)
 
-        if found_user_id in tracking_data:
-            tracking_data[found_user_id]["last_activity"] = timestamp
-            save_tracking_data(tracking_data)
-
-        if message_text:
-            reply_text = f"💬 Reply from Support Staff:\n\n{message_text}"
-        else:
-            reply_text = f"💬 Reply from Support Staff:"
-        
         try:
+            media_content = extract_media_content(message)
+            user_msg, header = await relay_message(
+                client,
+                user_id_int,
+                format_staff_relay(message_text),
+                media_type=media_type,
+                media_file_id=media_file_id,
+                media_content=media_content,
+                reply_to_message_id=original_user_message_id
+            )
             if original_user_message_id:
-                if media_type:
-                    if media_type == "photo":
-                        user_msg = await client.send_photo(
-                            user_id_int,
-                            photo=media_file_id,
-                            caption=reply_text,
-                            reply_to_message_id=original_user_message_id
-                        )
-                    elif media_type == "video":
-                        user_msg = await client.send_video(
-                            user_id_int,
-                            video=media_file_id,
-                            caption=reply_text,
-                            reply_to_message_id=original_user_message_id
-                        )
-                    elif media_type == "document":
-                        user_msg = await client.send_document(
-                            user_id_int,
-                            document=media_file_id,
-                            caption=reply_text,
-                            reply_to_message_id=original_user_message_id
-                        )
-                    elif media_type == "audio":
-                        user_msg = await client.send_audio(
-                            user_id_int,
-                            audio=media_file_id,
-                            caption=reply_text,
-                            reply_to_message_id=original_user_message_id
-                        )
-                    elif media_type == "voice":
-                        user_msg = await client.send_voice(
-                            user_id_int,
-                            voice=media_file_id,
-                            caption=reply_text,
-                            reply_to_message_id=original_user_message_id
-                        )
-                else:
-                    user_msg = await client.send_message(
-                        user_id_int, 
-                        reply_text,
-                        reply_to_message_id=original_user_message_id
-                    )
-                logger.info(f"Sent reply to user's message with ID {original_user_message_id}")
+                logger.info("Sent reply to user's message with ID %s", original_user_message_id)
             else:
-                if media_type:
-                    if media_type == "photo":
-                        user_msg = await client.send_photo(
-                            user_id_int,
-                            photo=media_file_id,
-                            caption=reply_text
-                        )
-                    elif media_type == "video":
-                        user_msg = await client.send_video(
-                            user_id_int,
-                            video=media_file_id,
-                            caption=reply_text
-                        )
-                    elif media_type == "document":
-                        user_msg = await client.send_document(
-                            user_id_int,
-                            document=media_file_id,
-                            caption=reply_text
-                        )
-                    elif media_type == "audio":
-                        user_msg = await client.send_audio(
-                            user_id_int,
-                            audio=media_file_id,
-                            caption=reply_text
-                        )
-                    elif media_type == "voice":
-                        user_msg = await client.send_voice(
-                            user_id_int,
-                            voice=media_file_id,
-                            caption=reply_text
-                        )
-                else:
-                    user_msg = await client.send_message(user_id_int, reply_text)
-                logger.info(f"Sent message to user without reply")
-
-            if found_user_id not in conversations_data:
-                conversations_data[found_user_id] = []
-                
-            conversations_data[found_user_id].append({
-                "sender": "staff",
+                logger.info("Sent message to user without reply")
+
+            store.append_message(found_user_id, ConversationEntry.from_dict({
+                "sender": Sender.STAFF,
                 "message_id": user_msg.id,
                 "text": message_text or "",
                 "media_type": media_type,
                 "media_file_id": media_file_id,
+                "media_content": media_content,
+                "header_message_id": header.id if header is not None else None,
                 "discussion_message_id": message.id,
                 "replied_to_discussion_msg_id": replied_msg_id,
-                "timestamp": message.date.timestamp(),
-                "timestamp_utc7": timestamp
-            })
-
-            save_conversations_data(conversations_data)
+                "timestamp": message.date.timestamp()
+            }))
                 
-            logger.info(f"Staff reply forwarded to user {found_user_id} - Message ID: {user_msg.id}")
+            assignments.record_response(found_user_id)
+            record_activity(client, found_user_id, "staff")
+            logger.info("Staff reply forwarded to user %s - Message ID: %s", found_user_id, user_msg.id)
 
-            await message.reply("✅ Message has been forwarded to the user.", quote=True)
+            await reply(message, "✅ Message has been forwarded to the user.", quote=True)
             return True
         except Exception as e:
-            logger.error(f"Error sending staff reply to user: {e}")
-            await message.reply(f"❌ Error sending message to the user: {e}", quote=True)
+            logger.error("Error sending staff reply to user: %s", e)
+            await reply(message, f"❌ Error sending message to the user: {e}", quote=True)
             return False
     else:
-        logger.warning(f"Could not find user associated with replied message ID {replied_msg_id}")
-        await message.reply("❓ Cannot find the user associated with this message.", quote=True)
-        return False
\ No newline at end of file
+        logger.warning("Could not find user associated with replied message ID %s", replied_msg_id)
+        await reply(message, "❓ Cannot find the user associated with this message.", quote=True)
+        return False
+
+async def process_user_edit(client, message):
+    """Mirror a user's edit of a relayed message onto its discussion group copy"""
+    user_id, entry = store.find_entry_by_private_message(message.id)
+    if entry is None or entry.sender != Sender.USER or user_id != str(message.from_user.id) or entry.deleted_at:
+        return False
+
+    _, _, new_text = extract_media(message)
+    edited_at = time.time()
+
+    if entry.media_type == MediaType.MEDIA_GROUP:
+        # The album's caption lives on its first item in the discussion group
+        new_text = new_text if message.caption else entry.text
+        discussion_msg_id = entry.discussion_message_ids[0] if entry.discussion_message_ids else None
+    else:
+        discussion_msg_id = entry.discussion_message_id
+
+    store.update_message(user_id, entry, text=new_text or "", edited_at=edited_at)
+
+    if discussion_msg_id is None:
+        logger.info("User %s edited message %s, which has no discussion group copy", user_id, message.id)
+        return True
+
+    ticket_data = store.get_ticket(user_id)
+    relayed_text = format_user_relay(message.from_user, entry.timestamp_utc7, new_text, entry.reply_to_message_id is not None)
+    edited = await edit_relayed_message(
+        client,
+        ticket_data.discussion_group_id or DISCUSSION_GROUP_ID,
+        discussion_msg_id,
+        f"{relayed_text}\n\n✏️ Edited on {format_timestamp(edited_at)}",
+        media_type=entry.media_type,
+        header_message_id=entry.header_message_id,
+        priority=PRIORITY_RELAY
+    )
+    logger.info("User %s edited message %s, discussion copy %s updated: %s", user_id, message.id, discussion_msg_id, edited)
+    return edited
+
+async def process_staff_edit(client, message):
+    """Mirror a staff member's edit of a reply onto the copy the user received"""
+    user_id = store.find_user_by_discussion_message(message.id)
+    entry = store.get_entry_by_discussion_message(message.id)
+    if entry is None or entry.sender != Sender.STAFF or entry.deleted_at or not store.has_ticket(user_id):
+        return False
+
+    _, _, new_text = extract_media(message)
+    edited_at = time.time()
+    store.update_message(user_id, entry, text=new_text or "", edited_at=edited_at)
+
+    edited = await edit_relayed_message(
+        client,
+        int(user_id),
+        entry.message_id,
+        f"{format_staff_relay(new_text)}\n\n✏️ Edited on {format_timestamp(edited_at)}",
+        media_type=entry.media_type,
+        header_message_id=entry.header_message_id
+    )
+    logger.info("Staff edited reply %s, copy %s for user %s updated: %s", message.id, entry.message_id, user_id, edited)
+    return edited
+
+def process_deleted_messages(client, messages):
+    """Queue the deletion of the counterparts of deleted messages, per ticket.
+
+    Private-chat deletions arrive without a chat, which is fine: private
+    message ids resolve to their ticket on their own. Discussion group
+    deletions only count for staff replies; removing the bot's own copy of a
+    user message there does not delete the user's original.
+    """
+    deletions = {}
+
+    for message in messages:
+        if message.chat is None or message.chat.type.name.startswith("PRIVATE"):
+            user_id, entry = store.find_entry_by_private_message(message.id)
+            if entry is not None and entry.sender == Sender.USER:
+                deletions.setdefault(user_id, []).append((entry, message.id, Sender.USER))
+        elif message.chat.id == DISCUSSION_GROUP_ID:
+            user_id = store.find_user_by_discussion_message(message.id)
+            entry = store.get_entry_by_discussion_message(message.id)
+            if entry is not None and entry.sender == Sender.STAFF:
+                deletions.setdefault(user_id, []).append((entry, message.id, Sender.STAFF))
+
+    for user_id, items in deletions.items():
+        dispatcher.submit(int(user_id), delete_counterparts, client, user_id, items)
+
+async def delete_counterparts(client, user_id, items):
+    ticket_data = store.get_ticket(user_id)
+    if ticket_data is None:
+        return
+
+    discussion_group_id = ticket_data.discussion_group_id or DISCUSSION_GROUP_ID
+    deleted_at = time.time()
+
+    for entry, message_id, sender in items:
+        if entry.deleted_at:
+            continue
+
+        if sender == Sender.USER:
+            chat_id = discussion_group_id
+            if entry.message_ids:
+                # One item of an album: delete the discussion item at the same
+                # position; the entry is deleted once every item is gone
+                index = entry.message_ids.index(message_id)
+                counterpart_ids = list(entry.discussion_message_ids or ())[index:index + 1]
+                deleted_ids = (*(entry.deleted_message_ids or ()), message_id)
+                whole_entry = set(deleted_ids) >= set(entry.message_ids)
+                if not whole_entry:
+                    store.update_message(user_id, entry, deleted_message_ids=deleted_ids)
+            else:
+                counterpart_ids = [entry.discussion_message_id] if entry.discussion_message_id else []
+                whole_entry = True
+        else:
+            chat_id = int(user_id)
+            counterpart_ids = [entry.message_id]
+            whole_entry = True
+
+        if whole_entry and entry.header_message_id is not None:
+            counterpart_ids.append(entry.header_message_id)
+
+        if whole_entry:
+            store.update_message(user_id, entry, deleted_at=deleted_at)
+
+        if counterpart_ids:
+            try:
+                await send(client.delete_messages, chat_id, counterpart_ids, priority=PRIORITY_RELAY)
+                logger.info("Deleted %s in %s after %s deleted message %s", counterpart_ids, chat_id, sender, message_id)
+            except Exception as e:
+                logger.error("Error deleting counterpart of message %s for user %s: %s", message_id, user_id, e)
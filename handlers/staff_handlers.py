@@ -1,31 +1,27 @@
+import io
 import logging
-from pyrogram.enums import ParseMode
-from config import SUPPORT_STAFF_IDS
-from utils.data_manager import load_tracking_data, save_tracking_data, load_conversations_data, save_conversations_data
-from utils.ticket_manager import close_ticket
+import time
+from config import SUPPORT_STAFF_IDS, STAFF_QUIET_MINUTES
+from utils.ticket_store import store
+from utils.utils import format_timestamp
+from utils.sender import send, reply
+from utils.archive import archive, day_range, format_transcript
+from utils.search import search_index
+from utils.topics import resolve_discussion_ticket
+from utils.utils import get_channel_message_url
+from utils.ticket_manager import (
+    close_ticket, get_user_display_name, enqueue_closure_jobs
+)
+from utils.assignment import set_staff_quiet, clear_staff_quiet, get_staff_quiet_until
 from handlers.message_handlers import process_staff_reply as handler_process_staff_reply
-from helper import logger
+from helper import get_logger
 
-async def process_staff_ticket_closure(client, message, replied_msg_id):
-    logger.info(f"Staff attempting to close ticket from message ID {replied_msg_id}")
-
-    tracking_data = load_tracking_data()
-    conversations_data = load_conversations_data()
+logger = get_logger(__name__)
 
-    found_user_id = None
-
-    for user_id, data in tracking_data.items():
-        if data.get("discussion_message_id") == replied_msg_id:
-            found_user_id = user_id
-            break
+async def process_staff_ticket_closure(client, message, replied_msg_id):
+    logger.info("Staff attempting to close ticket from message ID %s", replied_msg_id)
 
-        for msg in conversations_data.get(user_id, []):
-            if msg.get("discussion_message_id") == replied_msg_id:
-                found_user_id = user_id
-                break
-                
-        if found_user_id:
-            break
+    found_user_id = resolve_discussion_ticket(message)
     
     if not found_user_id:
         return False, "Cannot find a ticket associated with this message."
@@ -36,40 +32,23 @@ async def process_staff_ticket_closure(client, message, replied_msg_id):
         if message.from_user.username:
             staff_name += f" (@{message.from_user.username})"
 
-    user_info = None
     try:
-        user = await client.get_users(int(found_user_id))
-        user_name = f"{user.first_name}"
-        if user.username:
-            user_name += f" (@{user.username})"
-        user_info = user_name
-    except:
+        user_info = await get_user_display_name(client, found_user_id)
+    except Exception:
         user_info = f"User (ID: {found_user_id})"
 
     success, result = await close_ticket(
-        client, tracking_data, conversations_data, found_user_id, staff_name, is_staff=True
+        client, found_user_id, staff_name, is_staff=True
     )
     
     if not success:
-        logger.error(f"Error in process_staff_ticket_closure: {result}")
+        logger.error("Error in process_staff_ticket_closure: %s", result)
         return False, f"An error occurred while closing the ticket: {result}"
     
-    user_id_int = int(found_user_id)
-
     channel_url = result.get("channel_url", "")
     timestamp = result.get("timestamp", "")
     issue_type = result.get("issue_type", "").capitalize()
 
-    if found_user_id in conversations_data:
-        del conversations_data[found_user_id]
-        save_conversations_data(conversations_data)
-        logger.info(f"Removed conversation data for user {found_user_id}")
-        
-    if found_user_id in tracking_data:
-        del tracking_data[found_user_id]
-        save_tracking_data(tracking_data)
-        logger.info(f"Removed tracking data for user {found_user_id}")
-
     notification = (
         f"🔒 Your ticket has been closed by our support staff.\n\n"
         f"📝 Category: {issue_type}\n"
@@ -79,23 +58,12 @@ async def process_staff_ticket_closure(client, message, replied_msg_id):
             
     notification += "Thank you for contacting us. If you have another question, please use /create_ticket to create a new ticket."
 
-    try:
-        await client.send_message(
-            user_id_int,
-            notification,
-            disable_web_page_preview=True,
-            parse_mode=ParseMode.MARKDOWN
-        )
-        logger.info(f"Sent ticket closure notification to user {found_user_id}")
-    except Exception as e:
-        logger.error(f"Error sending closure notification to user: {e}")
-
-    staff_confirmation = f"✅ Ticket for user ID {found_user_id} has been closed."
+    staff_confirmation = f"✅ Ticket #{result['ticket_id']} of user ID {found_user_id} has been closed."
     if channel_url:
         staff_confirmation += f"\n🔗 [View Ticket]({channel_url})"
 
     staff_notification = (
-        f"🔒 TICKET CLOSED\n\n"
+        f"🔒 TICKET #{result['ticket_id']} CLOSED\n\n"
         f"👤 User: {user_info} (ID: {found_user_id})\n"
         f"📝 Category: {issue_type}\n"
         f"⏰ Closed on: {timestamp}\n"
@@ -107,22 +75,143 @@ async def process_staff_ticket_closure(client, message, replied_msg_id):
 
     closer_id = message.from_user.id if message.from_user else None
     
-    for staff_id in SUPPORT_STAFF_IDS:
-        if closer_id and staff_id == closer_id:
-            continue
-            
-        try:
-            await client.send_message(
-                staff_id,
-                staff_notification,
-                disable_web_page_preview=True,
-                parse_mode=ParseMode.MARKDOWN
-            )
-            logger.info(f"Notified support staff {staff_id} about ticket closure by staff")
-        except Exception as e:
-            logger.error(f"Failed to notify support staff {staff_id} about ticket closure: {e}")
+    enqueue_closure_jobs(
+        found_user_id, result["ticket"], staff_name, timestamp, is_staff=True,
+        user_notification=notification, staff_notification=staff_notification, exclude_id=closer_id
+    )
     
     return True, staff_confirmation
 
 async def process_staff_reply(client, message, replied_msg_id):    
-    return await handler_process_staff_reply(client, message)
\ No newline at end of file
+    return await handler_process_staff_reply(client, message)
+
+def process_staff_quiet(message):
+    """Handle /quiet [minutes|off] from a staff member. Returns the reply text"""
+    if not message.from_user or message.from_user.id not in SUPPORT_STAFF_IDS:
+        return "This command is only available to support staff."
+
+    staff_id = message.from_user.id
+    argument = message.command[1].lower() if len(message.command) > 1 else None
+
+    if argument == "off":
+        clear_staff_quiet(staff_id)
+        logger.info("Staff %s ended their quiet window", staff_id)
+        return "🔔 Notifications are back on."
+
+    if argument == "status":
+        quiet_until = get_staff_quiet_until(staff_id)
+        if quiet_until is None:
+            return "🔔 Notifications are on. Use /quiet [minutes] to mute them."
+        return f"🔕 Notifications are muted until {format_timestamp(quiet_until)}."
+
+    try:
+        minutes = int(argument) if argument else STAFF_QUIET_MINUTES
+    except ValueError:
+        return "Usage: /quiet [minutes], /quiet off or /quiet status"
+
+    if minutes <= 0:
+        return "Usage: /quiet [minutes], /quiet off or /quiet status"
+
+    quiet_until = set_staff_quiet(staff_id, minutes)
+    logger.info("Staff %s muted notifications for %s minutes", staff_id, minutes)
+    return f"🔕 Notifications muted until {format_timestamp(quiet_until)}. Use /quiet off to turn them back on."
+
+HISTORY_USAGE = (
+    "Usage:\n"
+    "/history <ticket id> - transcript of a closed ticket\n"
+    "/history user <user id> - closed tickets of a user\n"
+    "/history date <DD-MM-YYYY> - tickets closed on a day\n"
+    "or reply /history to a ticket message for that user's closed tickets"
+)
+
+def format_archive_rows(rows):
+    return "\n".join(
+        f"#{row['ticket_id']} · {(row['issue_type'] or 'unknown').capitalize()} · user {row['user_id']} · "
+        f"closed {format_timestamp(row['closed_at'])} by {row['closed_by']} · {row['message_count']} messages"
+        for row in rows
+    )
+
+async def process_staff_history(client, message):
+    """Handle /history: look up closed tickets in the archive"""
+    if not message.from_user or message.from_user.id not in SUPPORT_STAFF_IDS:
+        await reply(message, "This command is only available to support staff.")
+        return
+
+    arguments = message.command[1:]
+
+    if not arguments and message.reply_to_message_id:
+        user_id = resolve_discussion_ticket(message)
+        if not user_id:
+            await reply(message, "Cannot find a ticket associated with this message.")
+            return
+        arguments = ["user", user_id]
+
+    try:
+        if len(arguments) == 2 and arguments[0].lower() == "user":
+            rows = archive.find_by_user(int(arguments[1]))
+            title = f"🗄 Closed tickets of user {arguments[1]}"
+        elif len(arguments) == 2 and arguments[0].lower() == "date":
+            rows = archive.find_closed_between(*day_range(arguments[1]))
+            title = f"🗄 Tickets closed on {arguments[1]}"
+        elif len(arguments) == 1:
+            record = archive.get(int(arguments[0].lstrip("#")))
+            if record is None:
+                await reply(message, f"Ticket #{arguments[0]} is not in the archive.")
+                return
+            await send_transcript(client, message, record)
+            return
+        else:
+            await reply(message, HISTORY_USAGE)
+            return
+    except ValueError:
+        await reply(message, HISTORY_USAGE)
+        return
+
+    if not rows:
+        await reply(message, f"{title}: none found.")
+        return
+
+    await reply(message, f"{title}:\n\n{format_archive_rows(rows)}\n\nUse /history <ticket id> for a transcript.")
+
+async def send_transcript(client, message, record):
+    transcript = format_transcript(record)
+    logger.info("Staff %s fetched the transcript of ticket #%s", message.from_user.id, record['ticket'].ticket_id)
+
+    if len(transcript) <= 4000:
+        await reply(message, transcript)
+        return
+
+    document = io.BytesIO(transcript.encode())
+    document.name = f"ticket-{record['ticket'].ticket_id}.txt"
+    await send(
+        client.send_document,
+        message.chat.id,
+        document,
+        caption=f"Transcript of ticket #{record['ticket'].ticket_id}",
+        reply_to_message_id=message.id
+    )
+
+def process_staff_search(message):
+    """Handle /search <terms>. Returns the reply text"""
+    terms = " ".join(message.command[1:])
+    if not terms:
+        return "Usage: /search <words>, e.g. /search refund failed"
+
+    started = time.perf_counter()
+    results = search_index.search(terms)
+    elapsed = (time.perf_counter() - started) * 1000
+    logger.info("Search for %r returned %s tickets in %.1f ms", terms, len(results), elapsed)
+
+    if not results:
+        return f"🔎 No tickets mention \"{terms}\"."
+
+    lines = [f"🔎 Tickets mentioning \"{terms}\":"]
+    for number, result in enumerate(results, 1):
+        status = "🟢 open" if store.find_user_by_channel_message(result["channel_message_id"]) else "🗄 closed"
+        lines.append(
+            f"\n{number}. #{result['ticket_id']} · {(result['issue_type'] or 'unknown').capitalize()} · "
+            f"{status} · {result['hits']} matching message(s)\n"
+            f"“{result['snippet']}”\n"
+            f"{get_channel_message_url(result['channel_id'], result['channel_message_id'])}"
+        )
+    return "\n".join(lines)
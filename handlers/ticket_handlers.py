@@ -1,139 +1,165 @@
 import logging
-from pyrogram.enums import ParseMode
-from config import SUPPORT_CHANNEL_ID, SUPPORT_STAFF_IDS
-from utils.data_manager import load_tracking_data, save_tracking_data, load_conversations_data, save_conversations_data
+import time
+from config import SUPPORT_CHANNEL_ID, DISCUSSION_GROUP_ID, DESCRIPTION_TIMEOUT
+from utils.ticket_store import store
+from utils.sender import send, PRIORITY_RELAY
+from utils.media import CAPTIONED_MEDIA, extract_media, extract_media_content, describe_media, relay_message
 from utils.utils import get_timestamp, get_channel_message_url
-from utils.ticket_manager import notify_support_staff_about_new_ticket, close_ticket
-from helper import logger
+from utils.ticket_manager import (
+    close_ticket, remember_user, enqueue_closure_jobs
+)
+from utils.outbox import outbox
+from utils.assignment import assignments
+from utils.sla import record_activity
+from utils.models import Ticket, ConversationEntry, Sender
+from utils.timers import timers
+from utils.topics import topics_enabled, create_ticket_topic, format_topic_title
+from helper import get_logger
+
+logger = get_logger(__name__)
+
+AWAITING_DESCRIPTION = "awaiting_description:"
+
+def await_ticket_description(client, user_id, issue_type):
+    """Treat the user's next private message as the description of a new ticket"""
+    expires_at = time.time() + DESCRIPTION_TIMEOUT
+    store.set_state(user_id, f"{AWAITING_DESCRIPTION}{issue_type}", expires_at)
+    timers.schedule(("description", str(user_id)), expires_at, expire_ticket_description, client, user_id)
+
+def pending_ticket_category(user_id):
+    """Return the category the user is describing a ticket for, or None"""
+    state = store.get_state(user_id)
+    if state and state.startswith(AWAITING_DESCRIPTION):
+        return state[len(AWAITING_DESCRIPTION):]
+    return None
+
+def clear_ticket_description(user_id):
+    store.clear_state(user_id)
+    timers.cancel(("description", str(user_id)))
+
+async def expire_ticket_description(client, user_id):
+    store.clear_state(user_id)
+    logger.info("Ticket description from user %s timed out", user_id)
+    await send(
+        client.send_message,
+        int(user_id),
+        "You did not provide a description within the time limit. Please use /create_ticket to start again."
+    )
 
-async def process_issue_selection(client, user_id, issue_type, description, callback_query):
-    logger.info(f"Processing issue selection for user {user_id}, type: {issue_type}")
+def restore_description_timers(client):
+    """Re-arm expiry timers for description waits persisted before a restart"""
+    for user_id, state in list(store.states.items()):
+        if state["state"].startswith(AWAITING_DESCRIPTION):
+            expires_at = state.get("expires_at") or time.time()
+            timers.schedule(("description", user_id), expires_at, expire_ticket_description, client, user_id)
 
-    tracking_data = load_tracking_data()
-    conversations_data = load_conversations_data()
+async def process_issue_selection(client, user_id, issue_type, description):
+    logger.info("Processing issue selection for user %s, type: %s", user_id, issue_type)
 
-    if str(user_id) not in conversations_data:
-        conversations_data[str(user_id)] = []
+    media_type, media_file_id, description_text = extract_media(description)
+    media_content = extract_media_content(description)
 
-    media_type = None
-    media_file_id = None
-    caption = None
-    description_text = None
-    
-    if description.text:
-        logger.info(f"User {user_id} provided text description: {description.text[:20]}...")
-        description_text = description.text
-    elif description.photo:
-        media_type = "photo"
-        media_file_id = description.photo.file_id
-        caption = description.caption
-        logger.info(f"User {user_id} provided photo description with caption: {caption[:20] if caption else 'No caption'}")
-    elif description.video:
-        media_type = "video"
-        media_file_id = description.video.file_id
-        caption = description.caption
-        logger.info(f"User {user_id} provided video description with caption: {caption[:20] if caption else 'No caption'}")
-    elif description.document:
-        media_type = "document"
-        media_file_id = description.document.file_id
-        caption = description.caption
-        logger.info(f"User {user_id} provided document description with caption: {caption[:20] if caption else 'No caption'}")
-    elif description.audio:
-        media_type = "audio"
-        media_file_id = description.audio.file_id
-        caption = description.caption
-        logger.info(f"User {user_id} provided audio description with caption: {caption[:20] if caption else 'No caption'}")
-    elif description.voice:
-        media_type = "voice"
-        media_file_id = description.voice.file_id
-        caption = description.caption
-        logger.info(f"User {user_id} provided voice description with caption: {caption[:20] if caption else 'No caption'}")
-    else:
-        logger.warning(f"User {user_id} provided an unsupported message type")
+    if description_text is None and media_type is None:
+        logger.warning("User %s provided an unsupported message type", user_id)
         return False, "Please provide either text or media content for your ticket."
 
+    logger.info("User %s provided %s as description", user_id, describe_media(media_type, description_text))
+
     timestamp = get_timestamp()
+    ticket_number = store.allocate_ticket_number()
 
     ticket_info = (
-        f"🎫 NEW TICKET #{user_id}\n"
-        f"👤 User: {callback_query.from_user.first_name} (@{callback_query.from_user.username or 'N/A'})\n"
+        f"🎫 NEW TICKET #{ticket_number}\n"
+        f"👤 User: {description.from_user.first_name} (@{description.from_user.username or 'N/A'}, ID: {user_id})\n"
         f"📝 Category: {issue_type.capitalize()}\n"
         f"⏰ Time: {timestamp}\n"
     )
     
-    if description_text:
+    if media_type is None:
         ticket_info += f"🔍 Message:\n{description_text}"
-    elif caption:
-        ticket_info += f"🔍 Message:\n{caption}\n\n(Media attached)"
-    else:
+    elif description_text:
+        ticket_info += f"🔍 Message:\n{description_text}\n\n(Media attached)"
+    elif media_type in CAPTIONED_MEDIA:
         ticket_info += "🔍 Message: (Media without text)"
+    else:
+        ticket_info += f"🔍 Message: ({media_type.replace('_', ' ')} in the discussion thread)"
 
     try:
-        if media_type:
-            if media_type == "photo":
-                channel_message = await client.send_photo(
-                    SUPPORT_CHANNEL_ID,
-                    photo=media_file_id,
-                    caption=ticket_info
-                )
-            elif media_type == "video":
-                channel_message = await client.send_video(
-                    SUPPORT_CHANNEL_ID,
-                    video=media_file_id,
-                    caption=ticket_info
-                )
-            elif media_type == "document":
-                channel_message = await client.send_document(
-                    SUPPORT_CHANNEL_ID,
-                    document=media_file_id,
-                    caption=ticket_info
-                )
-            elif media_type == "audio":
-                channel_message = await client.send_audio(
-                    SUPPORT_CHANNEL_ID,
-                    audio=media_file_id,
-                    caption=ticket_info
-                )
-            elif media_type == "voice":
-                channel_message = await client.send_voice(
-                    SUPPORT_CHANNEL_ID,
-                    voice=media_file_id,
-                    caption=ticket_info
-                )
-        else:
-            channel_message = await client.send_message(SUPPORT_CHANNEL_ID, ticket_info)
-
-        channel_message_url = get_channel_message_url(SUPPORT_CHANNEL_ID, channel_message.id)
-
-        tracking_data[str(user_id)] = {
-            "channel_id": SUPPORT_CHANNEL_ID,
+        # Media that cannot carry the ticket header is posted to the discussion
+        # thread once the channel post has been forwarded there
+        channel_media_type = media_type if media_type in CAPTIONED_MEDIA else None
+
+        user_name = remember_user(description.from_user)
+
+        # In topics mode the ticket post opens the ticket's own forum topic and
+        # stands in for the channel post; there is no forward to wait for
+        topic_id = None
+        ticket_chat_id = SUPPORT_CHANNEL_ID
+        if topics_enabled():
+            topic_id = await create_ticket_topic(client, format_topic_title(ticket_number, user_name, issue_type))
+            ticket_chat_id = DISCUSSION_GROUP_ID
+
+        channel_message, _ = await relay_message(
+            client,
+            ticket_chat_id,
+            ticket_info,
+            media_type=channel_media_type,
+            media_file_id=media_file_id,
+            reply_to_message_id=topic_id,
+            priority=PRIORITY_RELAY
+        )
+
+        topic_fields = {}
+        if topic_id is not None:
+            topic_fields = {
+                "topic_id": topic_id,
+                "discussion_group_id": DISCUSSION_GROUP_ID,
+                "discussion_message_id": channel_message.id
+            }
+
+        channel_message_url = get_channel_message_url(ticket_chat_id, channel_message.id)
+        assignment = assignments.assign(user_id, issue_type)
+
+        store.create_ticket(user_id, Ticket.from_dict({
+            "channel_id": ticket_chat_id,
             "channel_message_id": channel_message.id,
-            "channel_message_url": channel_message_url,
             "user_id": user_id,
+            "ticket_number": ticket_number,
             "issue_type": issue_type,
-            "status": "pending_discussion_forward",
+            "status": "pending_discussion_forward" if topic_id is None else "forwarded_to_discussion",
             "timestamp": channel_message.date.timestamp(),
-            "timestamp_utc7": timestamp,
-            "media_type": media_type, 
-            "last_activity": timestamp
-        }
-
-        conversations_data[str(user_id)].append({
-            "sender": "user",
+            "media_type": media_type,
+            "channel_text": ticket_info,
+            "user_name": user_name,
+            "last_activity_at": time.time(),
+            "pending_media_message_id": description.id if media_type and not channel_media_type else None,
+            **topic_fields,
+            **assignment
+        }), first_entry=ConversationEntry.from_dict({
+            "sender": Sender.USER,
             "message_id": description.id,
-            "text": description_text or caption or "",
+            "text": description_text or "",
             "media_type": media_type,
             "media_file_id": media_file_id,
-            "timestamp": description.date.timestamp(),
-            "timestamp_utc7": timestamp
-        })
-
-        save_tracking_data(tracking_data)
-
-        save_conversations_data(conversations_data)
+            "media_content": media_content,
+            "timestamp": description.date.timestamp()
+        }))
         
-        logger.info(f"Ticket for user {user_id} created and forwarded to channel - Message ID: {channel_message.id}")
-        logger.info(f"Channel message URL: {channel_message_url}")
+        record_activity(client, user_id, "user")
+
+        if topic_id is not None and media_type and not channel_media_type:
+            outbox.enqueue("relay_ticket_media", {
+                "user_id": user_id,
+                "message_id": description.id,
+                "media_type": media_type,
+                "media_file_id": media_file_id,
+                "media_content": media_content,
+                "discussion_group_id": DISCUSSION_GROUP_ID,
+                "discussion_message_id": channel_message.id
+            }, key=user_id)
+
+        logger.info("Ticket for user %s created and posted to %s - Message ID: %s", user_id, ticket_chat_id, channel_message.id)
+        logger.info("Channel message URL: %s", channel_message_url)
 
         response_message = (
             "🎫 Your ticket has been created and forwarded to our support team.\n"
@@ -141,52 +167,36 @@ async def process_issue_selection(client, user_id, issue_type, description, call
             "You can close this ticket at any time with /close_ticket"
         )
 
-        user_name = f"{callback_query.from_user.first_name}"
-        if callback_query.from_user.username:
-            user_name += f" (@{callback_query.from_user.username})"
-
-        await notify_support_staff_about_new_ticket(
-            client, 
-            user_id, 
-            user_name, 
-            issue_type, 
-            timestamp, 
-            description_text or caption or "", 
-            channel_message_url
-        )
+        outbox.enqueue("notify_new_ticket", {
+            "user_id": user_id,
+            "ticket_id": ticket_number,
+            "user_name": user_name,
+            "issue_type": issue_type,
+            "timestamp": timestamp,
+            "description_text": description_text or "",
+            "channel_url": channel_message_url,
+            "assigned_staff_id": assignment.get("assigned_staff_id")
+        }, key=user_id)
         
         return True, response_message
     except Exception as e:
-        logger.error(f"Error creating ticket: {e}")
+        logger.error("Error creating ticket: %s", e)
         return False, f"Error creating your ticket: {e}"
 
 async def process_user_ticket_closure(client, user_id, message):
     """Process ticket closure initiated by a user"""
-    logger.info(f"Processing ticket closure by user {user_id}")
-
-    tracking_data = load_tracking_data()
-    conversations_data = load_conversations_data()
+    logger.info("Processing ticket closure by user %s", user_id)
 
-    if str(user_id) not in tracking_data:
+    if not store.has_ticket(user_id):
         return False, "You don't have an open ticket."
 
     user_name = f"{message.from_user.first_name}"
     if message.from_user.username:
         user_name += f" (@{message.from_user.username})"
 
-    success, result = await close_ticket(client, tracking_data, conversations_data, user_id, user_name, is_staff=False)
+    success, result = await close_ticket(client, user_id, user_name, is_staff=False)
     
     if success:
-        if str(user_id) in conversations_data:
-            del conversations_data[str(user_id)]
-            save_conversations_data(conversations_data)
-            logger.info(f"Removed conversation data for user {user_id}")
-            
-        if str(user_id) in tracking_data:
-            del tracking_data[str(user_id)]
-            save_tracking_data(tracking_data)
-            logger.info(f"Removed tracking data for user {user_id}")
-        
         # Create detailed notification
         channel_url = result.get("channel_url", "")
         timestamp = result.get("timestamp", "")
@@ -203,7 +213,7 @@ async def process_user_ticket_closure(client, user_id, message):
         notification += "Thank you for contacting us. If you have another question, please use /create_ticket to create a new ticket."
 
         staff_notification = (
-            f"🔒 TICKET CLOSED\n\n"
+            f"🔒 TICKET #{result['ticket_id']} CLOSED\n\n"
             f"👤 User: {user_name} (ID: {user_id})\n"
             f"📝 Category: {issue_type}\n"
             f"⏰ Closed on: {timestamp}\n"
@@ -213,19 +223,11 @@ async def process_user_ticket_closure(client, user_id, message):
         if channel_url:
             staff_notification += f"🔗 [View Ticket]({channel_url})"
 
-        for staff_id in SUPPORT_STAFF_IDS:
-            try:
-                await client.send_message(
-                    staff_id,
-                    staff_notification,
-                    disable_web_page_preview=True,
-                    parse_mode=ParseMode.MARKDOWN
-                )
-                logger.info(f"Notified support staff {staff_id} about ticket closure by user")
-            except Exception as e:
-                logger.error(f"Failed to notify support staff {staff_id} about ticket closure: {e}")
+        enqueue_closure_jobs(
+            user_id, result["ticket"], user_name, timestamp, is_staff=False, staff_notification=staff_notification
+        )
                 
         return True, notification
     else:
-        logger.error(f"Error in process_user_ticket_closure: {result}")
+        logger.error("Error in process_user_ticket_closure: %s", result)
         return False, "An error occurred while closing the ticket. Please try again later or contact an administrator."
\ No newline at end of file
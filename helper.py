@@ -1,4 +1,123 @@
+import atexit
+import contextvars
+import json
 import logging
+import logging.handlers
+import queue
+import re
+import sys
+import warnings
+from config import LOG_LEVEL, LOG_LEVELS, LOG_FORMAT
 
-logger = logging.getLogger(__name__)
-logger.setLevel(logging.CRITICAL)
\ No newline at end of file
+ROOT_LOGGER = "support_bot"
+
+# Fields attached to every record logged while they are set: the dispatcher
+# sets handler and user_id around each job, ticket_id is resolved from user_id
+log_context = contextvars.ContextVar("log_context", default=None)
+CONTEXT_FIELDS = ("ticket_id", "user_id", "handler")
+
+_ticket_resolver = None
+
+def get_logger(name):
+    """Logger for a module, below the bot's root logger so LOG_LEVELS can
+    address it by module path (e.g. utils.sender)"""
+    if name == "__main__":
+        name = "main"
+    return logging.getLogger(f"{ROOT_LOGGER}.{name}")
+
+def set_ticket_resolver(func):
+    """func(user_id) -> ticket id or None, used to fill ticket_id in log records"""
+    global _ticket_resolver
+    _ticket_resolver = func
+
+LEVEL_NAMES = ("DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL")
+MODULE_PATTERN = re.compile(r"[A-Za-z_]\w*(\.[A-Za-z_]\w*)*")
+
+def parse_levels(spec):
+    """"utils.sender=DEBUG,handlers=INFO" -> {"utils.sender": "DEBUG", "handlers": "INFO"}.
+    Entries without a valid module path and level name are skipped with a warning"""
+    levels = {}
+    if spec.lstrip().startswith("#"):
+        # An inline comment that dotenv read as the value
+        warnings.warn(f"Ignoring LOG_LEVELS {spec!r}: put comments on their own line")
+        return levels
+
+    for item in spec.split(","):
+        if not item.strip():
+            continue
+        name, _, level = item.partition("=")
+        name, level = name.strip(), level.strip().upper()
+        if MODULE_PATTERN.fullmatch(name) and level in LEVEL_NAMES:
+            levels[name] = level
+        else:
+            warnings.warn(f"Ignoring invalid LOG_LEVELS entry {item.strip()!r}")
+    return levels
+
+class ContextFilter(logging.Filter):
+    """Copies the current log context onto the record. Filters only run for
+    records that passed the level check, so disabled levels never get here"""
+
+    def filter(self, record):
+        context = log_context.get() or {}
+        for field in CONTEXT_FIELDS:
+            setattr(record, field, context.get(field))
+
+        if record.ticket_id is None and record.user_id is not None and _ticket_resolver is not None:
+            record.ticket_id = _ticket_resolver(record.user_id)
+        return True
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line"""
+
+    def format(self, record):
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name.removeprefix(f"{ROOT_LOGGER}."),
+            "msg": record.getMessage()
+        }
+        for field in CONTEXT_FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+class TextFormatter(logging.Formatter):
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)s %(name)s%(context)s: %(message)s")
+
+    def format(self, record):
+        fields = [f"{field}={getattr(record, field)}" for field in CONTEXT_FIELDS if getattr(record, field, None) is not None]
+        record.context = f" [{' '.join(fields)}]" if fields else ""
+        return super().format(record)
+
+def setup_logging(log_format=LOG_FORMAT, stream=None):
+    """Send the bot's log records through a queue to a listener thread that
+    formats and writes them, so the event loop only pays for enqueueing.
+    Returns the listener; it is stopped (and the queue drained) at exit"""
+    formatter = JsonFormatter() if log_format == "json" else TextFormatter()
+    output = logging.StreamHandler(stream or sys.stderr)
+    output.setFormatter(formatter)
+
+    records = queue.SimpleQueue()
+    queue_handler = logging.handlers.QueueHandler(records)
+    queue_handler.addFilter(ContextFilter())
+
+    logger.handlers = [queue_handler]
+    logger.propagate = False
+
+    listener = logging.handlers.QueueListener(records, output)
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
+
+logger = logging.getLogger(ROOT_LOGGER)
+if LOG_LEVEL.upper() in LEVEL_NAMES:
+    logger.setLevel(LOG_LEVEL.upper())
+else:
+    warnings.warn(f"Ignoring invalid LOG_LEVEL {LOG_LEVEL!r}, using CRITICAL")
+    logger.setLevel(logging.CRITICAL)
+for module, level in parse_levels(LOG_LEVELS).items():
+    get_logger(module).setLevel(level)
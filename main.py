@@ -4,16 +4,37 @@
 # Description: Telegram Bot Support With Media Compatible
 
 
-from pyromod import listen
 from pyrogram import Client, filters, idle
 from pyrogram.enums import ParseMode
-from pyrogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+from pyrogram.types import InlineKeyboardMarkup, InlineKeyboardButton, CallbackQuery
 
 from config import API_ID, API_HASH, BOT_TOKEN, SUPPORT_CHANNEL_ID, DISCUSSION_GROUP_ID
-from handlers.ticket_handlers import process_issue_selection, process_user_ticket_closure
-from handlers.staff_handlers import process_staff_ticket_closure, process_staff_reply
-from handlers.message_handlers import process_forwarded_message, process_user_message
-from helper import logger
+from handlers.ticket_handlers import (
+    process_issue_selection, process_user_ticket_closure, await_ticket_description,
+    pending_ticket_category, clear_ticket_description, restore_description_timers
+)
+from handlers.staff_handlers import (
+    process_staff_ticket_closure, process_staff_reply, process_staff_quiet, process_staff_history,
+    process_staff_search
+)
+from handlers.message_handlers import (
+    process_forwarded_message, process_user_message, process_user_edit, process_staff_edit, process_deleted_messages
+)
+from utils.ticket_store import store
+from utils.sender import send, reply
+from utils.outbox import outbox
+from utils.timers import timers
+from utils.dispatcher import dispatcher
+from utils.assignment import assignments
+from utils.sla import restore_ticket_timers
+from utils.ticket_manager import restore_notification_digests
+from utils.archive import archive
+from utils.search import search_index
+from utils.topics import resolve_discussion_ticket
+from utils.health import health
+from helper import get_logger, setup_logging
+
+logger = get_logger(__name__)
 
 app = Client(
     "sessions/Support_HyperBot",
@@ -22,9 +43,27 @@ app = Client(
     bot_token=BOT_TOKEN
 )
 
+def ticket_key(update):
+    """Dispatcher key: the user id of the ticket an update belongs to"""
+    if isinstance(update, CallbackQuery):
+        return update.from_user.id
+
+    message = update
+    if message.chat.type.name.startswith("PRIVATE"):
+        return message.from_user.id
+
+    user_id = None
+    if message.forward_from_chat and message.forward_from_chat.id == SUPPORT_CHANNEL_ID:
+        user_id = store.find_user_by_channel_message(message.forward_from_message_id)
+    elif message.reply_to_message_id:
+        user_id = resolve_discussion_ticket(message)
+
+    return int(user_id) if user_id else message.chat.id
+
 @app.on_message(filters.command("start"))
+@dispatcher.serialized(ticket_key)
 async def start_command(client, message):
-    logger.info(f"User {message.from_user.id} started the bot")
+    logger.info("User %s started the bot", message.from_user.id)
     
     keyboard = InlineKeyboardMarkup(
         [
@@ -35,7 +74,8 @@ async def start_command(client, message):
         ]
     )
     
-    await message.reply(
+    await reply(
+        message,
         "👋 Hello! I am a Support Bot. How can I help you today?\n\n"
         "Use /create_ticket to open a new support ticket\n"
         "Use /close_ticket to close an existing ticket",
@@ -43,15 +83,13 @@ async def start_command(client, message):
     )
 
 @app.on_message(filters.command("create_ticket"))
+@dispatcher.serialized(ticket_key)
 async def create_ticket_command(client, message):
     user_id = message.from_user.id
-    logger.info(f"User {user_id} is creating a ticket")
+    logger.info("User %s is creating a ticket", user_id)
 
-    from utils.data_manager import load_tracking_data
-    tracking_data = load_tracking_data()
-    
-    if str(user_id) in tracking_data:
-        await message.reply("You already have an open ticket! Please close it with /close_ticket first")
+    if store.has_ticket(user_id):
+        await reply(message, "You already have an open ticket! Please close it with /close_ticket first")
         return
     
     keyboard = InlineKeyboardMarkup([
@@ -61,71 +99,90 @@ async def create_ticket_command(client, message):
         [InlineKeyboardButton("General Question", callback_data="issue_general")]
     ])
     
-    await message.reply(
+    await reply(
+        message,
         "Please select the category that best matches your issue:",
         reply_markup=keyboard
     )
 
 @app.on_callback_query(filters.regex(r"^issue_(.+)$"))
+@dispatcher.serialized(ticket_key)
 async def handle_issue_selection(client, callback_query):
     user_id = callback_query.from_user.id
     issue_type = callback_query.data.split("_")[1]
     
-    logger.info(f"User {user_id} selected issue type: {issue_type}")
+    logger.info("User %s selected issue type: %s", user_id, issue_type)
     
-    await callback_query.message.delete()
-    await callback_query.message.reply(
+    await send(client.delete_messages, callback_query.message.chat.id, callback_query.message.id)
+    await reply(
+        callback_query.message,
         f"You have selected: {issue_type.capitalize()}\n\n"
-        "Please describe your issue in detail: (You can send text, photo, video, or document)"
+        "Please describe your issue in detail: (You can send text or any kind of media)"
     )
 
-    try:
-        description = await client.listen(user_id, timeout=300)
-        
-        success, message = await process_issue_selection(client, user_id, issue_type, description, callback_query)
-        
-        if success:
-            await description.reply(message)
-        else:
-            await callback_query.message.reply(
-                f"❌ {message}\n"
-                "Please try again later or contact an administrator."
-            )
-        
-    except TimeoutError:
-
-        await callback_query.message.reply(
-            "You did not provide a description within the time limit. Please use /create_ticket to start again."
+    await_ticket_description(client, user_id, issue_type)
+
+async def handle_ticket_description(client, message, issue_type):
+    user_id = message.from_user.id
+    clear_ticket_description(user_id)
+
+    success, result_message = await process_issue_selection(client, user_id, issue_type, message)
+
+    if success:
+        await reply(message, result_message)
+    else:
+        await reply(
+            message,
+            f"❌ {result_message}\n"
+            "Please try again later or contact an administrator."
         )
 
 @app.on_message(filters.command("close_ticket"))
+@dispatcher.serialized(ticket_key)
 async def close_ticket_command(client, message):
     is_from_group = not message.chat.type.name.startswith("PRIVATE")
     
     if is_from_group:
-        if not message.reply_to_message:
-            await message.reply("This command must be used as a reply to a message from the ticket you want to close.")
+        if not message.reply_to_message_id:
+            await reply(message, "This command must be used as a reply to a message from the ticket you want to close.")
             return
 
         await staff_close_ticket(client, message)
         return
 
     user_id = message.from_user.id
-    logger.info(f"User {user_id} is trying to close their ticket")
+    logger.info("User %s is trying to close their ticket", user_id)
 
     success, result_message = await process_user_ticket_closure(client, user_id, message)
     
     if success:
-        await message.reply(
+        await reply(
+            message,
             result_message,
             disable_web_page_preview=True,
             parse_mode=ParseMode.MARKDOWN
         )
     else:
-        logger.error(f"Error in close_ticket_command: {result_message}")
-        await message.reply(result_message)
+        logger.error("Error in close_ticket_command: %s", result_message)
+        await reply(message, result_message)
+
+@app.on_message(filters.command("quiet"))
+@dispatcher.serialized(ticket_key)
+async def quiet_command(client, message):
+    await reply(message, process_staff_quiet(message))
+
+@app.on_message(filters.command("history"))
+@dispatcher.serialized(ticket_key)
+async def history_command(client, message):
+    await process_staff_history(client, message)
+
+@app.on_message(filters.chat(DISCUSSION_GROUP_ID) & filters.command("search"))
+@dispatcher.serialized(ticket_key)
+async def search_command(client, message):
+    await reply(message, process_staff_search(message), disable_web_page_preview=True)
 
 @app.on_message(filters.chat(DISCUSSION_GROUP_ID) & filters.forwarded)
+@dispatcher.serialized(ticket_key)
 async def handle_forwarded_message(client, message):
     if message.forward_from_chat and message.forward_from_chat.id == SUPPORT_CHANNEL_ID:
         await process_forwarded_message(
@@ -136,41 +193,85 @@ async def handle_forwarded_message(client, message):
         )
 
 @app.on_message(filters.chat(DISCUSSION_GROUP_ID) & filters.command("close"))
+@dispatcher.serialized(ticket_key)
 async def staff_close_ticket(client, message):
-    if not message.reply_to_message:
-        await message.reply("This command must be used as a reply to a message from the ticket you want to close.")
+    if not message.reply_to_message_id:
+        await reply(message, "This command must be used as a reply to a message from the ticket you want to close.")
         return
     
-    replied_msg_id = message.reply_to_message.id
+    replied_msg_id = message.reply_to_message_id
 
     success, result_message = await process_staff_ticket_closure(client, message, replied_msg_id)
     
     if success:
-        await message.reply(
+        await reply(
+            message,
             result_message,
             disable_web_page_preview=True,
             parse_mode=ParseMode.MARKDOWN
         )
     else:
-        await message.reply(result_message)
+        await reply(message, result_message)
 
 @app.on_message(filters.chat(DISCUSSION_GROUP_ID) & filters.reply)
+@dispatcher.serialized(ticket_key)
 async def handle_discussion_reply(client, message):
     if message.text and message.text.startswith('/'):
         return
-    await process_staff_reply(client, message, message.reply_to_message.id)
+    await process_staff_reply(client, message, message.reply_to_message_id)
 
 @app.on_message(filters.private)
+@dispatcher.serialized(ticket_key)
 async def handle_user_message(client, message):
+    issue_type = pending_ticket_category(message.from_user.id)
+    if issue_type:
+        await handle_ticket_description(client, message, issue_type)
+        return
+
     is_reply = message.reply_to_message is not None
 
     await process_user_message(client, message, is_reply)
 
+@app.on_edited_message(filters.private)
+@dispatcher.serialized(ticket_key)
+async def handle_user_edit(client, message):
+    await process_user_edit(client, message)
+
+@app.on_edited_message(filters.chat(DISCUSSION_GROUP_ID))
+@dispatcher.serialized(ticket_key)
+async def handle_staff_edit(client, message):
+    await process_staff_edit(client, message)
+
+@app.on_deleted_messages()
+async def handle_deleted_messages(client, messages):
+    process_deleted_messages(client, messages)
+
+async def main():
+    await health.start(app)
+    store.load()
+    search_index.start(store.conversations, store.tracking, archive)
+    assignments.start()
+    await app.start()
+    outbox.start(app)
+    restore_description_timers(app)
+    restore_ticket_timers(app)
+    restore_notification_digests()
+    health.ready = True
+    logger.critical("Bot is running. Press Ctrl+C to stop.")
+    await idle()
+    health.ready = False
+    timers.stop()
+    await dispatcher.stop()
+    await outbox.stop()
+    await app.stop()
+    store.close()
+    archive.close()
+    search_index.close()
+    await health.stop()
+
 if __name__ == "__main__":
+    setup_logging()
     logger.critical("Starting the Support Bot...")
     logger.critical("Repository: https://github.com/Farhanachyar/Telegram-Bot-Support")
     logger.critical("Developer: https://github.com/Farhanachyar")
-    app.start()
-    logger.critical("Bot is running. Press Ctrl+C to stop.")
-    idle()
-    app.stop()
\ No newline at end of file
+    app.run(main())
\ No newline at end of file
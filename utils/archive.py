@@ -0,0 +1,196 @@
+import gzip
+import os
+import sqlite3
+import time
+from datetime import datetime
+from config import ARCHIVE_DIR, ARCHIVE_SEGMENT_SIZE
+from utils.codec import JsonCodec
+from utils.models import Ticket, ConversationEntry, Sender
+from utils.utils import UTC7, format_timestamp
+from helper import get_logger
+
+logger = get_logger(__name__)
+
+SEGMENT_PREFIX = "segment-"
+
+ARCHIVE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS tickets (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    ticket_id INTEGER,
+    user_id TEXT NOT NULL,
+    issue_type TEXT,
+    opened_at INTEGER,
+    closed_at INTEGER NOT NULL,
+    closed_by TEXT,
+    message_count INTEGER NOT NULL,
+    segment INTEGER NOT NULL,
+    offset INTEGER NOT NULL,
+    length INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_archive_ticket ON tickets (ticket_id);
+CREATE INDEX IF NOT EXISTS idx_archive_user ON tickets (user_id, closed_at);
+CREATE INDEX IF NOT EXISTS idx_archive_closed ON tickets (closed_at);
+"""
+
+INDEX_COLUMNS = "id, ticket_id, user_id, issue_type, opened_at, closed_at, closed_by, message_count, segment, offset, length"
+
+class TicketArchive:
+    """Append-only, compressed history of closed tickets.
+
+    Each closed ticket (record plus transcript) is one gzip member appended
+    to the active segment file; concatenated members are still a valid gzip
+    stream, so a segment can be inspected with zcat. A SQLite index maps the
+    ticket id (its allocated ticket number, or the channel message id for
+    tickets opened before numbering), user id and close date to the
+    member's segment, offset and length, so fetching one transcript is a
+    single seek and read no matter how large the archive grows. Segments
+    roll over once they reach ARCHIVE_SEGMENT_SIZE bytes.
+    """
+
+    def __init__(self, directory=ARCHIVE_DIR, segment_size=ARCHIVE_SEGMENT_SIZE):
+        self.directory = directory
+        self.segment_size = segment_size
+        self.codec = JsonCodec()
+        self._conn = None
+        self._file = None
+        self._segment = None
+
+    @property
+    def conn(self):
+        if self._conn is None:
+            os.makedirs(self.directory, exist_ok=True)
+            self._conn = sqlite3.connect(os.path.join(self.directory, "index.db"))
+            self._conn.row_factory = sqlite3.Row
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript(ARCHIVE_SCHEMA)
+        return self._conn
+
+    def _segment_path(self, number):
+        return os.path.join(self.directory, f"{SEGMENT_PREFIX}{number:06d}.gz")
+
+    def _active_segment(self):
+        if self._file is None:
+            os.makedirs(self.directory, exist_ok=True)
+            numbers = [
+                int(name[len(SEGMENT_PREFIX):-len(".gz")])
+                for name in os.listdir(self.directory)
+                if name.startswith(SEGMENT_PREFIX) and name.endswith(".gz")
+            ]
+            self._segment = max(numbers, default=1)
+            self._file = open(self._segment_path(self._segment), "ab")
+
+        if self._file.tell() >= self.segment_size:
+            self._file.close()
+            self._segment += 1
+            self._file = open(self._segment_path(self._segment), "ab")
+
+        return self._file
+
+    def append(self, user_id, ticket, conversation, closed_by=None, closed_at=None):
+        """Archive a closed ticket. Returns its archive row id"""
+        closed_at = int(closed_at or time.time())
+        record = {
+            "user_id": str(user_id),
+            "closed_at": closed_at,
+            "closed_by": closed_by,
+            "ticket": ticket,
+            "conversation": conversation or []
+        }
+        member = gzip.compress(self.codec.dumps(record), compresslevel=6)
+
+        # The member is on disk before the index points at it; a crash in
+        # between leaves an unreferenced member, never a dangling index row
+        f = self._active_segment()
+        offset = f.tell()
+        f.write(member)
+        f.flush()
+        os.fsync(f.fileno())
+
+        with self.conn:
+            cursor = self.conn.execute(
+                f"INSERT INTO tickets ({INDEX_COLUMNS}) VALUES (NULL, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    ticket.ticket_id, str(user_id), ticket.issue_type, ticket.timestamp,
+                    closed_at, closed_by, len(record["conversation"]), self._segment, offset, len(member)
+                )
+            )
+
+        logger.info("Archived ticket %s of user %s (%s bytes)", ticket.ticket_id, user_id, len(member))
+        return cursor.lastrowid
+
+    def lookup(self, ticket_id):
+        """Index row of the most recent archived ticket with this ticket id, or None"""
+        return self.conn.execute(
+            f"SELECT {INDEX_COLUMNS} FROM tickets WHERE ticket_id = ? ORDER BY id DESC LIMIT 1", (ticket_id,)
+        ).fetchone()
+
+    def find_by_user(self, user_id, limit=10):
+        """Index rows of a user's archived tickets, newest first"""
+        return self.conn.execute(
+            f"SELECT {INDEX_COLUMNS} FROM tickets WHERE user_id = ? ORDER BY closed_at DESC LIMIT ?",
+            (str(user_id), limit)
+        ).fetchall()
+
+    def find_closed_between(self, start, end, limit=50):
+        """Index rows of tickets closed in [start, end) (epoch seconds), oldest first"""
+        return self.conn.execute(
+            f"SELECT {INDEX_COLUMNS} FROM tickets WHERE closed_at >= ? AND closed_at < ? ORDER BY closed_at LIMIT ?",
+            (start, end, limit)
+        ).fetchall()
+
+    def read(self, row):
+        """Load the archived record an index row points at. The ticket and its
+        entries are returned as models"""
+        with open(self._segment_path(row["segment"]), "rb") as f:
+            f.seek(row["offset"])
+            member = f.read(row["length"])
+
+        record = self.codec.loads(gzip.decompress(member))
+        record["ticket"] = Ticket.from_dict(record["ticket"])
+        record["conversation"] = [ConversationEntry.from_dict(entry) for entry in record["conversation"]]
+        return record
+
+    def max_ticket_id(self):
+        """Highest ticket id in the archive, 0 when it is empty"""
+        return self.conn.execute("SELECT max(ticket_id) FROM tickets").fetchone()[0] or 0
+
+    def get(self, ticket_id):
+        """Archived record of a ticket id, or None"""
+        row = self.lookup(ticket_id)
+        return None if row is None else self.read(row)
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+def day_range(date_text):
+    """Epoch bounds of a DD-MM-YYYY day in UTC+7"""
+    day = datetime.strptime(date_text, "%d-%m-%Y").replace(tzinfo=UTC7)
+    start = int(day.timestamp())
+    return start, start + 86400
+
+def format_transcript(record):
+    """Plain-text transcript of an archived ticket"""
+    ticket = record["ticket"]
+    lines = [
+        f"Ticket #{ticket.ticket_id} of user {record['user_id']}",
+        f"Category: {(ticket.issue_type or 'Unknown').capitalize()}",
+        f"Opened: {ticket.timestamp_utc7 or 'unknown'}",
+        f"Closed: {format_timestamp(record['closed_at'])} by {record['closed_by'] or 'unknown'}",
+        ""
+    ]
+
+    for entry in record["conversation"]:
+        sender = "User" if entry.sender == Sender.USER else "Staff"
+        text = entry.text or ""
+        if entry.media_type:
+            text = f"[{entry.media_type}] {text}".rstrip()
+        lines.append(f"[{entry.timestamp_utc7 or '?'}] {sender}: {text}")
+
+    return "\n".join(lines)
+
+archive = TicketArchive()
@@ -0,0 +1,163 @@
+import time
+from config import SUPPORT_STAFF_IDS, STAFF_CATEGORIES, ASSIGNMENT_STRATEGY, ASSIGNMENT_ESCALATION_TIMEOUT
+from utils.ticket_store import store
+from utils.outbox import outbox
+from utils.timers import timers
+from helper import get_logger
+
+logger = get_logger(__name__)
+
+def quiet_state_key(staff_id):
+    return f"quiet:{staff_id}"
+
+def set_staff_quiet(staff_id, minutes):
+    """Mute staff notifications for staff_id for the given number of minutes. Returns the end time"""
+    expires_at = time.time() + minutes * 60
+    store.set_state(quiet_state_key(staff_id), "quiet", expires_at)
+    return expires_at
+
+def clear_staff_quiet(staff_id):
+    store.clear_state(quiet_state_key(staff_id))
+
+def is_staff_quiet(staff_id):
+    return store.get_state(quiet_state_key(staff_id)) == "quiet"
+
+def get_staff_quiet_until(staff_id):
+    """End of the staff member's quiet window as an epoch timestamp, or None"""
+    if not is_staff_quiet(staff_id):
+        return None
+    return store.states[quiet_state_key(staff_id)]["expires_at"]
+
+class AssignmentEngine:
+    """Routes every new ticket to a single staff member.
+
+    Candidates are the staff members whose STAFF_CATEGORIES include the
+    ticket's category (everyone when nobody has an affinity for it), minus
+    staff inside a /quiet window when someone else is available. Among them
+    the "least_loaded" strategy picks the one with the fewest open tickets
+    and "round_robin" takes turns; "broadcast" disables assignment.
+
+    Open-ticket counts are kept per staff member and updated in O(1) on
+    assignment and release. When the assignee has not answered within
+    ASSIGNMENT_ESCALATION_TIMEOUT seconds, or is inside a /quiet window when
+    a follow-up arrives, the ticket is escalated and its notifications go to
+    everyone again.
+    """
+
+    def __init__(self, staff_ids=SUPPORT_STAFF_IDS, categories=STAFF_CATEGORIES,
+                 strategy=ASSIGNMENT_STRATEGY, escalation_timeout=ASSIGNMENT_ESCALATION_TIMEOUT):
+        self.staff_ids = list(staff_ids)
+        self.categories = categories
+        self.strategy = strategy
+        self.escalation_timeout = escalation_timeout
+        self.load = {staff_id: 0 for staff_id in self.staff_ids}
+        self._turn = 0
+
+    @property
+    def enabled(self):
+        return self.strategy != "broadcast" and bool(self.staff_ids)
+
+    def start(self):
+        """Rebuild load counters from the open tickets and re-arm escalation timers"""
+        self.load = {staff_id: 0 for staff_id in self.staff_ids}
+
+        for user_id, ticket in store.tracking.items():
+            staff_id = ticket.assigned_staff_id
+            if staff_id is None:
+                continue
+
+            self.load[staff_id] = self.load.get(staff_id, 0) + 1
+            if not ticket.escalated and not ticket.first_response_at:
+                self._schedule_escalation(user_id, ticket.assigned_at or time.time())
+
+        logger.info("Assignment engine (%s) loaded: %s", self.strategy, self.load)
+
+    def _candidates(self, category):
+        candidates = [staff_id for staff_id in self.staff_ids if category in self.categories.get(staff_id, ())]
+        if not candidates:
+            candidates = self.staff_ids
+
+        available = [staff_id for staff_id in candidates if not is_staff_quiet(staff_id)]
+        return available or candidates
+
+    def choose(self, category):
+        """Pick the staff member for a new ticket of this category without assigning it"""
+        candidates = self._candidates(category)
+
+        if self.strategy == "round_robin":
+            staff_id = candidates[self._turn % len(candidates)]
+            self._turn += 1
+            return staff_id
+
+        return min(candidates, key=lambda staff_id: self.load.get(staff_id, 0))
+
+    def assign(self, user_id, category):
+        """Choose an assignee for a new ticket and count it against their load.
+
+        Returns the ticket fields to store (empty when assignment is disabled).
+        """
+        if not self.enabled:
+            return {}
+
+        staff_id = self.choose(category)
+        assigned_at = time.time()
+        self.load[staff_id] = self.load.get(staff_id, 0) + 1
+        self._schedule_escalation(user_id, assigned_at)
+
+        logger.info("Assigned ticket of user %s (%s) to staff %s, load %s", user_id, category, staff_id, self.load[staff_id])
+        return {"assigned_staff_id": staff_id, "assigned_at": assigned_at}
+
+    def release(self, user_id, ticket):
+        """Take a closed ticket off its assignee's load"""
+        timers.cancel(("escalate", str(user_id)))
+
+        staff_id = ticket.assigned_staff_id
+        if staff_id is not None and self.load.get(staff_id, 0) > 0:
+            self.load[staff_id] -= 1
+
+    def record_response(self, user_id):
+        """Staff answered the ticket: stop the escalation timer"""
+        ticket = store.get_ticket(user_id)
+        if ticket is None or ticket.first_response_at:
+            return
+
+        timers.cancel(("escalate", str(user_id)))
+        store.update_ticket(user_id, first_response_at=time.time())
+
+    def recipients(self, user_id):
+        """Staff ids to notify about a ticket's follow-ups, or None for everyone.
+
+        An assignee inside a /quiet window would receive nothing, so the
+        ticket is escalated right away and everyone else is notified instead.
+        """
+        ticket = store.get_ticket(user_id)
+        if ticket is None or ticket.escalated:
+            return None
+
+        staff_id = ticket.assigned_staff_id
+        if staff_id is None:
+            return None
+
+        if is_staff_quiet(staff_id):
+            self._escalate(user_id, assignee_quiet=True)
+            return None
+
+        return [staff_id]
+
+    def _schedule_escalation(self, user_id, assigned_at):
+        if self.escalation_timeout > 0:
+            timers.schedule(("escalate", str(user_id)), assigned_at + self.escalation_timeout, self._escalate, user_id)
+
+    def _escalate(self, user_id, assignee_quiet=False):
+        timers.cancel(("escalate", str(user_id)))
+        ticket = store.update_ticket(user_id, escalated=True)
+        if ticket is None:
+            return
+
+        if assignee_quiet:
+            logger.warning("Staff %s assigned to the ticket of user %s is quiet, escalating", ticket.assigned_staff_id, user_id)
+        else:
+            logger.warning("Ticket of user %s was not answered by staff %s, escalating", user_id, ticket.assigned_staff_id)
+        outbox.enqueue("escalate_ticket", {"user_id": str(user_id), "assignee_quiet": assignee_quiet}, key=user_id)
+
+assignments = AssignmentEngine()
@@ -0,0 +1,168 @@
+import json
+import os
+from utils.models import encode_record
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# Binary snapshots start with MAGIC followed by one format version byte
+MAGIC = b"TSNP"
+VERSION = 1
+
+class CodecError(ValueError):
+    pass
+
+class JsonCodec:
+    """Compact JSON (no indentation), encoded with orjson when it is installed"""
+
+    name = "json"
+    extension = ".json"
+
+    def dumps(self, data):
+        if orjson is not None:
+            # Models are passed to encode_record so they keep the legacy schema
+            return orjson.dumps(data, default=encode_record, option=orjson.OPT_PASSTHROUGH_DATACLASS)
+        return json.dumps(data, separators=(",", ":"), default=encode_record).encode()
+
+    def loads(self, raw):
+        if orjson is not None:
+            return orjson.loads(raw)
+        return json.loads(raw)
+
+class MsgpackCodec:
+    """msgpack body behind a MAGIC + version header"""
+
+    name = "msgpack"
+    extension = ".msgpack"
+
+    def __init__(self):
+        if msgpack is None:
+            raise CodecError("The msgpack snapshot format needs the msgpack package (pip install msgpack)")
+
+    def dumps(self, data):
+        return MAGIC + bytes([VERSION]) + msgpack.packb(data, default=encode_record, use_bin_type=True)
+
+    def loads(self, raw):
+        if not raw.startswith(MAGIC):
+            raise CodecError("Not a msgpack snapshot")
+
+        version = raw[len(MAGIC)]
+        if version > VERSION:
+            raise CodecError(f"Snapshot format version {version} is newer than this bot supports ({VERSION})")
+        return msgpack.unpackb(raw[len(MAGIC) + 1:], raw=False, strict_map_key=False)
+
+CODECS = {"json": JsonCodec, "msgpack": MsgpackCodec}
+
+def get_codec(name):
+    """Create the codec for a SNAPSHOT_FORMAT name"""
+    if name not in CODECS:
+        raise ValueError(f"Unknown snapshot format: {name}")
+    return CODECS[name]()
+
+def detect_codec(raw):
+    """Pick the codec that wrote raw from its first bytes"""
+    return get_codec("msgpack" if raw.startswith(MAGIC) else "json")
+
+def snapshot_path(path, codec):
+    """path with the file extension of codec, e.g. message_tracking.msgpack"""
+    return os.path.splitext(path)[0] + codec.extension
+
+def write_atomic(path, raw):
+    """Write raw bytes to path through a temp file and rename, so readers
+    (and a crash) only ever see the old or the new file"""
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(raw)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+def read_snapshot(path):
+    """Load a snapshot written by any codec"""
+    with open(path, "rb") as f:
+        raw = f.read()
+    return detect_codec(raw).loads(raw)
+
+def write_snapshot(path, data, codec):
+    write_atomic(path, codec.dumps(data))
+
+def convert_snapshot(src, dst, codec):
+    """Re-encode the snapshot at src with codec into dst. Returns (src_bytes, dst_bytes)"""
+    data = read_snapshot(src)
+    write_snapshot(dst, data, codec)
+    return os.path.getsize(src), os.path.getsize(dst)
+
+def benchmark(ticket_counts, rounds=3):
+    """Time save and load and measure the file size of a tracking snapshot with
+    the given numbers of tickets, for every available format.
+
+    Yields (tickets, format, save_seconds, load_seconds, size_bytes); times are
+    the best of `rounds`.
+    """
+    import tempfile
+    import time
+    from utils.models import Ticket, _sample_records
+
+    formats = [("json (indent=4)", None), ("json (stdlib)", "stdlib")]
+    if orjson is not None:
+        formats.append(("json (orjson)", "json"))
+    if msgpack is not None:
+        formats.append(("msgpack", "msgpack"))
+
+    def stdlib_dumps(data):
+        return json.dumps(data, separators=(",", ":"), default=encode_record).encode()
+
+    def indent_dumps(data):
+        return json.dumps(data, indent=4, default=encode_record).encode()
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "snapshot")
+
+        for count in ticket_counts:
+            tickets, _ = _sample_records(count, tickets=count)
+            tracking = {user_id: Ticket.from_dict(ticket) for user_id, ticket in tickets.items()}
+
+            for label, name in formats:
+                if name is None:
+                    dumps, loads = indent_dumps, json.loads
+                elif name == "stdlib":
+                    dumps, loads = stdlib_dumps, json.loads
+                else:
+                    codec = get_codec(name)
+                    dumps, loads = codec.dumps, codec.loads
+
+                save_times = []
+                load_times = []
+                for _ in range(rounds):
+                    started = time.perf_counter()
+                    write_atomic(path, dumps(tracking))
+                    save_times.append(time.perf_counter() - started)
+
+                    started = time.perf_counter()
+                    with open(path, "rb") as f:
+                        loads(f.read())
+                    load_times.append(time.perf_counter() - started)
+
+                yield count, label, min(save_times), min(load_times), os.path.getsize(path)
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Snapshot codec tools")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    bench_parser = subparsers.add_parser("bench", help="Compare save/load time and size of the snapshot formats")
+    bench_parser.add_argument("--tickets", type=int, nargs="+", default=[1000, 10000, 100000])
+    bench_parser.add_argument("--rounds", type=int, default=3)
+    args = parser.parse_args()
+
+    if args.command == "bench":
+        print(f"{'tickets':>8}  {'format':<16} {'save ms':>9} {'load ms':>9} {'size KiB':>10}")
+        for count, label, save_time, load_time, size in benchmark(args.tickets, args.rounds):
+            print(f"{count:>8}  {label:<16} {save_time * 1000:9.1f} {load_time * 1000:9.1f} {size / 1024:10.1f}")
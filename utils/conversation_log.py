@@ -0,0 +1,201 @@
+import asyncio
+import json
+import os
+import time
+from utils.models import encode_record
+from helper import get_logger
+
+logger = get_logger(__name__)
+
+BASE_FILE = "base.jsonl"
+SEGMENT_PREFIX = "segment-"
+
+class ConversationLog:
+    """Append-only, segmented log of conversation entries.
+
+    Each relayed message is one JSON line ({"u": user_id, "e": entry}) written
+    to the active segment and a closed ticket is one tombstone line
+    ({"u": user_id, "d": 1}), so the I/O per message is proportional to the
+    message, not to the history. An edited or deleted entry is rewritten as a
+    replacement line ({"u": user_id, "r": entry}) matched by message_id on
+    replay. The ticket store keeps the live
+    conversations in memory and serves all lookups from there.
+
+    Compaction rotates to a fresh segment and rewrites the live state into
+    base.jsonl in a worker thread. The base file records the last segment it
+    covers, so a crash between writing the base and deleting old segments
+    never replays an entry twice.
+    """
+
+    def __init__(self, directory, compact_interval=300, compact_min_dead=1000):
+        self.directory = directory
+        self.compact_interval = compact_interval
+        self.compact_min_dead = compact_min_dead
+        self._file = None
+        self._segment = 0
+        self._live = 0
+        self._dead = 0
+        self._last_compaction = time.monotonic()
+        self._compacting = False
+
+    def _segment_path(self, number):
+        return os.path.join(self.directory, f"{SEGMENT_PREFIX}{number:06d}.jsonl")
+
+    def _segments(self):
+        numbers = []
+        for name in os.listdir(self.directory):
+            if name.startswith(SEGMENT_PREFIX) and name.endswith(".jsonl"):
+                numbers.append(int(name[len(SEGMENT_PREFIX):-len(".jsonl")]))
+        return sorted(numbers)
+
+    def exists(self):
+        return os.path.isdir(self.directory) and (
+            os.path.exists(os.path.join(self.directory, BASE_FILE)) or bool(self._segments())
+        )
+
+    def load(self):
+        """Replay base and segments into a {user_id: [entries]} dict"""
+        os.makedirs(self.directory, exist_ok=True)
+        conversations = {}
+        covered = 0
+
+        base_path = os.path.join(self.directory, BASE_FILE)
+        if os.path.exists(base_path):
+            with open(base_path, "r") as f:
+                header = f.readline()
+                if header:
+                    covered = json.loads(header).get("through", 0)
+                self._replay(f, conversations)
+
+        segments = self._segments()
+        for number in segments:
+            if number <= covered:
+                os.remove(self._segment_path(number))
+                continue
+            with open(self._segment_path(number), "r") as f:
+                self._replay(f, conversations)
+
+        self._live = sum(len(messages) for messages in conversations.values())
+        self._open_segment(max(segments + [covered]) + 1)
+        logger.info("Replayed conversation log for %s users", len(conversations))
+        return conversations
+
+    def _replay(self, f, conversations):
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # A crash can leave one torn line at the end of a segment
+                logger.warning("Skipping corrupt line in conversation log %s", f.name)
+                continue
+
+            user_id = record["u"]
+            if "e" in record:
+                conversations.setdefault(user_id, []).append(record["e"])
+            elif "r" in record:
+                self._replace(conversations.get(user_id, []), record["r"])
+                self._dead += 1
+            elif record.get("d"):
+                self._dead += len(conversations.pop(user_id, [])) + 1
+
+    @staticmethod
+    def _replace(messages, entry):
+        # Edits almost always hit recent entries, so search from the end
+        for index in range(len(messages) - 1, -1, -1):
+            if messages[index].get("message_id") == entry.get("message_id"):
+                messages[index] = entry
+                return
+
+    def _open_segment(self, number):
+        if self._file is not None:
+            self._file.close()
+        self._segment = number
+        self._file = open(self._segment_path(number), "a")
+
+    def _write(self, record):
+        self._file.write(json.dumps(record, separators=(",", ":"), default=encode_record) + "\n")
+        self._file.flush()
+
+    def append(self, user_id, entry):
+        self._write({"u": str(user_id), "e": entry})
+        self._live += 1
+
+    def replace(self, user_id, entry):
+        self._write({"u": str(user_id), "r": entry})
+        self._dead += 1
+
+    def remove(self, user_id, removed_count):
+        self._write({"u": str(user_id), "d": 1})
+        self._live -= removed_count
+        self._dead += removed_count + 1
+
+    def import_conversations(self, conversations):
+        for user_id, messages in conversations.items():
+            for entry in messages:
+                self.append(user_id, entry)
+
+    def needs_compaction(self):
+        return (
+            not self._compacting
+            and self._dead >= self.compact_min_dead
+            and self._dead > self._live
+            and time.monotonic() - self._last_compaction >= self.compact_interval
+        )
+
+    def maybe_compact(self, conversations):
+        """Start a background compaction when enough dead records piled up"""
+        if not self.needs_compaction():
+            return
+
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self.compact(conversations)
+            return
+
+        through, snapshot = self._rotate(conversations)
+        self._compacting = True
+        task = loop.run_in_executor(None, self._write_base, through, snapshot)
+        task.add_done_callback(self._compaction_done)
+
+    def compact(self, conversations):
+        """Synchronously rewrite the live state into the base file"""
+        through, snapshot = self._rotate(conversations)
+        self._write_base(through, snapshot)
+
+    def _rotate(self, conversations):
+        through = self._segment
+        self._open_segment(through + 1)
+        self._dead = 0
+        self._last_compaction = time.monotonic()
+        snapshot = {user_id: list(messages) for user_id, messages in conversations.items()}
+        return through, snapshot
+
+    def _write_base(self, through, snapshot):
+        base_path = os.path.join(self.directory, BASE_FILE)
+        tmp_path = base_path + ".tmp"
+
+        with open(tmp_path, "w") as f:
+            f.write(json.dumps({"through": through}) + "\n")
+            for user_id, messages in snapshot.items():
+                for entry in messages:
+                    f.write(json.dumps({"u": user_id, "e": entry}, separators=(",", ":"), default=encode_record) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, base_path)
+
+        for number in self._segments():
+            if number <= through:
+                os.remove(self._segment_path(number))
+
+        logger.info("Compacted conversation log through segment %s", through)
+
+    def _compaction_done(self, future):
+        self._compacting = False
+        if future.exception():
+            logger.error("Error compacting conversation log: %s", future.exception())
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
@@ -1,37 +1,433 @@
+import asyncio
 import json
-from config import TRACKING_FILE, CONVERSATIONS_FILE
-from helper import logger
+import os
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from config import (
+    TRACKING_FILE, CONVERSATIONS_FILE, STATES_FILE, SQLITE_FILE, STORAGE_BACKEND,
+    CONVERSATION_LOG_DIR, CONVERSATION_COMPACT_INTERVAL, SNAPSHOT_FORMAT
+)
+from utils.codec import (
+    CODECS, CodecError, get_codec, snapshot_path, read_snapshot, write_snapshot, convert_snapshot
+)
+from utils.conversation_log import ConversationLog
+from utils.models import as_ticket, as_entry
+from utils.metrics import timed, STORAGE_SECONDS
+from helper import get_logger
 
+logger = get_logger(__name__)
+
+def load_snapshot(path, description):
+    """Load a snapshot in the configured format, falling back to a file
+    written in another format (switching SNAPSHOT_FORMAT migrates on the next save).
+
+    An unreadable file is renamed to <file>.corrupt-<timestamp> before None
+    is returned, so the next save cannot overwrite what may still be recovered.
+    """
+    codec = get_codec(SNAPSHOT_FORMAT)
+    candidates = [snapshot_path(path, codec)] + [
+        snapshot_path(path, other) for name, other in CODECS.items() if name != codec.name
+    ]
+
+    for candidate in candidates:
+        try:
+            return read_snapshot(candidate)
+        except FileNotFoundError:
+            continue
+        except (ValueError, CodecError) as e:
+            corrupt_path = f"{candidate}.corrupt-{int(time.time())}"
+            os.replace(candidate, corrupt_path)
+            logger.error("Could not read %s from %s, moved it to %s: %s", description, candidate, corrupt_path, e)
+            return None
+    return None
+
+@timed(STORAGE_SECONDS)
 def load_tracking_data():
     """Load message tracking data from file"""
-    try:
-        with open(TRACKING_FILE, "r") as f:
-            data = json.load(f)
-            logger.info(f"Loaded {len(data)} tracked users from file")
-            return data
-    except (FileNotFoundError, json.JSONDecodeError):
+    data = load_snapshot(TRACKING_FILE, "tracking data")
+    if data is None:
         logger.info("No existing tracking file found or file is corrupted. Creating new tracking")
         return {}
+    logger.info("Loaded %s tracked users from file", len(data))
+    return data
 
+@timed(STORAGE_SECONDS)
 def load_conversations_data():
     """Load conversations data from file"""
-    try:
-        with open(CONVERSATIONS_FILE, "r") as f:
-            data = json.load(f)
-            logger.info(f"Loaded conversations for {len(data)} users")
-            return data
-    except (FileNotFoundError, json.JSONDecodeError):
+    data = load_snapshot(CONVERSATIONS_FILE, "conversations")
+    if data is None:
         logger.info("No existing conversations file found or file is corrupted. Creating new")
         return {}
+    logger.info("Loaded conversations for %s users", len(data))
+    return data
 
+@timed(STORAGE_SECONDS)
+def load_states_data():
+    """Load per-user conversation states from file"""
+    data = load_snapshot(STATES_FILE, "conversation states")
+    if data is None:
+        return {}
+    logger.info("Loaded conversation states for %s users", len(data))
+    return data
+
+def save_snapshot(path, data):
+    codec = get_codec(SNAPSHOT_FORMAT)
+    write_snapshot(snapshot_path(path, codec), data, codec)
+
+    # A file left in the previous format would shadow this one if the format is switched back
+    for name, other in CODECS.items():
+        stale_path = snapshot_path(path, other)
+        if name != codec.name and os.path.exists(stale_path):
+            os.remove(stale_path)
+            logger.info("Removed %s after migrating it to %s", stale_path, codec.name)
+
+@timed(STORAGE_SECONDS)
 def save_tracking_data(data):
     """Save message tracking data to file"""
-    with open(TRACKING_FILE, "w") as f:
-        json.dump(data, f, indent=4)
-    logger.info(f"Saved tracking data for {len(data)} users")
-
-def save_conversations_data(data):
-    """Save conversations data to file"""
-    with open(CONVERSATIONS_FILE, "w") as f:
-        json.dump(data, f, indent=4)
-    logger.info(f"Saved conversations for {len(data)} users")
\ No newline at end of file
+    save_snapshot(TRACKING_FILE, data)
+    logger.info("Saved tracking data for %s users", len(data))
+
+@timed(STORAGE_SECONDS)
+def save_states_data(data):
+    """Save per-user conversation states to file"""
+    save_snapshot(STATES_FILE, data)
+    logger.info("Saved conversation states for %s users", len(data))
+
+class JsonBackend:
+    """Keeps tracking as a JSON document and conversations in an append-only log.
+
+    Ticket mutations only mark the ticket dirty; flush() rewrites the
+    document. Every ticket's record is kept as a plain dict and only dirty
+    tickets are serialized again, on the loop; the document is then encoded
+    and written by a single writer thread, so a flush never stalls the loop
+    and two writes never overlap. Changes made while a write is running are
+    picked up when it finishes. Conversation entries go
+    straight to the ConversationLog as one line each. An existing
+    conversations.json is imported into the log once.
+    """
+
+    name = "json"
+
+    def __init__(self, log_dir=CONVERSATION_LOG_DIR):
+        self._dirty = False
+        self._dirty_tickets = set()
+        self._records = {}
+        self._states_dirty = False
+        self._latest = None
+        self._write = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="snapshot-writer")
+        self.log = ConversationLog(log_dir, compact_interval=CONVERSATION_COMPACT_INTERVAL)
+
+    def load(self):
+        tracking = load_tracking_data()
+        self._records = dict(tracking)
+
+        if self.log.exists():
+            return tracking, self.log.load()
+
+        conversations = load_conversations_data()
+        self.log.load()
+        self.log.import_conversations(conversations)
+        if conversations:
+            logger.info("Imported %s into the conversation log", CONVERSATIONS_FILE)
+        return tracking, conversations
+
+    def load_states(self):
+        return load_states_data()
+
+    def put_ticket(self, user_id, ticket):
+        self._dirty = True
+        self._dirty_tickets.add(str(user_id))
+
+    def append_message(self, user_id, entry):
+        self.log.append(user_id, entry)
+
+    def replace_message(self, user_id, entry):
+        self.log.replace(user_id, entry)
+
+    def remove_ticket(self, user_id, removed_count=0):
+        self._dirty = True
+        self._dirty_tickets.add(str(user_id))
+        self.log.remove(user_id, removed_count)
+
+    def put_state(self, user_id, state):
+        self._states_dirty = True
+
+    def delete_state(self, user_id):
+        self._states_dirty = True
+
+    def flush(self, tracking, conversations, states):
+        self._latest = (tracking, conversations, states)
+        self.log.maybe_compact(conversations)
+
+        if self._write is not None and not self._write.done():
+            # _write_done() flushes again once the running write finished
+            return
+
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            # No event loop (scripts, maintenance tools): write right away
+            self._save(self._take_snapshot())
+            return
+
+        snapshot = self._take_snapshot()
+        if snapshot:
+            self._write = self._executor.submit(self._save, snapshot)
+            asyncio.wrap_future(self._write).add_done_callback(self._write_done)
+
+    def _take_snapshot(self):
+        """Copy the dirty documents as plain dicts and clear their dirty flags.
+        Records are replaced, never mutated, so the copies can be shared with
+        the writer thread"""
+        tracking, _, states = self._latest
+        snapshot = []
+
+        if self._dirty:
+            for user_id in self._dirty_tickets:
+                ticket = tracking.get(user_id)
+                if ticket is None:
+                    self._records.pop(user_id, None)
+                else:
+                    self._records[user_id] = ticket.to_dict()
+            self._dirty_tickets.clear()
+            snapshot.append((save_tracking_data, dict(self._records)))
+            self._dirty = False
+
+        if self._states_dirty:
+            snapshot.append((save_states_data, {user_id: dict(state) for user_id, state in states.items()}))
+            self._states_dirty = False
+
+        return snapshot
+
+    def _save(self, snapshot):
+        """Write a snapshot taken by _take_snapshot(). On failure the documents
+        are marked dirty again so the next flush retries them"""
+        try:
+            for save, data in snapshot:
+                save(data)
+        except Exception:
+            for save, _ in snapshot:
+                if save is save_tracking_data:
+                    self._dirty = True
+                else:
+                    self._states_dirty = True
+            raise
+
+    def _write_done(self, future):
+        if future.exception() is not None:
+            logger.error("Error writing snapshot: %s", future.exception())
+            return
+
+        if self._dirty or self._states_dirty:
+            self.flush(*self._latest)
+
+    def close(self):
+        if self._write is not None:
+            try:
+                self._write.result()
+            except Exception as e:
+                logger.error("Error writing snapshot: %s", e)
+
+        if self._latest is not None:
+            self._save(self._take_snapshot())
+        self._executor.shutdown()
+        self.log.close()
+
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS tickets (
+    user_id TEXT PRIMARY KEY,
+    channel_message_id INTEGER,
+    discussion_message_id INTEGER,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_tickets_channel_message ON tickets (channel_message_id);
+CREATE INDEX IF NOT EXISTS idx_tickets_discussion_message ON tickets (discussion_message_id);
+
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id TEXT NOT NULL,
+    discussion_message_id INTEGER,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_messages_user ON messages (user_id);
+CREATE INDEX IF NOT EXISTS idx_messages_discussion_message ON messages (discussion_message_id);
+
+CREATE TABLE IF NOT EXISTS states (
+    user_id TEXT PRIMARY KEY,
+    state TEXT NOT NULL,
+    expires_at REAL
+);
+"""
+
+SQL_UPSERT_TICKET = (
+    "INSERT INTO tickets (user_id, channel_message_id, discussion_message_id, data) VALUES (?, ?, ?, ?) "
+    "ON CONFLICT (user_id) DO UPDATE SET channel_message_id = excluded.channel_message_id, "
+    "discussion_message_id = excluded.discussion_message_id, data = excluded.data"
+)
+SQL_INSERT_MESSAGE = "INSERT INTO messages (user_id, discussion_message_id, data) VALUES (?, ?, ?)"
+SQL_REPLACE_MESSAGE = (
+    "UPDATE messages SET discussion_message_id = ?, data = ? "
+    "WHERE user_id = ? AND json_extract(data, '$.message_id') = ?"
+)
+SQL_DELETE_TICKET = "DELETE FROM tickets WHERE user_id = ?"
+SQL_DELETE_MESSAGES = "DELETE FROM messages WHERE user_id = ?"
+SQL_UPSERT_STATE = (
+    "INSERT INTO states (user_id, state, expires_at) VALUES (?, ?, ?) "
+    "ON CONFLICT (user_id) DO UPDATE SET state = excluded.state, expires_at = excluded.expires_at"
+)
+SQL_DELETE_STATE = "DELETE FROM states WHERE user_id = ?"
+
+class SqliteBackend:
+    """Stores tickets and conversation entries as rows in a WAL-mode SQLite database.
+
+    Every mutation is a single-row statement; flush() commits the pending
+    transaction, so a crash can never leave a half-written file behind.
+    """
+
+    name = "sqlite"
+
+    def __init__(self, path=SQLITE_FILE):
+        self.path = path
+        self._conn = None
+
+    @property
+    def conn(self):
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, cached_statements=32)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.executescript(SQLITE_SCHEMA)
+        return self._conn
+
+    def load(self):
+        tracking = {}
+        conversations = {}
+
+        for user_id, data in self.conn.execute("SELECT user_id, data FROM tickets"):
+            tracking[user_id] = json.loads(data)
+
+        for user_id, data in self.conn.execute("SELECT user_id, data FROM messages ORDER BY id"):
+            conversations.setdefault(user_id, []).append(json.loads(data))
+
+        logger.info("Loaded %s tickets from %s", len(tracking), self.path)
+        return tracking, conversations
+
+    def load_states(self):
+        return {
+            user_id: {"state": state, "expires_at": expires_at}
+            for user_id, state, expires_at in self.conn.execute("SELECT user_id, state, expires_at FROM states")
+        }
+
+    def put_ticket(self, user_id, ticket):
+        self.conn.execute(SQL_UPSERT_TICKET, (
+            str(user_id),
+            ticket.channel_message_id,
+            ticket.discussion_message_id,
+            json.dumps(ticket.to_dict())
+        ))
+
+    def append_message(self, user_id, entry):
+        self.conn.execute(SQL_INSERT_MESSAGE, (
+            str(user_id),
+            entry.discussion_message_id,
+            json.dumps(entry.to_dict())
+        ))
+
+    def replace_message(self, user_id, entry):
+        self.conn.execute(SQL_REPLACE_MESSAGE, (
+            entry.discussion_message_id,
+            json.dumps(entry.to_dict()),
+            str(user_id),
+            entry.message_id
+        ))
+
+    def remove_ticket(self, user_id, removed_count=0):
+        self.conn.execute(SQL_DELETE_TICKET, (str(user_id),))
+        self.conn.execute(SQL_DELETE_MESSAGES, (str(user_id),))
+
+    def put_state(self, user_id, state):
+        self.conn.execute(SQL_UPSERT_STATE, (str(user_id), state["state"], state.get("expires_at")))
+
+    def delete_state(self, user_id):
+        self.conn.execute(SQL_DELETE_STATE, (str(user_id),))
+
+    def flush(self, tracking, conversations, states):
+        self.conn.commit()
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.commit()
+            self._conn.close()
+            self._conn = None
+
+def get_backend(name=STORAGE_BACKEND):
+    """Create the storage backend selected by STORAGE_BACKEND"""
+    if name == "sqlite":
+        return SqliteBackend()
+    if name == "json":
+        return JsonBackend()
+    raise ValueError(f"Unknown storage backend: {name}")
+
+def import_json_to_sqlite(path=SQLITE_FILE):
+    """One-shot import of the JSON tracking file and conversation log into SQLite"""
+    json_backend = JsonBackend()
+    tracking, conversations = json_backend.load()
+    states = json_backend.load_states()
+    json_backend.close()
+    backend = SqliteBackend(path)
+
+    with backend.conn:
+        for user_id in set(tracking) | set(conversations):
+            backend.remove_ticket(user_id)
+
+        for user_id, ticket in tracking.items():
+            backend.put_ticket(user_id, as_ticket(ticket))
+
+        for user_id, messages in conversations.items():
+            for entry in messages:
+                backend.append_message(user_id, as_entry(entry))
+
+        for user_id, state in states.items():
+            backend.put_state(user_id, state)
+
+    backend.close()
+    logger.info("Imported %s tickets and conversations for %s users into %s", len(tracking), len(conversations), path)
+    return len(tracking), len(conversations)
+
+def convert_snapshots(format_name):
+    """Rewrite every snapshot file that exists in another format with the codec
+    `format_name`. Yields (source path, size change) per converted file"""
+    codec = get_codec(format_name)
+
+    for path in (TRACKING_FILE, STATES_FILE):
+        target = snapshot_path(path, codec)
+        for name, other in CODECS.items():
+            source = snapshot_path(path, other)
+            if name == codec.name or not os.path.exists(source):
+                continue
+
+            src_bytes, dst_bytes = convert_snapshot(source, target, codec)
+            os.remove(source)
+            logger.info("Converted %s to %s", source, target)
+            yield source, f"{src_bytes} -> {dst_bytes} bytes ({target})"
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Ticket storage maintenance")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    import_parser = subparsers.add_parser("import-json", help="Import the JSON files into the SQLite database")
+    import_parser.add_argument("--db", default=SQLITE_FILE)
+    convert_parser = subparsers.add_parser("convert", help="Rewrite the tracking and state snapshots in another format")
+    convert_parser.add_argument("--to", choices=sorted(CODECS), required=True)
+    args = parser.parse_args()
+
+    if args.command == "import-json":
+        tickets, users = import_json_to_sqlite(args.db)
+        print(f"Imported {tickets} tickets and conversations for {users} users into {args.db}")
+
+    elif args.command == "convert":
+        for source, change in convert_snapshots(args.to):
+            print(f"Converted {source}: {change}")
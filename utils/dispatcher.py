@@ -0,0 +1,112 @@
+import asyncio
+import functools
+import time
+from collections import deque
+from config import DISPATCH_WORKERS
+from utils.metrics import registry, HANDLER_SECONDS, HANDLER_ERRORS, DISPATCH_WAIT_SECONDS
+from helper import get_logger, log_context
+
+logger = get_logger(__name__)
+
+class KeyedDispatcher:
+    """Runs handler work in order per key and in parallel across keys.
+
+    Work submitted under the same key (a ticket's user id) runs strictly one
+    item at a time in submission order, so read-modify-write sequences on a
+    ticket never interleave. Different keys are processed concurrently by up
+    to `workers` tasks.
+    """
+
+    def __init__(self, workers=DISPATCH_WORKERS):
+        self.workers = workers
+        self._pending = {}
+        self._ready = None
+        self._tasks = []
+
+    def depth(self, key):
+        """Number of queued or running items for key"""
+        return len(self._pending.get(key, ()))
+
+    def hot_keys(self, limit=10):
+        """The keys with the deepest queues as [(key, depth)]"""
+        depths = ((key, self.depth(key)) for key in self._pending)
+        return sorted(depths, key=lambda item: item[1], reverse=True)[:limit]
+
+    @property
+    def backlog(self):
+        return sum(len(items) for items in self._pending.values())
+
+    def _ensure_workers(self):
+        if self._ready is None:
+            self._ready = asyncio.Queue()
+            loop = asyncio.get_running_loop()
+            self._tasks = [loop.create_task(self._worker()) for _ in range(self.workers)]
+
+    def submit(self, key, func, *args):
+        """Queue func(*args) behind earlier work for key. Returns a future for its result"""
+        self._ensure_workers()
+        future = asyncio.get_running_loop().create_future()
+
+        items = self._pending.get(key)
+        if items is None:
+            items = self._pending[key] = deque()
+            self._ready.put_nowait(key)
+        items.append((func, args, future, time.perf_counter()))
+        return future
+
+    async def _worker(self):
+        while True:
+            key = await self._ready.get()
+            items = self._pending[key]
+            func, args, future, queued_at = items[0]
+            started = time.perf_counter()
+            DISPATCH_WAIT_SECONDS.labels().observe(started - queued_at)
+            context = log_context.set({"handler": func.__name__, "user_id": key})
+
+            try:
+                result = await func(*args)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                HANDLER_ERRORS.labels(func.__name__).inc()
+                logger.error("Error in %s for key %s: %s", func.__name__, key, e)
+                if not future.done():
+                    future.set_exception(e)
+                    future.exception()
+            else:
+                if not future.done():
+                    future.set_result(result)
+            finally:
+                HANDLER_SECONDS.labels(func.__name__).observe(time.perf_counter() - started)
+                log_context.reset(context)
+
+            items.popleft()
+            if items:
+                self._ready.put_nowait(key)
+            else:
+                del self._pending[key]
+
+    def serialized(self, key_func):
+        """Decorator for pyrogram handlers: run the handler through the dispatcher
+        under key_func(update) and return to pyrogram immediately"""
+        def decorator(func):
+            @functools.wraps(func)
+            async def wrapper(client, update):
+                self.submit(key_func(update), func, client, update)
+            return wrapper
+        return decorator
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._ready = None
+
+dispatcher = KeyedDispatcher()
+
+# Only the deepest queues are exported, which bounds the number of series
+registry.gauge(
+    "support_bot_dispatch_hot_key_depth", "Queued or running jobs of the busiest tickets",
+    lambda: dict(dispatcher.hot_keys()), ["key"]
+)
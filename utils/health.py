@@ -0,0 +1,173 @@
+import asyncio
+import json
+import time
+from config import HEALTH_HOST, HEALTH_PORT, HEALTH_MAX_LOOP_LAG, HEALTH_MAX_BACKLOG, HEALTH_MAX_UNFLUSHED
+from utils.ticket_store import store
+from utils.sender import scheduler
+from utils.outbox import outbox
+from utils.dispatcher import dispatcher
+from utils.metrics import registry
+from helper import get_logger
+
+logger = get_logger(__name__)
+
+STATUS_TEXT = {200: "OK", 404: "Not Found", 405: "Method Not Allowed", 503: "Service Unavailable"}
+
+class LoopMonitor:
+    """Measures event-loop lag: how late a periodic sleep wakes up"""
+
+    def __init__(self, interval=0.5):
+        self.interval = interval
+        self.lag = 0.0
+        self.max_lag = 0.0
+        self._task = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            await asyncio.sleep(self.interval)
+            self.lag = max(0.0, loop.time() - started - self.interval)
+            self.max_lag = max(self.max_lag, self.lag)
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+class HealthServer:
+    """Serves /health, /ready, /metrics and /stats from the bot's own event loop.
+
+    Answering at all proves the loop is alive; the checks add the Telegram
+    connection, event-loop lag, the outbound backlog (send scheduler,
+    outbox and dispatcher) and how long changes have been waiting for a
+    store flush. /health fails on a dead connection, a stalled loop or a
+    stuck flush; /ready additionally waits for startup to finish and for the
+    backlog to drain below HEALTH_MAX_BACKLOG. /metrics is the Prometheus
+    export of utils/metrics.py; /stats has the p50/p95/p99 of its histograms
+    and the dispatcher's deepest per-ticket queues.
+    """
+
+    def __init__(self, host=HEALTH_HOST, port=HEALTH_PORT):
+        self.host = host
+        self.port = port
+        self.monitor = LoopMonitor()
+        self.started_at = time.time()
+        self.ready = False
+        self._client = None
+        self._server = None
+
+    async def start(self, client):
+        self._client = client
+        self.monitor.start()
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        logger.info("Health server listening on %s:%s", self.host, self.port)
+
+    async def stop(self):
+        self.monitor.stop()
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    def backlog(self):
+        return {
+            "send_scheduler": scheduler.backlog,
+            "outbox": outbox.backlog,
+            "dispatcher": dispatcher.backlog
+        }
+
+    def checks(self):
+        """Current state as {name: (ok, value)}"""
+        backlog = sum(self.backlog().values())
+        unflushed = store.unflushed_seconds
+        connected = bool(self._client and self._client.is_connected)
+
+        return {
+            "telegram_connected": (connected, connected),
+            "loop_lag_seconds": (self.monitor.lag < HEALTH_MAX_LOOP_LAG, round(self.monitor.lag, 4)),
+            "unflushed_seconds": (unflushed < HEALTH_MAX_UNFLUSHED, round(unflushed, 1)),
+            "backlog": (backlog < HEALTH_MAX_BACKLOG, backlog)
+        }
+
+    def health(self):
+        checks = self.checks()
+        ok = all(checks[name][0] for name in ("telegram_connected", "loop_lag_seconds", "unflushed_seconds"))
+        return ok, checks
+
+    def readiness(self):
+        ok, checks = self.health()
+        return ok and self.ready and checks["backlog"][0], checks
+
+    def _status_body(self, ok, checks):
+        body = {
+            "status": "ok" if ok else "unavailable",
+            "checks": {name: {"ok": passed, "value": value} for name, (passed, value) in checks.items()}
+        }
+        return (200 if ok else 503), "application/json", json.dumps(body)
+
+    def route(self, method, path):
+        """Return (status, content_type, body) for a request"""
+        if method not in ("GET", "HEAD"):
+            return 405, "text/plain", "Method not allowed\n"
+
+        path = path.split("?", 1)[0]
+        if path == "/health":
+            return self._status_body(*self.health())
+        if path == "/ready":
+            return self._status_body(*self.readiness())
+        if path == "/metrics":
+            return 200, "text/plain; version=0.0.4", registry.render()
+        if path == "/stats":
+            stats = registry.percentiles()
+            stats["dispatch_hot_keys"] = {str(key): depth for key, depth in dispatcher.hot_keys()}
+            return 200, "application/json", json.dumps(stats)
+        if path == "/":
+            return 200, "application/json", json.dumps({
+                "status": "online",
+                "service": "Telegram Support Bot",
+                "endpoints": ["/health", "/ready", "/metrics", "/stats"]
+            })
+        return 404, "text/plain", "Not found\n"
+
+    async def _handle(self, reader, writer):
+        try:
+            request_line = await asyncio.wait_for(reader.readline(), timeout=5)
+            # Drain the headers; no endpoint needs them
+            while (await asyncio.wait_for(reader.readline(), timeout=5)) not in (b"\r\n", b"\n", b""):
+                pass
+
+            parts = request_line.decode("latin-1").split()
+            if len(parts) < 2:
+                return
+
+            method, path = parts[0], parts[1]
+            status, content_type, body = self.route(method, path)
+            payload = body.encode()
+            head = (
+                f"HTTP/1.1 {status} {STATUS_TEXT[status]}\r\n"
+                f"Content-Type: {content_type}\r\n"
+                f"Content-Length: {len(payload)}\r\n"
+                "Connection: close\r\n\r\n"
+            ).encode()
+            writer.write(head if method == "HEAD" else head + payload)
+            await writer.drain()
+        except (asyncio.TimeoutError, ConnectionError):
+            pass
+        except Exception as e:
+            logger.error("Error serving health request: %s", e)
+        finally:
+            writer.close()
+
+health = HealthServer()
+
+registry.gauge("support_bot_up", "Whether the Telegram connection is up", lambda: int(health.checks()["telegram_connected"][1]))
+registry.gauge("support_bot_ready", "Whether /ready currently succeeds", lambda: int(health.readiness()[0]))
+registry.gauge("support_bot_uptime_seconds", "Seconds since the process started", lambda: time.time() - health.started_at)
+registry.gauge("support_bot_loop_lag_seconds", "Latest event loop lag", lambda: health.monitor.lag)
+registry.gauge("support_bot_loop_lag_max_seconds", "Largest event loop lag seen", lambda: health.monitor.max_lag)
+registry.gauge("support_bot_backlog", "Calls and jobs waiting per queue", health.backlog, ["queue"])
@@ -0,0 +1,191 @@
+from pyrogram.types import InputMediaPhoto, InputMediaVideo, InputMediaDocument, InputMediaAudio
+from utils.sender import send, PRIORITY_USER
+from helper import get_logger
+
+logger = get_logger(__name__)
+
+# Media types Telegram lets us put a caption on. Everything else (stickers,
+# video notes, locations, polls, ...) is sent as a reply to a separate
+# message carrying our header.
+CAPTIONED_MEDIA = {"photo", "video", "document", "audio", "voice", "animation"}
+
+# Media without a file, sent again from the fields extract_media_content() keeps
+MEDIA_SENDERS = {
+    "location": "send_location",
+    "venue": "send_venue",
+    "contact": "send_contact",
+    "poll": "send_poll",
+    "dice": "send_dice"
+}
+
+# Media types that can be part of an album
+INPUT_MEDIA = {
+    "photo": InputMediaPhoto,
+    "video": InputMediaVideo,
+    "document": InputMediaDocument,
+    "audio": InputMediaAudio
+}
+
+def extract_media(message):
+    """Return (media_type, media_file_id, text) for any kind of message.
+
+    media_type is None for plain text (including text with a link preview),
+    media_file_id is None for media without a file such as locations or polls.
+    """
+    if message.text or not message.media:
+        return None, None, message.text
+
+    media_type = message.media.value
+    media = getattr(message, media_type, None)
+    media_file_id = getattr(media, "file_id", None)
+
+    return media_type, media_file_id, message.caption
+
+def extract_media_content(message):
+    """Send parameters of media that has no file (location, venue, contact,
+    poll, dice), or None. Plain JSON so it can travel in outbox payloads"""
+    media_type = message.media.value if message.media and not message.text else None
+
+    if media_type == "location":
+        return {"latitude": message.location.latitude, "longitude": message.location.longitude}
+    if media_type == "venue":
+        venue = message.venue
+        return {
+            "latitude": venue.location.latitude,
+            "longitude": venue.location.longitude,
+            "title": venue.title,
+            "address": venue.address
+        }
+    if media_type == "contact":
+        contact = message.contact
+        return {"phone_number": contact.phone_number, "first_name": contact.first_name, "last_name": contact.last_name}
+    if media_type == "poll":
+        return {"question": message.poll.question, "options": [option.text for option in message.poll.options]}
+    if media_type == "dice":
+        return {"emoji": message.dice.emoji}
+    return None
+
+class describe_media:
+    """Short log-friendly summary of a message, built only when a log record
+    that uses it is actually emitted"""
+    __slots__ = ("media_type", "text")
+
+    def __init__(self, media_type, text):
+        self.media_type = media_type
+        self.text = text
+
+    def __str__(self):
+        if self.media_type is None:
+            return f"text: {(self.text or '')[:20]}..."
+        return f"{self.media_type} with caption: {self.text[:20] if self.text else 'No caption'}"
+
+async def relay_message(client, chat_id, text, media_type=None, media_file_id=None, media_content=None,
+                        reply_to_message_id=None, priority=PRIORITY_USER):
+    """Deliver a message to chat_id. Returns (message, header).
+
+    Text messages are sent as `text`. Media with a file is sent again from
+    media_file_id with `text` as the caption, so the file is reused
+    server-side without downloading it. Media that cannot carry a caption is
+    sent as a reply to `text` sent on its own, so the header still shows
+    whose message it is; header is that message, otherwise None. Every call
+    passes reply_to_message_id, which keeps the relay in the ticket's thread
+    or forum topic.
+    """
+    if media_type is None:
+        message = await send(
+            client.send_message,
+            chat_id,
+            text,
+            reply_to_message_id=reply_to_message_id,
+            priority=priority
+        )
+        return message, None
+
+    if media_type in CAPTIONED_MEDIA:
+        message = await send(
+            client.send_cached_media,
+            chat_id,
+            media_file_id,
+            caption=text or "",
+            reply_to_message_id=reply_to_message_id,
+            priority=priority
+        )
+        return message, None
+
+    header = None
+    if text:
+        header = await send(
+            client.send_message,
+            chat_id,
+            text,
+            reply_to_message_id=reply_to_message_id,
+            priority=priority
+        )
+        reply_to_message_id = header.id
+
+    if media_file_id:
+        message = await send(
+            client.send_cached_media,
+            chat_id,
+            media_file_id,
+            reply_to_message_id=reply_to_message_id,
+            priority=priority
+        )
+    elif media_type in MEDIA_SENDERS and media_content:
+        message = await send(
+            getattr(client, MEDIA_SENDERS[media_type]),
+            chat_id,
+            reply_to_message_id=reply_to_message_id,
+            priority=priority,
+            **media_content
+        )
+    elif header is not None:
+        logger.warning("Cannot relay %s to %s, sending only its header", media_type, chat_id)
+        return header, None
+    else:
+        logger.warning("Cannot relay %s to %s, sending a placeholder", media_type, chat_id)
+        message = await send(
+            client.send_message,
+            chat_id,
+            f"[{media_type.replace('_', ' ')}]",
+            reply_to_message_id=reply_to_message_id,
+            priority=priority
+        )
+
+    logger.info("Relayed %s to %s below its header", media_type, chat_id)
+    return message, header
+
+async def relay_media_group(client, chat_id, media_items, caption, reply_to_message_id=None, priority=PRIORITY_USER):
+    """Send an album as one media group. media_items is a list of
+    (media_type, file_id); the caption goes on the first item"""
+    media = [
+        INPUT_MEDIA[media_type](file_id, caption=caption if index == 0 else "")
+        for index, (media_type, file_id) in enumerate(media_items)
+    ]
+
+    return await send(
+        client.send_media_group,
+        chat_id,
+        media,
+        reply_to_message_id=reply_to_message_id,
+        priority=priority
+    )
+
+async def edit_relayed_message(client, chat_id, message_id, text, media_type=None, header_message_id=None,
+                               priority=PRIORITY_USER):
+    """Replace the text (or caption) of a message sent by relay_message, or
+    the text of its header for media that cannot carry a caption. Returns
+    False when there is nothing to edit"""
+    if media_type is None:
+        await send(client.edit_message_text, chat_id, message_id, text, priority=priority)
+        return True
+
+    if media_type in CAPTIONED_MEDIA or media_type == "media_group":
+        await send(client.edit_message_caption, chat_id, message_id, caption=text, priority=priority)
+        return True
+
+    if header_message_id is not None:
+        await send(client.edit_message_text, chat_id, header_message_id, text, priority=priority)
+        return True
+
+    return False
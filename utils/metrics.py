@@ -0,0 +1,241 @@
+import asyncio
+import bisect
+import functools
+import time
+from contextlib import contextmanager
+
+# Seconds; covers a cached lookup (1ms) up to a long FloodWait-delayed call
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+QUANTILES = (0.5, 0.95, 0.99)
+
+def escape_label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def format_labels(labelnames, values, extra=()):
+    pairs = list(zip(labelnames, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{escape_label(value)}"' for name, value in pairs) + "}"
+
+def format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Metric:
+    """A metric family: one child per combination of label values"""
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+
+    def labels(self, *values, **labels):
+        if labels:
+            values = tuple(labels[name] for name in self.labelnames)
+        key = tuple(str(value) for value in values)
+        child = self._children.get(key)
+        if child is None:
+            child = self._children[key] = self._new_child()
+        return child
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def samples(self):
+        """Yield (suffix, label_string, value) for the text exposition"""
+        raise NotImplementedError
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines += [f"{self.name}{suffix}{labels} {format_value(value)}" for suffix, labels, value in self.samples()]
+        return "\n".join(lines)
+
+class CounterValue:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+class Counter(Metric):
+    """A monotonically increasing count. Its name carries the _total suffix
+    itself, so the HELP and TYPE lines name the same family as the samples"""
+    kind = "counter"
+
+    def _new_child(self):
+        return CounterValue()
+
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+    def samples(self):
+        for key, child in self._children.items():
+            yield "", format_labels(self.labelnames, key), child.value
+
+class Gauge(Metric):
+    """A gauge read from a callback at scrape time, so it never goes stale.
+    With labelnames the callback returns {label value: value}"""
+    kind = "gauge"
+
+    def __init__(self, name, documentation, func, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self.func = func
+
+    def samples(self):
+        if not self.labelnames:
+            yield "", "", self.func()
+            return
+        for key, value in self.func().items():
+            yield "", format_labels(self.labelnames, (key,)), value
+
+class HistogramValue:
+    """Bucketed observations. Percentiles are estimated by linear
+    interpolation inside the bucket holding the requested rank, the same way
+    Prometheus' histogram_quantile() does"""
+    __slots__ = ("buckets", "counts", "count", "sum")
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q):
+        if not self.count:
+            return 0.0
+
+        rank = q * self.count
+        cumulative = 0
+        for index, bucket_count in enumerate(self.counts):
+            if cumulative + bucket_count >= rank and bucket_count:
+                if index == len(self.buckets):
+                    # Above the largest bucket: the best estimate is its bound
+                    return float(self.buckets[-1])
+                lower = self.buckets[index - 1] if index else 0.0
+                return lower + (self.buckets[index] - lower) * (rank - cumulative) / bucket_count
+            cumulative += bucket_count
+        return float(self.buckets[-1])
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def _new_child(self):
+        return HistogramValue(self.buckets)
+
+    def samples(self):
+        for key, child in self._children.items():
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), child.counts):
+                cumulative += bucket_count
+                yield "_bucket", format_labels(self.labelnames, key, [("le", format_value(float(bound)))]), cumulative
+            yield "_sum", format_labels(self.labelnames, key), child.sum
+            yield "_count", format_labels(self.labelnames, key), child.count
+
+    def percentiles(self):
+        """{label values: {"count", "p50", "p95", "p99"}} for every child"""
+        result = {}
+        for key, child in self._children.items():
+            summary = {"count": child.count}
+            summary.update({f"p{int(q * 100)}": round(child.quantile(q), 6) for q in QUANTILES})
+            result[",".join(key) or self.name] = summary
+        return result
+
+class MetricsRegistry:
+    """Process-wide collection of metrics, exported by the health server's /metrics"""
+
+    def __init__(self):
+        self._metrics = {}
+
+    def _register(self, metric):
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, func, labelnames=()):
+        return self._register(Gauge(name, documentation, func, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self):
+        """Prometheus text exposition format (version 0.0.4)"""
+        return "\n".join(metric.render() for metric in self._metrics.values()) + "\n"
+
+    def percentiles(self):
+        """p50/p95/p99 of every histogram, for a quick look without Prometheus"""
+        return {
+            name: metric.percentiles()
+            for name, metric in self._metrics.items() if isinstance(metric, Histogram)
+        }
+
+registry = MetricsRegistry()
+
+HANDLER_SECONDS = registry.histogram(
+    "support_bot_handler_seconds", "Time spent running an update handler or dispatched job", ["handler"]
+)
+HANDLER_ERRORS = registry.counter(
+    "support_bot_handler_errors_total", "Update handlers and dispatched jobs that raised", ["handler"]
+)
+DISPATCH_WAIT_SECONDS = registry.histogram(
+    "support_bot_dispatch_wait_seconds", "Time a job waited behind earlier work for the same ticket"
+)
+API_CALL_SECONDS = registry.histogram(
+    "support_bot_api_call_seconds", "Duration of Telegram API calls, excluding rate-limit waits", ["method"]
+)
+API_ERRORS = registry.counter(
+    "support_bot_api_errors_total", "Telegram API calls that failed, FloodWait excluded", ["method"]
+)
+FLOOD_WAITS = registry.counter(
+    "support_bot_flood_waits_total", "FloodWait errors returned by Telegram", ["method"]
+)
+STORAGE_SECONDS = registry.histogram(
+    "support_bot_storage_seconds", "Duration of loading and saving persistent data", ["operation"]
+)
+
+@contextmanager
+def timer(histogram, *labels):
+    """Observe the duration of the with-block in histogram.labels(*labels)"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        histogram.labels(*labels).observe(time.perf_counter() - started)
+
+def timed(histogram, *labels):
+    """Decorator form of timer() for plain and async functions. Without
+    labels the function's name is used as the single label value"""
+    def decorator(func):
+        values = labels or ((func.__name__,) if histogram.labelnames else ())
+
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with timer(histogram, *values):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with timer(histogram, *values):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,324 @@
+import functools
+import sys
+from dataclasses import dataclass, fields
+from enum import StrEnum
+from utils.utils import format_timestamp, get_channel_message_url
+
+class Sender(StrEnum):
+    USER = "user"
+    STAFF = "staff"
+
+class MediaType(StrEnum):
+    AUDIO = "audio"
+    DOCUMENT = "document"
+    PHOTO = "photo"
+    STICKER = "sticker"
+    VIDEO = "video"
+    ANIMATION = "animation"
+    VOICE = "voice"
+    VIDEO_NOTE = "video_note"
+    CONTACT = "contact"
+    LOCATION = "location"
+    VENUE = "venue"
+    POLL = "poll"
+    WEB_PAGE = "web_page"
+    DICE = "dice"
+    GAME = "game"
+    MEDIA_GROUP = "media_group"
+
+def _enum(enum_type, value):
+    if value is None or isinstance(value, enum_type):
+        return value
+    try:
+        return enum_type(value)
+    except ValueError:
+        return sys.intern(value)
+
+def _epoch(value):
+    return None if value is None else int(value)
+
+def _ids(value):
+    return None if value is None else tuple(value)
+
+class Record:
+    """Shared codec for the slotted models below.
+
+    EPOCH_FIELDS hold integer epoch seconds, INTERNED_FIELDS are short
+    strings repeated across records, DERIVED_FIELDS are computed properties
+    that are written to the JSON schema for readers of the files but never
+    stored. Keys the model does not know are kept in `extra` so a round trip
+    is lossless.
+    """
+
+    __slots__ = ()
+    EPOCH_FIELDS = ()
+    INTERNED_FIELDS = ()
+    DERIVED_FIELDS = ()
+    ALWAYS_FIELDS = ()
+
+    @classmethod
+    @functools.cache
+    def field_names(cls):
+        return frozenset(field.name for field in fields(cls) if field.name != "extra")
+
+    @classmethod
+    def from_dict(cls, data):
+        record = cls()
+        record.update(data)
+        return record
+
+    def update(self, data):
+        known = self.field_names()
+        for key, value in data.items():
+            if key in known:
+                setattr(self, key, self._coerce(key, value))
+            elif key not in self.DERIVED_FIELDS:
+                if self.extra is None:
+                    self.extra = {}
+                self.extra[key] = value
+
+    def _coerce(self, key, value):
+        if key in self.EPOCH_FIELDS:
+            return _epoch(value)
+        if key == "media_type":
+            return _enum(MediaType, value)
+        if key in self.INTERNED_FIELDS and isinstance(value, str):
+            return sys.intern(value)
+        return value
+
+    def to_dict(self):
+        """Serialize to the JSON schema the files have always used"""
+        data = {}
+        for field in fields(self):
+            key = field.name
+            if key == "extra":
+                continue
+            value = getattr(self, key)
+            if value is not None or key in self.ALWAYS_FIELDS:
+                data[key] = list(value) if isinstance(value, tuple) else value
+
+        for key in self.DERIVED_FIELDS:
+            value = getattr(self, key)
+            if value is not None:
+                data[key] = value
+
+        if self.extra:
+            data.update(self.extra)
+        return data
+
+@dataclass(slots=True)
+class Ticket(Record):
+    user_id: int = None
+    ticket_number: int = None
+    channel_id: int = None
+    channel_message_id: int = None
+    issue_type: str = None
+    status: str = None
+    timestamp: int = None
+    media_type: MediaType = None
+    channel_text: str = None
+    user_name: str = None
+    last_activity_at: int = None
+    discussion_group_id: int = None
+    discussion_message_id: int = None
+    topic_id: int = None
+    forward_timestamp: int = None
+    pending_media_message_id: int = None
+    assigned_staff_id: int = None
+    assigned_at: int = None
+    first_response_at: int = None
+    escalated: bool = None
+    awaiting_reply_since: int = None
+    sla_reminded: bool = None
+    idle_warned_at: int = None
+    extra: dict = None
+
+    EPOCH_FIELDS = (
+        "timestamp", "last_activity_at", "forward_timestamp", "assigned_at",
+        "first_response_at", "awaiting_reply_since", "idle_warned_at"
+    )
+    INTERNED_FIELDS = ("issue_type", "status", "user_name")
+    DERIVED_FIELDS = ("channel_message_url", "timestamp_utc7", "last_activity", "forward_timestamp_utc7")
+
+    @classmethod
+    def from_dict(cls, data):
+        ticket = super(Ticket, cls).from_dict(data)
+        if ticket.last_activity_at is None:
+            # Records written before activity was tracked as an epoch
+            ticket.last_activity_at = ticket.forward_timestamp or ticket.timestamp
+        return ticket
+
+    @property
+    def ticket_id(self):
+        """The number staff see as #N in headers, topic titles, /history and
+        /search. Tickets opened before numbering used their post's message id"""
+        return self.ticket_number if self.ticket_number is not None else self.channel_message_id
+
+    @property
+    def channel_message_url(self):
+        if self.channel_id is None or self.channel_message_id is None:
+            return None
+        return get_channel_message_url(self.channel_id, self.channel_message_id)
+
+    @property
+    def timestamp_utc7(self):
+        return None if self.timestamp is None else format_timestamp(self.timestamp)
+
+    @property
+    def last_activity(self):
+        return None if self.last_activity_at is None else format_timestamp(self.last_activity_at)
+
+    @property
+    def forward_timestamp_utc7(self):
+        return None if self.forward_timestamp is None else format_timestamp(self.forward_timestamp)
+
+@dataclass(slots=True)
+class ConversationEntry(Record):
+    sender: Sender = None
+    message_id: int = None
+    text: str = ""
+    media_type: MediaType = None
+    media_file_id: str = None
+    timestamp: int = None
+    discussion_message_id: int = None
+    reply_to_message_id: int = None
+    is_reply_to_staff: bool = None
+    replied_to_discussion_msg_id: int = None
+    media_types: tuple = None
+    media_file_ids: tuple = None
+    message_ids: tuple = None
+    discussion_message_ids: tuple = None
+    deleted_message_ids: tuple = None
+    media_content: dict = None
+    header_message_id: int = None
+    edited_at: int = None
+    deleted_at: int = None
+    extra: dict = None
+
+    EPOCH_FIELDS = ("timestamp", "edited_at", "deleted_at")
+    DERIVED_FIELDS = ("timestamp_utc7",)
+    ALWAYS_FIELDS = ("sender", "message_id", "text", "media_type", "media_file_id", "timestamp")
+
+    def _coerce(self, key, value):
+        if key == "sender":
+            return _enum(Sender, value)
+        if key == "media_types":
+            return None if value is None else tuple(_enum(MediaType, item) for item in value)
+        if key in ("media_file_ids", "message_ids", "discussion_message_ids", "deleted_message_ids"):
+            return _ids(value)
+        return Record._coerce(self, key, value)
+
+    @property
+    def timestamp_utc7(self):
+        return None if self.timestamp is None else format_timestamp(self.timestamp)
+
+def encode_record(obj):
+    """json.dump(s) default= hook for the models"""
+    if isinstance(obj, Record):
+        return obj.to_dict()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+def as_ticket(data):
+    return data if isinstance(data, Ticket) else Ticket.from_dict(data)
+
+def as_entry(data):
+    return data if isinstance(data, ConversationEntry) else ConversationEntry.from_dict(data)
+
+def _sample_records(count, tickets=None):
+    """Synthetic conversation entries in the JSON schema, spread over `tickets`
+    tickets (one per 20 entries by default), for the benchmarks"""
+    import random
+    import time
+
+    now = time.time()
+    media = [None, None, None, "photo", "document", "voice"]
+    ticket_records = {}
+    conversations = {}
+
+    for number in range(tickets or max(count // 20, 1)):
+        user_id = 100000000 + number
+        timestamp = now - random.randint(0, 86400)
+        ticket_records[str(user_id)] = {
+            "channel_id": -1001234567890,
+            "channel_message_id": number + 1,
+            "channel_message_url": get_channel_message_url(-1001234567890, number + 1),
+            "user_id": user_id,
+            "issue_type": random.choice(["technical", "billing", "feature", "general"]),
+            "status": "forwarded_to_discussion",
+            "timestamp": timestamp,
+            "timestamp_utc7": format_timestamp(timestamp),
+            "media_type": None,
+            "user_name": f"User {number}",
+            "last_activity": format_timestamp(timestamp),
+            "last_activity_at": timestamp,
+            "discussion_group_id": -1009876543210,
+            "discussion_message_id": number + 1
+        }
+        conversations[str(user_id)] = []
+
+    user_ids = list(conversations)
+    for number in range(count):
+        timestamp = now - random.random() * 86400
+        media_type = random.choice(media)
+        conversations[random.choice(user_ids)].append({
+            "sender": random.choice(["user", "staff"]),
+            "message_id": number,
+            "text": f"message number {number}",
+            "media_type": media_type,
+            "media_file_id": f"AgACAgIAAxkBAAI{number:012d}" if media_type else None,
+            "timestamp": timestamp,
+            "timestamp_utc7": format_timestamp(timestamp),
+            "discussion_message_id": number + 1000000
+        })
+
+    return ticket_records, conversations
+
+def benchmark(count):
+    """Compare the memory held by `count` conversation entries (plus one ticket
+    per 20 entries) as JSON dicts and as models. Returns (dict_bytes, model_bytes)"""
+    import gc
+    import json
+    import tracemalloc
+
+    tickets, conversations = _sample_records(count)
+    # Round-trip through JSON like a real load, so nothing is shared with the generator
+    payload = json.dumps({"tickets": tickets, "conversations": conversations})
+    del tickets, conversations
+    gc.collect()
+
+    tracemalloc.start()
+    data = json.loads(payload)
+    dict_bytes = tracemalloc.get_traced_memory()[0]
+    del data
+    gc.collect()
+    tracemalloc.stop()
+
+    tracemalloc.start()
+    data = json.loads(payload)
+    tracking = {user_id: Ticket.from_dict(ticket) for user_id, ticket in data["tickets"].items()}
+    conversations = {
+        user_id: [ConversationEntry.from_dict(entry) for entry in messages]
+        for user_id, messages in data["conversations"].items()
+    }
+    del data
+    gc.collect()
+    model_bytes = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    del tracking, conversations
+    return dict_bytes, model_bytes
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Ticket model tools")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    bench_parser = subparsers.add_parser("bench", help="Compare memory use of dict records and models")
+    bench_parser.add_argument("--entries", type=int, default=100000)
+    args = parser.parse_args()
+
+    if args.command == "bench":
+        dict_bytes, model_bytes = benchmark(args.entries)
+        print(f"{args.entries} entries as dicts:  {dict_bytes / 1048576:8.1f} MiB ({dict_bytes / args.entries:.0f} B/entry)")
+        print(f"{args.entries} entries as models: {model_bytes / 1048576:8.1f} MiB ({model_bytes / args.entries:.0f} B/entry)")
+        print(f"Saved {100 * (1 - model_bytes / dict_bytes):.1f}%")
@@ -0,0 +1,165 @@
+import asyncio
+import json
+import sqlite3
+import time
+from collections import deque
+from config import OUTBOX_FILE, OUTBOX_WORKERS, OUTBOX_MAX_ATTEMPTS
+from helper import get_logger
+
+logger = get_logger(__name__)
+
+OUTBOX_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,
+    job_key TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    created REAL NOT NULL
+);
+"""
+
+class Job:
+    __slots__ = ("id", "kind", "key", "payload", "attempts")
+
+    def __init__(self, id, kind, key, payload, attempts=0):
+        self.id = id
+        self.kind = kind
+        self.key = key
+        self.payload = payload
+        self.attempts = attempts
+
+class Outbox:
+    """Durable queue of delivery jobs backed by a SQLite journal.
+
+    Handlers enqueue a job (one committed INSERT) and return immediately.
+    Worker tasks run the registered coroutine for each job and delete it
+    from the journal once it succeeded; failures are retried with
+    exponential backoff. Jobs sharing a key (usually the ticket's user id)
+    run strictly in order, jobs with different keys run in parallel.
+    Pending jobs are replayed from the journal on the next start, so
+    delivery is at-least-once across restarts.
+    """
+
+    def __init__(self, path=OUTBOX_FILE, workers=OUTBOX_WORKERS, max_attempts=OUTBOX_MAX_ATTEMPTS):
+        self.path = path
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self._handlers = {}
+        self._conn = None
+        self._pending = {}
+        self._ready = None
+        self._tasks = []
+        self._client = None
+
+    def job(self, kind):
+        """Decorator registering the coroutine that delivers jobs of this kind"""
+        def decorator(func):
+            self._handlers[kind] = func
+            return func
+        return decorator
+
+    @property
+    def conn(self):
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript(OUTBOX_SCHEMA)
+        return self._conn
+
+    @property
+    def backlog(self):
+        """Number of jobs not yet delivered"""
+        return sum(len(jobs) for jobs in self._pending.values())
+
+    def enqueue(self, kind, payload, key="default"):
+        """Persist a job and hand it to the workers"""
+        if kind not in self._handlers:
+            raise ValueError(f"No outbox handler registered for {kind}")
+
+        key = str(key)
+        with self.conn:
+            cursor = self.conn.execute(
+                "INSERT INTO jobs (kind, job_key, payload, created) VALUES (?, ?, ?, ?)",
+                (kind, key, json.dumps(payload), time.time())
+            )
+        self._add(Job(cursor.lastrowid, kind, key, payload))
+
+    def _add(self, job):
+        jobs = self._pending.get(job.key)
+        if jobs is None:
+            jobs = self._pending[job.key] = deque()
+            if self._ready is not None:
+                self._ready.put_nowait(job.key)
+        jobs.append(job)
+
+    def start(self, client):
+        """Replay the journal and start the worker tasks"""
+        self._client = client
+        self._ready = asyncio.Queue()
+        self._pending = {}
+
+        rows = self.conn.execute("SELECT id, kind, job_key, payload, attempts FROM jobs ORDER BY id").fetchall()
+        for job_id, kind, key, payload, attempts in rows:
+            self._add(Job(job_id, kind, key, json.loads(payload), attempts))
+
+        loop = asyncio.get_running_loop()
+        self._tasks = [loop.create_task(self._worker()) for _ in range(self.workers)]
+        logger.info("Outbox started with %s workers, replaying %s pending jobs", self.workers, len(rows))
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    async def _worker(self):
+        while True:
+            key = await self._ready.get()
+            jobs = self._pending.get(key)
+            if not jobs:
+                continue
+
+            job = jobs[0]
+            if await self._run(job):
+                jobs.popleft()
+
+            if not jobs:
+                del self._pending[key]
+            elif job is jobs[0]:
+                # Failed: keep the key blocked so later jobs stay in order
+                delay = min(2 ** job.attempts, 300)
+                asyncio.get_running_loop().call_later(delay, self._ready.put_nowait, key)
+            else:
+                self._ready.put_nowait(key)
+
+    async def _run(self, job):
+        """Run one job. Returns True when the job is finished (delivered or dropped)"""
+        try:
+            await self._handlers[job.kind](self._client, job.payload)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            job.attempts += 1
+            if job.attempts >= self.max_attempts:
+                logger.error("Dropping outbox job %s (%s) after %s attempts: %s", job.id, job.kind, job.attempts, e)
+                self._delete(job)
+                return True
+
+            logger.warning("Outbox job %s (%s) failed (attempt %s): %s", job.id, job.kind, job.attempts, e)
+            with self.conn:
+                self.conn.execute("UPDATE jobs SET attempts = ? WHERE id = ?", (job.attempts, job.id))
+            return False
+
+        self._delete(job)
+        return True
+
+    def _delete(self, job):
+        with self.conn:
+            self.conn.execute("DELETE FROM jobs WHERE id = ?", (job.id,))
+
+outbox = Outbox()
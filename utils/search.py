@@ -0,0 +1,279 @@
+import re
+import sqlite3
+from config import SEARCH_FILE
+from helper import get_logger
+
+logger = get_logger(__name__)
+
+# detail=column keeps only which column a term occurs in, not its positions,
+# which makes the posting lists several times smaller. Phrase queries are not
+# needed for /search
+SEARCH_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS entries USING fts5(
+    text,
+    user_id UNINDEXED,
+    ticket_id UNINDEXED,
+    channel_id UNINDEXED,
+    channel_message_id UNINDEXED,
+    issue_type UNINDEXED,
+    tokenize = 'unicode61 remove_diacritics 2',
+    detail = column
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE TABLE IF NOT EXISTS entry_rows (
+    user_id TEXT NOT NULL,
+    message_id INTEGER NOT NULL,
+    entry_rowid INTEGER NOT NULL,
+    PRIMARY KEY (user_id, message_id)
+) WITHOUT ROWID;
+"""
+
+# Bumped when the layout changes; start() rebuilds an index built by an older version
+SEARCH_VERSION = "3"
+
+SQL_INSERT_ENTRY = (
+    "INSERT INTO entries (text, user_id, ticket_id, channel_id, channel_message_id, issue_type) VALUES (?, ?, ?, ?, ?, ?)"
+)
+SQL_MAP_ENTRY = "INSERT OR REPLACE INTO entry_rows (user_id, message_id, entry_rowid) VALUES (?, ?, ?)"
+SQL_FIND_ENTRY = "SELECT entry_rowid FROM entry_rows WHERE user_id = ? AND message_id = ?"
+
+# Only the most recent matching entries are scored: bm25 is computed per row,
+# so a very common word would otherwise cost one evaluation per message ever
+# indexed. Rare terms, the usual case, never reach the cap
+SEARCH_CANDIDATES = 2000
+
+# Candidates are grouped per ticket; bm25 scores are negative, so summing them
+# favours tickets that match often and well. The bare rowid column is taken
+# from the row with the best (lowest) score and used for the snippet
+SQL_SEARCH = f"""
+SELECT ticket_id, channel_id, channel_message_id, user_id, issue_type, count(*) AS hits, sum(score) AS total, min(score), rowid
+FROM (
+    SELECT rowid, ticket_id, channel_id, channel_message_id, user_id, issue_type, bm25(entries) AS score
+    FROM entries WHERE entries MATCH ?
+    ORDER BY rowid DESC LIMIT {SEARCH_CANDIDATES}
+)
+GROUP BY ticket_id, channel_id
+ORDER BY total
+LIMIT ?
+"""
+
+SQL_SNIPPET = "SELECT snippet(entries, 0, '', '', '…', 12) FROM entries WHERE entries MATCH ? AND rowid = ?"
+
+class SearchIndex:
+    """Full-text index over the text of every conversation entry, open and archived.
+
+    Backed by a SQLite FTS5 table: an inverted index whose posting lists are
+    stored delta- and varint-encoded, updated one entry at a time as the
+    ticket store appends messages. Closed tickets stay in the index, so
+    /search covers the archive without reading it. Results are ranked per
+    ticket by the summed bm25 score of its matching entries. A side table
+    maps (user id, message id) to the entry's row, so edits replace the
+    indexed text and deletions drop it.
+    """
+
+    def __init__(self, path=SEARCH_FILE):
+        self.path = path
+        self._conn = None
+
+    @property
+    def conn(self):
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.executescript(SEARCH_SCHEMA)
+        return self._conn
+
+    def start(self, conversations, tracking, archive):
+        """Build the index from the open conversations and the archive on first
+        use, or again after an upgrade changed its layout"""
+        built = self.conn.execute("SELECT value FROM meta WHERE key = 'built'").fetchone()
+        if built and built[0] == SEARCH_VERSION:
+            return
+
+        if built:
+            # Columns changed: recreate the tables instead of re-filling them
+            with self.conn:
+                self.conn.execute("DROP TABLE IF EXISTS entries")
+                self.conn.execute("DROP TABLE IF EXISTS entry_rows")
+            self.conn.executescript(SEARCH_SCHEMA)
+        self.rebuild(conversations, tracking, archive)
+
+    def rebuild(self, conversations, tracking, archive):
+        """Re-index every open and archived conversation from scratch"""
+        count = 0
+        with self.conn:
+            self.conn.execute("DELETE FROM entries")
+            self.conn.execute("DELETE FROM entry_rows")
+
+            for row in archive.conn.execute("SELECT id, segment, offset, length FROM tickets ORDER BY id"):
+                record = archive.read(row)
+                count += self._insert_many(record["user_id"], record["ticket"], record["conversation"])
+
+            for user_id, messages in conversations.items():
+                ticket = tracking.get(user_id)
+                if ticket is not None:
+                    count += self._insert_many(user_id, ticket, messages)
+
+            self.conn.execute("INSERT INTO entries (entries) VALUES ('optimize')")
+            self.conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('built', ?)", (SEARCH_VERSION,))
+
+        logger.info("Built the search index over %s conversation entries", count)
+        return count
+
+    def _insert(self, user_id, ticket, entry):
+        cursor = self.conn.execute(SQL_INSERT_ENTRY, (
+            entry.text, str(user_id), ticket.ticket_id, ticket.channel_id, ticket.channel_message_id, ticket.issue_type
+        ))
+        if entry.message_id is not None:
+            self.conn.execute(SQL_MAP_ENTRY, (str(user_id), entry.message_id, cursor.lastrowid))
+
+    def _delete(self, user_id, entry):
+        if entry.message_id is None:
+            return
+        row = self.conn.execute(SQL_FIND_ENTRY, (str(user_id), entry.message_id)).fetchone()
+        if row:
+            self.conn.execute("DELETE FROM entries WHERE rowid = ?", row)
+            self.conn.execute("DELETE FROM entry_rows WHERE user_id = ? AND message_id = ?", (str(user_id), entry.message_id))
+
+    def _insert_many(self, user_id, ticket, entries):
+        count = 0
+        for entry in entries:
+            if entry.text and not entry.deleted_at:
+                self._insert(user_id, ticket, entry)
+                count += 1
+        return count
+
+    def add(self, user_id, ticket, entry):
+        """Index one conversation entry of an open ticket"""
+        if not entry.text or ticket is None:
+            return
+
+        try:
+            with self.conn:
+                self._insert(user_id, ticket, entry)
+        except sqlite3.Error as e:
+            # A missing search hit is better than a failed relay
+            logger.error("Error indexing message of user %s: %s", user_id, e)
+
+    def replace(self, user_id, ticket, entry):
+        """Re-index an edited entry in place of its previous text"""
+        try:
+            with self.conn:
+                self._delete(user_id, entry)
+                if entry.text and ticket is not None and not entry.deleted_at:
+                    self._insert(user_id, ticket, entry)
+        except sqlite3.Error as e:
+            logger.error("Error re-indexing message %s of user %s: %s", entry.message_id, user_id, e)
+
+    def remove(self, user_id, entry):
+        """Drop a deleted entry from the index"""
+        try:
+            with self.conn:
+                self._delete(user_id, entry)
+        except sqlite3.Error as e:
+            logger.error("Error removing message %s of user %s from the index: %s", entry.message_id, user_id, e)
+
+    def search(self, terms, limit=10):
+        """Tickets whose recent conversations contain every word of `terms`, best first.
+
+        Returns a list of dicts with ticket_id, channel_id, channel_message_id, user_id,
+        issue_type, hits and snippet.
+        """
+        words = re.findall(r"\w+", terms.lower())
+        if not words:
+            return []
+
+        query = " ".join(f'"{word}"' for word in words)
+        results = []
+        rows = self.conn.execute(SQL_SEARCH, (query, limit)).fetchall()
+        for ticket_id, channel_id, channel_message_id, user_id, issue_type, hits, _, _, rowid in rows:
+            snippet = self.conn.execute(SQL_SNIPPET, (query, rowid)).fetchone()
+            results.append({
+                "ticket_id": ticket_id,
+                "channel_id": channel_id,
+                "channel_message_id": channel_message_id,
+                "user_id": user_id,
+                "issue_type": issue_type,
+                "hits": hits,
+                "snippet": snippet[0] if snippet else ""
+            })
+        return results
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+def benchmark(count, queries=("printer error", "refund", "login password reset")):
+    """Index `count` synthetic entries in a temporary database and time a few
+    searches. Returns (index_seconds, [(query, results, milliseconds)], index_bytes)"""
+    import os
+    import random
+    import tempfile
+    import time
+    from utils.models import Ticket
+
+    vocabulary = (
+        "printer error refund login password reset invoice payment card app crash update "
+        "account email verify order shipping delay broken screen sync backup feature request "
+        "thanks hello please help again still not working since yesterday today"
+    ).split()
+
+    with tempfile.TemporaryDirectory() as directory:
+        index = SearchIndex(os.path.join(directory, "search.db"))
+        tickets = [
+            Ticket.from_dict({"channel_id": -1001234567890, "channel_message_id": number, "issue_type": "technical"})
+            for number in range(max(count // 20, 1))
+        ]
+
+        started = time.perf_counter()
+        with index.conn:
+            for number in range(count):
+                ticket = random.choice(tickets)
+                index.conn.execute(SQL_INSERT_ENTRY, (
+                    " ".join(random.choices(vocabulary, k=12)), "100",
+                    ticket.ticket_id, ticket.channel_id, ticket.channel_message_id, ticket.issue_type
+                ))
+            index.conn.execute("INSERT INTO entries (entries) VALUES ('optimize')")
+        index_seconds = time.perf_counter() - started
+
+        timings = []
+        for query in queries:
+            started = time.perf_counter()
+            results = index.search(query)
+            timings.append((query, len(results), (time.perf_counter() - started) * 1000))
+
+        # With WAL the new pages sit in the -wal file until a checkpoint
+        index.conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        size = os.path.getsize(index.path)
+        index.close()
+    return index_seconds, timings, size
+
+search_index = SearchIndex()
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Conversation search index tools")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("rebuild", help="Re-index all open and archived conversations")
+    bench_parser = subparsers.add_parser("bench", help="Time indexing and searching synthetic entries")
+    bench_parser.add_argument("--entries", type=int, default=300000)
+    args = parser.parse_args()
+
+    if args.command == "rebuild":
+        from utils.ticket_store import store
+        from utils.archive import archive
+
+        store.load()
+        print(f"Indexed {search_index.rebuild(store.conversations, store.tracking, archive)} entries")
+
+    elif args.command == "bench":
+        index_seconds, timings, size = benchmark(args.entries)
+        print(f"Indexed {args.entries} entries in {index_seconds:.1f}s, index size {size / 1048576:.1f} MiB")
+        for query, results, milliseconds in timings:
+            print(f"  {query!r}: {results} tickets in {milliseconds:.1f} ms")
@@ -0,0 +1,179 @@
+import asyncio
+import heapq
+import itertools
+import time
+from pyrogram.errors import FloodWait
+from config import (
+    SEND_GLOBAL_RATE, SEND_PRIVATE_RATE, SEND_GROUP_RATE_PER_MINUTE, SEND_MAX_RETRIES
+)
+from utils.metrics import API_CALL_SECONDS, API_ERRORS, FLOOD_WAITS
+from helper import get_logger
+
+logger = get_logger(__name__)
+
+# Lower value = sent first when the global budget is contended
+PRIORITY_USER = 0
+PRIORITY_RELAY = 1
+PRIORITY_STAFF = 2
+
+class TokenBucket:
+    """Rate limiter that hands out reservations instead of blocking.
+
+    reserve() books the next slot and returns how long the caller has to
+    wait for it, so callers are served in the order they reserved.
+    """
+
+    def __init__(self, rate, burst=1):
+        self.interval = 1.0 / rate
+        self.burst = burst
+        self._next_free = 0.0
+
+    def reserve(self):
+        now = time.monotonic()
+        next_free = max(self._next_free, now)
+        self._next_free = next_free + self.interval
+        return max(0.0, next_free - now - (self.burst - 1) * self.interval)
+
+    def pause(self, seconds):
+        """Block the bucket for the given number of seconds (e.g. after FloodWait)"""
+        self._next_free = max(self._next_free, time.monotonic() + seconds)
+
+    def idle_since(self, now):
+        """Seconds since the bucket was last full again; a fresh bucket behaves the same"""
+        return now - self._next_free
+
+class SendScheduler:
+    """Routes every outbound Telegram call through shared rate limits.
+
+    Each destination chat has its own token bucket (about 1 msg/s for private
+    chats, 20 msg/min for groups and channels) and all calls share a global
+    bucket (about 30 msg/s). When the global budget is contended, waiting
+    calls are released by priority. FloodWait errors pause the affected chat
+    and the call is retried with backoff instead of being dropped. Buckets
+    of chats that have been idle for BUCKET_IDLE_TIMEOUT seconds are swept
+    at most once per timeout, so their number follows the active chats
+    rather than every chat ever written to.
+    """
+
+    BUCKET_IDLE_TIMEOUT = 60
+
+    def __init__(self, global_rate=SEND_GLOBAL_RATE, private_rate=SEND_PRIVATE_RATE,
+                 group_rate_per_minute=SEND_GROUP_RATE_PER_MINUTE, max_retries=SEND_MAX_RETRIES):
+        self.global_bucket = TokenBucket(global_rate, burst=int(global_rate))
+        self.private_rate = private_rate
+        self.group_rate = group_rate_per_minute / 60.0
+        self.group_burst = int(group_rate_per_minute)
+        self.max_retries = max_retries
+        self._chat_buckets = {}
+        self._next_sweep = time.monotonic() + self.BUCKET_IDLE_TIMEOUT
+        self._waiters = []
+        self._sequence = itertools.count()
+        self._wakeup = None
+        self._dispatcher = None
+
+    def _bucket_for(self, chat_id):
+        now = time.monotonic()
+        if now >= self._next_sweep:
+            self._sweep_buckets(now)
+
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            if isinstance(chat_id, int) and chat_id < 0:
+                bucket = TokenBucket(self.group_rate, burst=self.group_burst)
+            else:
+                bucket = TokenBucket(self.private_rate, burst=3)
+            self._chat_buckets[chat_id] = bucket
+        return bucket
+
+    def _sweep_buckets(self, now):
+        self._next_sweep = now + self.BUCKET_IDLE_TIMEOUT
+        idle = [
+            chat_id for chat_id, bucket in self._chat_buckets.items()
+            if bucket.idle_since(now) > self.BUCKET_IDLE_TIMEOUT
+        ]
+        for chat_id in idle:
+            del self._chat_buckets[chat_id]
+        if idle:
+            logger.debug("Dropped %s idle chat rate buckets, %s left", len(idle), len(self._chat_buckets))
+
+    @property
+    def backlog(self):
+        """Number of calls waiting for the global budget"""
+        return len(self._waiters)
+
+    def _ensure_dispatcher(self):
+        if self._dispatcher is None or self._dispatcher.done():
+            self._wakeup = asyncio.Event()
+            self._dispatcher = asyncio.get_running_loop().create_task(self._dispatch())
+
+    async def _dispatch(self):
+        while True:
+            if not self._waiters:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            delay = self.global_bucket.reserve()
+            if delay:
+                await asyncio.sleep(delay)
+
+            # The top waiter may have changed while we slept: always serve the best one
+            while self._waiters:
+                _, _, future = heapq.heappop(self._waiters)
+                if not future.done():
+                    future.set_result(None)
+                    break
+
+    async def _acquire_global(self, priority):
+        self._ensure_dispatcher()
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._sequence), future))
+        self._wakeup.set()
+        await future
+
+    async def submit(self, chat_id, method, *args, priority=PRIORITY_USER, **kwargs):
+        """Await method(*args, **kwargs) once chat_id and the global budget allow it"""
+        bucket = self._bucket_for(chat_id)
+        name = api_method_name(method, args)
+
+        for attempt in range(self.max_retries + 1):
+            delay = bucket.reserve()
+            if delay:
+                await asyncio.sleep(delay)
+            await self._acquire_global(priority)
+
+            started = time.perf_counter()
+            try:
+                return await method(*args, **kwargs)
+            except FloodWait as e:
+                FLOOD_WAITS.labels(name).inc()
+                if attempt == self.max_retries:
+                    logger.error("Giving up on %s to %s after %s FloodWaits", method.__name__, chat_id, attempt + 1)
+                    raise
+
+                backoff = e.value + min(2 ** attempt, 30)
+                logger.warning("FloodWait of %ss on %s to %s, retrying in %ss", e.value, method.__name__, chat_id, backoff)
+                bucket.pause(backoff)
+            except Exception:
+                API_ERRORS.labels(name).inc()
+                raise
+            finally:
+                API_CALL_SECONDS.labels(name).observe(time.perf_counter() - started)
+
+def api_method_name(method, args):
+    """Metric label for an API call: the client method's name, or the raw
+    request type for client.invoke(...)"""
+    if method.__name__ == "invoke" and args:
+        return type(args[0]).__name__
+    return method.__name__
+
+scheduler = SendScheduler()
+
+async def send(method, chat_id, *args, priority=PRIORITY_USER, **kwargs):
+    """Call a client method whose first argument is the destination chat, e.g.
+    send(client.send_message, chat_id, text), through the send scheduler"""
+    return await scheduler.submit(chat_id, method, chat_id, *args, priority=priority, **kwargs)
+
+async def reply(message, *args, priority=PRIORITY_USER, **kwargs):
+    """message.reply(...) through the send scheduler"""
+    return await scheduler.submit(message.chat.id, message.reply, *args, priority=priority, **kwargs)
@@ -0,0 +1,163 @@
+import time
+from config import SLA_REPLY_TIMEOUT, TICKET_IDLE_WARNING, TICKET_IDLE_CLOSE
+from utils.ticket_store import store
+from utils.timers import timers
+from utils.outbox import outbox
+from utils.sender import send
+from utils.dispatcher import dispatcher
+from utils.assignment import assignments
+from utils.utils import format_timestamp
+from utils.ticket_manager import (
+    close_ticket, send_to_support_staff, enqueue_closure_jobs
+)
+from helper import get_logger
+
+logger = get_logger(__name__)
+
+# Seconds before an auto-close that failed (e.g. the archive was unwritable) is tried again
+AUTO_CLOSE_RETRY_DELAY = 300
+
+def record_activity(client, user_id, sender):
+    """Record activity on a ticket and move its deadlines.
+
+    Every message pushes the idle deadline back; a user message starts the
+    staff reply SLA unless it is already running, a staff reply stops it.
+    Each reschedule is one push onto the timer heap.
+    """
+    now = time.time()
+    fields = {"last_activity_at": now, "idle_warned_at": None}
+
+    if sender == "staff":
+        fields["awaiting_reply_since"] = None
+        timers.cancel(("sla", str(user_id)))
+    elif not timers.pending(("sla", str(user_id))):
+        ticket = store.get_ticket(user_id)
+        if ticket is not None and not ticket.awaiting_reply_since:
+            fields["awaiting_reply_since"] = now
+            fields["sla_reminded"] = False
+            _schedule_sla(user_id, now)
+
+    if store.update_ticket(user_id, **fields) is not None:
+        _schedule_idle(client, user_id, now, warned=False)
+
+def restore_ticket_timers(client):
+    """Re-arm SLA and idle deadlines of open tickets after a restart"""
+    now = time.time()
+    for user_id, ticket in store.tracking.items():
+        last_activity_at = ticket.last_activity_at or ticket.timestamp or now
+        _schedule_idle(client, user_id, last_activity_at, warned=bool(ticket.idle_warned_at))
+
+        if ticket.awaiting_reply_since and not ticket.sla_reminded:
+            _schedule_sla(user_id, ticket.awaiting_reply_since)
+
+def _schedule_sla(user_id, since):
+    if SLA_REPLY_TIMEOUT > 0:
+        timers.schedule(("sla", str(user_id)), since + SLA_REPLY_TIMEOUT, _sla_expired, user_id)
+
+def _schedule_idle(client, user_id, last_activity_at, warned):
+    if TICKET_IDLE_CLOSE > 0 and (warned or TICKET_IDLE_WARNING <= 0):
+        timers.schedule(("idle", str(user_id)), last_activity_at + TICKET_IDLE_CLOSE, _idle_close, client, user_id)
+    elif TICKET_IDLE_WARNING > 0:
+        timers.schedule(("idle", str(user_id)), last_activity_at + TICKET_IDLE_WARNING, _idle_warn, client, user_id)
+
+def _sla_expired(user_id):
+    ticket = store.update_ticket(user_id, sla_reminded=True)
+    if ticket is None or not ticket.awaiting_reply_since:
+        return
+
+    logger.warning("Ticket of user %s has waited %.0f minutes for a staff reply", user_id, SLA_REPLY_TIMEOUT / 60)
+    outbox.enqueue("sla_reminder", {"user_id": str(user_id)}, key=user_id)
+
+def _idle_warn(client, user_id):
+    ticket = store.update_ticket(user_id, idle_warned_at=time.time())
+    if ticket is None:
+        return
+
+    outbox.enqueue("warn_idle_ticket", {"user_id": str(user_id)}, key=user_id)
+    _schedule_idle(client, user_id, ticket.last_activity_at or time.time(), warned=True)
+
+def _idle_close(client, user_id):
+    # Run in the ticket's dispatcher lane so it cannot interleave with a message being handled
+    dispatcher.submit(int(user_id), auto_close_ticket, client, user_id)
+
+@outbox.job("sla_reminder")
+async def send_sla_reminder(client, payload):
+    user_id = payload["user_id"]
+    ticket_data = store.get_ticket(user_id)
+    if ticket_data is None or not ticket_data.awaiting_reply_since:
+        return
+
+    notification = (
+        f"⏳ SLA REMINDER\n\n"
+        f"👤 From: {ticket_data.user_name or 'Unknown'} (ID: {user_id})\n"
+        f"📝 Category: {(ticket_data.issue_type or 'Unknown').capitalize()}\n"
+        f"⏰ Waiting for a reply since {format_timestamp(ticket_data.awaiting_reply_since)}\n\n"
+    )
+
+    if ticket_data.channel_message_url:
+        notification += f"🔗 [View Ticket in Channel]({ticket_data.channel_message_url})"
+
+    await send_to_support_staff(
+        client, notification, description="SLA reminder", staff_ids=assignments.recipients(user_id)
+    )
+
+@outbox.job("warn_idle_ticket")
+async def send_idle_warning(client, payload):
+    user_id = payload["user_id"]
+    ticket_data = store.get_ticket(user_id)
+    if ticket_data is None or not ticket_data.idle_warned_at:
+        return
+
+    close_at = (ticket_data.last_activity_at or time.time()) + TICKET_IDLE_CLOSE
+    await send(
+        client.send_message,
+        int(user_id),
+        f"⏳ Your ticket has been inactive for a while and will be closed automatically on {format_timestamp(close_at)}.\n"
+        "Send a message if you still need help, or use /close_ticket if your issue is resolved."
+    )
+
+async def auto_close_ticket(client, user_id):
+    """Close a ticket that stayed idle past TICKET_IDLE_CLOSE through the regular closure path"""
+    ticket_data = store.get_ticket(user_id)
+    if ticket_data is None:
+        return
+
+    last_activity_at = ticket_data.last_activity_at or 0
+    if last_activity_at + TICKET_IDLE_CLOSE > time.time():
+        # Activity arrived after the timer fired
+        _schedule_idle(client, user_id, last_activity_at, warned=bool(ticket_data.idle_warned_at))
+        return
+
+    logger.info("Auto-closing ticket of user %s after %.1fh without activity", user_id, TICKET_IDLE_CLOSE / 3600)
+    success, result = await close_ticket(client, user_id, "Auto-close", is_staff=True)
+    if not success:
+        logger.error("Error auto-closing ticket of user %s, retrying in %ss: %s", user_id, AUTO_CLOSE_RETRY_DELAY, result)
+        timers.schedule(("idle", str(user_id)), time.time() + AUTO_CLOSE_RETRY_DELAY, _idle_close, client, user_id)
+        return
+
+    timestamp = result.get("timestamp", "")
+    issue_type = result.get("issue_type", "").capitalize()
+    channel_url = result.get("channel_url", "")
+
+    notification = (
+        f"🔒 Your ticket has been closed because there was no activity for a while.\n\n"
+        f"📝 Category: {issue_type}\n"
+        f"⏰ Closed on: {timestamp}\n\n"
+        "If you still need help, please use /create_ticket to create a new ticket."
+    )
+
+    staff_notification = (
+        f"🔒 TICKET #{result['ticket_id']} AUTO-CLOSED\n\n"
+        f"👤 User: {ticket_data.user_name or 'Unknown'} (ID: {user_id})\n"
+        f"📝 Category: {issue_type}\n"
+        f"⏰ Closed on: {timestamp}\n"
+        f"💤 Reason: no activity since {format_timestamp(last_activity_at)}\n"
+    )
+
+    if channel_url:
+        staff_notification += f"🔗 [View Ticket]({channel_url})"
+
+    enqueue_closure_jobs(
+        user_id, result["ticket"], "Auto-close", timestamp, is_staff=True, reason="automatically after inactivity",
+        user_notification=notification, staff_notification=staff_notification
+    )
@@ -1,13 +1,109 @@
+import asyncio
+import json
 import logging
+import time
 from pyrogram.enums import ParseMode
-from config import SUPPORT_STAFF_IDS
-from utils.data_manager import load_tracking_data
+from config import (
+    SUPPORT_STAFF_IDS, STAFF_FANOUT_CONCURRENCY, USER_CACHE_SIZE, USER_CACHE_TTL,
+    NOTIFY_DIGEST_WINDOW, NOTIFY_DIGEST_MAX_ITEMS
+)
+from utils.ticket_store import store
+from utils.sender import send, PRIORITY_RELAY, PRIORITY_STAFF
+from utils.outbox import outbox
+from utils.cache import TTLCache
+from utils.timers import timers
+from utils.assignment import assignments, is_staff_quiet
+from utils.archive import archive
+from utils.topics import close_ticket_topic
+from utils.media import CAPTIONED_MEDIA
+from utils.models import Ticket
 from utils.utils import get_channel_message_url
-from helper import logger
+from helper import get_logger
 
-async def notify_support_staff_about_new_ticket(client, user_id, user_name, issue_type, timestamp, description_text, channel_url=None):
+logger = get_logger(__name__)
+
+user_profiles = TTLCache(maxsize=USER_CACHE_SIZE, ttl=USER_CACHE_TTL)
+
+# Open notification windows per ticket: user_id -> {"user_name", "pending", "closes_at"}.
+# Windows holding messages are mirrored into the store as digest:<user_id> states
+# so a restart delivers them instead of dropping them.
+_digests = {}
+DIGEST_STATE_PREFIX = "digest:"
+
+def format_user_name(user):
+    user_name = f"{user.first_name}"
+    if user.username:
+        user_name += f" (@{user.username})"
+    return user_name
+
+def remember_user(user):
+    """Cache the display name of a user we just received an update from"""
+    user_name = format_user_name(user)
+    user_profiles.set(user.id, user_name)
+    return user_name
+
+async def get_user_display_name(client, user_id):
+    """Display name of a user from their ticket, the profile cache, or Telegram as a last resort"""
+    ticket_data = store.get_ticket(user_id)
+    if ticket_data and ticket_data.user_name:
+        return ticket_data.user_name
+
+    user_name = user_profiles.get(int(user_id))
+    if user_name is None:
+        user = await send(client.get_users, int(user_id))
+        user_name = remember_user(user)
+    return user_name
+
+async def send_to_support_staff(client, text, exclude_id=None, description="notification", staff_ids=None):
+    """Send a Markdown message to every support staff member (or only to
+    staff_ids) concurrently.
+
+    Staff members inside a /quiet window are skipped. At most
+    STAFF_FANOUT_CONCURRENCY sends are in flight at once. A send that fails
+    is queued again in the outbox for that staff member alone, so it gets
+    the outbox's retries and backoff without repeating the message to
+    everyone else. Returns (sent_count, failures, elapsed) where failures
+    maps staff id to the exception raised for that recipient.
+    """
+    semaphore = asyncio.Semaphore(STAFF_FANOUT_CONCURRENCY)
+    recipients = [
+        staff_id for staff_id in (SUPPORT_STAFF_IDS if staff_ids is None else staff_ids)
+        if staff_id != exclude_id and not is_staff_quiet(staff_id)
+    ]
+    failures = {}
+
+    async def notify(staff_id):
+        async with semaphore:
+            try:
+                await send(
+                    client.send_message,
+                    staff_id,
+                    text,
+                    disable_web_page_preview=True,
+                    parse_mode=ParseMode.MARKDOWN,
+                    priority=PRIORITY_STAFF
+                )
+            except Exception as e:
+                failures[staff_id] = e
+                logger.error("Failed to send %s to support staff %s, queued for retry: %s", description, staff_id, e)
+                outbox.enqueue("retry_staff_notification", {
+                    "staff_id": staff_id,
+                    "text": text,
+                    "description": description
+                }, key=f"staff:{staff_id}")
+
+    started = time.monotonic()
+    await asyncio.gather(*(notify(staff_id) for staff_id in recipients))
+    elapsed = time.monotonic() - started
+
+    sent_count = len(recipients) - len(failures)
+    logger.info("Sent %s to %s/%s support staff in %.3fs", description, sent_count, len(recipients), elapsed)
+    return sent_count, failures, elapsed
+
+async def notify_support_staff_about_new_ticket(client, user_id, user_name, issue_type, timestamp, description_text,
+                                               channel_url=None, assigned_staff_id=None, ticket_id=None):
     notification = (
-        f"🎫 NEW TICKET\n\n"
+        f"🎫 NEW TICKET{f' #{ticket_id}' if ticket_id else ''}\n\n"
         f"👤 From: {user_name} (ID: {user_id})\n"
         f"📝 Category: {issue_type.capitalize()}\n"
         f"⏰ Time: {timestamp}\n\n"
@@ -21,19 +117,50 @@ async def notify_support_staff_about_new_ticket(client, user_id, user_name, issu
     if channel_url:
         notification += f"📎 [View in Channel]({channel_url})"
 
-    for staff_id in SUPPORT_STAFF_IDS:
-        try:
-            await client.send_message(
-                staff_id,
-                notification,
-                disable_web_page_preview=True,
-                parse_mode=ParseMode.MARKDOWN
-            )
-            logger.info(f"Sent new ticket notification to support staff {staff_id}")
-        except Exception as e:
-            logger.error(f"Failed to notify support staff {staff_id}: {e}")
+    if assigned_staff_id is not None:
+        notification += "\n\n🙋 This ticket is assigned to you."
+        await send_to_support_staff(
+            client, notification, description="new ticket assignment", staff_ids=[assigned_staff_id]
+        )
+        return
+
+    await send_to_support_staff(client, notification, description="new ticket notification")
+
+def _message_links(user_id, discussion_group_id, discussion_msg_id):
+    message_links = []
+
+    if discussion_group_id and discussion_msg_id:
+        discussion_url = get_channel_message_url(discussion_group_id, discussion_msg_id)
+        message_links.append(f"📎 [View in Group]({discussion_url})")
+
+    ticket_data = store.get_ticket(user_id)
+    if ticket_data and ticket_data.channel_message_url:
+        channel_url = ticket_data.channel_message_url
+        message_links.append(f"🔗 [View Ticket in Channel]({channel_url})")
+
+    return message_links
 
 async def notify_support_staff(client, user_id, user_name, message_text, discussion_group_id, discussion_msg_id):
+    """Tell support staff about a new user message.
+
+    The first message of a ticket is announced right away and opens a
+    NOTIFY_DIGEST_WINDOW for it. Messages arriving while the window is open
+    are collected and sent as one digest when it closes, and the window
+    stays open as long as the user keeps writing.
+    """
+    digest = _digests.get(str(user_id))
+    if digest is not None:
+        digest["user_name"] = user_name
+        digest["pending"].append({
+            "text": message_text,
+            "discussion_group_id": discussion_group_id,
+            "discussion_msg_id": discussion_msg_id
+        })
+        store.set_state(f"{DIGEST_STATE_PREFIX}{user_id}", json.dumps(digest))
+        return
+
+    if NOTIFY_DIGEST_WINDOW > 0:
+        _open_digest_window(user_id, user_name)
 
     notification = (
         f"🔔 New message from {user_name} (ID: {user_id})\n\n"
@@ -44,81 +171,289 @@ async def notify_support_staff(client, user_id, user_name, message_text, discuss
     else:
         notification += "Message: [Media without text]\n\n"
  
-    message_links = []
-
-    if discussion_group_id and discussion_msg_id:
-        discussion_url = get_channel_message_url(discussion_group_id, discussion_msg_id)
-        message_links.append(f"📎 [View in Group]({discussion_url})")
-
-    tracking_data = load_tracking_data()
-    if str(user_id) in tracking_data and "channel_message_url" in tracking_data[str(user_id)]:
-        channel_url = tracking_data[str(user_id)]["channel_message_url"]
-        message_links.append(f"🔗 [View Ticket in Channel]({channel_url})")
+    message_links = _message_links(user_id, discussion_group_id, discussion_msg_id)
 
     if message_links:
         notification += " | ".join(message_links)
  
-    for staff_id in SUPPORT_STAFF_IDS:
-        try:
-            await client.send_message(
-                staff_id,
-                notification,
-                disable_web_page_preview=True,
-                parse_mode=ParseMode.MARKDOWN
-            )
-            logger.info(f"Sent message notification to support staff {staff_id}")
-        except Exception as e:
-            logger.error(f"Failed to notify support staff {staff_id}: {e}")
+    await send_to_support_staff(
+        client, notification, description="message notification", staff_ids=assignments.recipients(user_id)
+    )
+
+def _open_digest_window(user_id, user_name):
+    closes_at = time.time() + NOTIFY_DIGEST_WINDOW
+    _digests[str(user_id)] = {"user_name": user_name, "pending": [], "closes_at": closes_at}
+    timers.schedule(("digest", str(user_id)), closes_at, _close_digest_window, user_id)
+
+def _close_digest_window(user_id):
+    """Queue the digest of a window that just closed, keeping the window open while messages keep coming"""
+    digest = _digests.pop(str(user_id), None)
+    if not digest or not digest["pending"]:
+        return
+
+    store.clear_state(f"{DIGEST_STATE_PREFIX}{user_id}")
+    outbox.enqueue("notify_support_digest", {
+        "user_id": user_id,
+        "user_name": digest["user_name"],
+        "messages": digest["pending"]
+    }, key=user_id)
+    _open_digest_window(user_id, digest["user_name"])
+
+def discard_notification_digest(user_id):
+    """Drop the open notification window of a ticket (e.g. when it is closed)"""
+    _digests.pop(str(user_id), None)
+    store.clear_state(f"{DIGEST_STATE_PREFIX}{user_id}")
+    timers.cancel(("digest", str(user_id)))
+
+def restore_notification_digests():
+    """Re-open the notification windows that held messages before a restart;
+    windows that closed while the bot was down are sent right away"""
+    for key, state in list(store.states.items()):
+        if not key.startswith(DIGEST_STATE_PREFIX):
+            continue
+
+        user_id = key[len(DIGEST_STATE_PREFIX):]
+        if not store.has_ticket(user_id):
+            store.clear_state(key)
+            continue
+
+        digest = json.loads(state["state"])
+        _digests[user_id] = digest
+        timers.schedule(("digest", user_id), digest["closes_at"], _close_digest_window, user_id)
+        logger.info("Restored notification digest of user %s with %s messages", user_id, len(digest["pending"]))
+
+async def notify_support_staff_digest(client, user_id, user_name, messages):
+    count = len(messages)
+    notification = f"🔔 {count} new message{'s' if count != 1 else ''} from {user_name} (ID: {user_id})\n\n"
+
+    for message in messages[:NOTIFY_DIGEST_MAX_ITEMS]:
+        text = message["text"]
+        line = f"{text[:60]}{'...' if len(text) > 60 else ''}" if text else "[Media without text]"
+
+        if message["discussion_group_id"] and message["discussion_msg_id"]:
+            discussion_url = get_channel_message_url(message["discussion_group_id"], message["discussion_msg_id"])
+            line += f" ([View]({discussion_url}))"
+        notification += f"• {line}\n"
 
-async def close_ticket(client, tracking_data, conversations_data, user_id, closer_name, is_staff=False):
+    if count > NOTIFY_DIGEST_MAX_ITEMS:
+        notification += f"• ...and {count - NOTIFY_DIGEST_MAX_ITEMS} more\n"
+
+    ticket_data = store.get_ticket(user_id)
+    if ticket_data and ticket_data.channel_message_url:
+        notification += f"\n🔗 [View Ticket in Channel]({ticket_data.channel_message_url})"
+
+    await send_to_support_staff(
+        client, notification, description="message digest", staff_ids=assignments.recipients(user_id)
+    )
+
+async def notify_support_staff_about_escalation(client, user_id, assignee_quiet=False):
+    ticket_data = store.get_ticket(user_id)
+    if ticket_data is None:
+        return
+
+    assignee = ticket_data.assigned_staff_id
+    if assignee_quiet:
+        reason = "who has muted notifications"
+    else:
+        waited_minutes = int((time.time() - (ticket_data.assigned_at or time.time())) // 60)
+        reason = f"no reply after {waited_minutes} minutes"
+
+    notification = (
+        f"⏰ TICKET #{ticket_data.ticket_id} ESCALATED\n\n"
+        f"👤 From: {ticket_data.user_name or 'Unknown'} (ID: {user_id})\n"
+        f"📝 Category: {(ticket_data.issue_type or 'Unknown').capitalize()}\n"
+        f"🙋 Assigned to staff ID {assignee}, {reason}\n\n"
+        f"Follow-up notifications for this ticket now go to all staff.\n"
+    )
+
+    if ticket_data.channel_message_url:
+        notification += f"🔗 [View Ticket in Channel]({ticket_data.channel_message_url})"
+
+    await send_to_support_staff(client, notification, description="escalation notification")
+
+@outbox.job("retry_staff_notification")
+async def retry_staff_notification(client, payload):
+    """Deliver a staff notification that failed for one recipient; raising
+    on failure lets the outbox back off and try again"""
+    staff_id = payload["staff_id"]
+    if is_staff_quiet(staff_id):
+        return
+
+    await send(
+        client.send_message,
+        staff_id,
+        payload["text"],
+        disable_web_page_preview=True,
+        parse_mode=ParseMode.MARKDOWN,
+        priority=PRIORITY_STAFF
+    )
+    logger.info("Sent %s to support staff %s on retry", payload["description"], staff_id)
+
+@outbox.job("notify_new_ticket")
+async def deliver_new_ticket_notification(client, payload):
+    await notify_support_staff_about_new_ticket(client, **payload)
+
+@outbox.job("notify_support_staff")
+async def deliver_support_staff_notification(client, payload):
+    await notify_support_staff(client, **payload)
+
+@outbox.job("escalate_ticket")
+async def deliver_escalation_notification(client, payload):
+    await notify_support_staff_about_escalation(client, **payload)
+
+@outbox.job("notify_support_digest")
+async def deliver_support_staff_digest(client, payload):
+    await notify_support_staff_digest(client, **payload)
+
+async def close_ticket(client, user_id, closer_name, is_staff=False):
+    """Commit a ticket closure. Returns (success, result).
+
+    Archiving the ticket with its transcript and removing it from the open
+    tickets are the only steps that have to finish before the closer gets a
+    confirmation; the removal is flushed right away (a single transaction on
+    the SQLite backend). If the transcript cannot be archived the ticket is
+    left open, so its conversation is never dropped. The returned result
+    carries the removed ticket so callers can hand the channel edit and
+    notifications to enqueue_closure_jobs().
+    """
     try:
-        user_id_str = str(user_id)
+        ticket_info = store.get_ticket(user_id)
 
-        if user_id_str not in tracking_data:
+        if ticket_info is None:
             return False, "No open ticket found."
 
-        ticket_info = tracking_data[user_id_str]
-        channel_id = ticket_info.get("channel_id")
-        channel_msg_id = ticket_info.get("channel_message_id")
-        channel_message_url = ticket_info.get("channel_message_url", "")
-        issue_type = ticket_info.get("issue_type", "Unknown")
-
         from utils.utils import get_timestamp
         close_timestamp = get_timestamp()
 
-        if channel_id and channel_msg_id:
-            try:
-                channel_message = await client.get_messages(channel_id, channel_msg_id)
-                original_text = channel_message.text or channel_message.caption or ""
-                
-                if "TICKET CLOSED" not in original_text:
-                    if is_staff:
-                        closure_text = f"{original_text}\n\n🔒 TICKET CLOSED by staff {closer_name} on {close_timestamp}"
-                    else:
-                        closure_text = f"{original_text}\n\n🔒 TICKET CLOSED by user on {close_timestamp}"
-
-                    if channel_message.media:
-                        await client.edit_message_caption(
-                            channel_id,
-                            channel_msg_id,
-                            caption=closure_text
-                        )
-                    else:
-                        await client.edit_message_text(
-                            channel_id,
-                            channel_msg_id,
-                            closure_text
-                        )
-                    logger.info(f"Edited channel message {channel_msg_id} to mark ticket as closed")
-            except Exception as e:
-                logger.error(f"Error editing channel message: {e}")
+        try:
+            archive.append(user_id, ticket_info, store.get_conversation(user_id), closed_by=closer_name if is_staff else "user")
+        except Exception as e:
+            logger.error("Error archiving ticket of user %s, leaving it open: %s", user_id, e)
+            return False, "The ticket could not be archived, so it was left open. Please try closing it again later."
+
+        store.remove_ticket(user_id)
+        store.flush()
+        discard_notification_digest(user_id)
+        assignments.release(user_id, ticket_info)
+        timers.cancel(("sla", str(user_id)))
+        timers.cancel(("idle", str(user_id)))
+        logger.info("Moved ticket and conversation of user %s to the archive", user_id)
 
         return True, {
+            "ticket": ticket_info,
+            "ticket_id": ticket_info.ticket_id,
             "timestamp": close_timestamp,
-            "channel_url": channel_message_url,
-            "issue_type": issue_type,
+            "channel_url": ticket_info.channel_message_url or "",
+            "issue_type": ticket_info.issue_type or "Unknown",
             "closer_name": closer_name if is_staff else "user"
         }
     except Exception as e:
-        logger.error(f"Error in close_ticket: {e}")
-        return False, str(e)
\ No newline at end of file
+        logger.error("Error in close_ticket: %s", e)
+        return False, str(e)
+
+async def mark_channel_ticket_closed(client, ticket_info, closer_name, close_timestamp, is_staff=False, reason=None):
+    """Append the closed marker to the ticket's channel post with a single edit
+    and, in topics mode, close the ticket's forum topic. A failed edit raises
+    so the outbox retries it"""
+    channel_id = ticket_info.channel_id
+    channel_msg_id = ticket_info.channel_message_id
+
+    if ticket_info.topic_id is not None:
+        try:
+            await close_ticket_topic(client, ticket_info.topic_id, ticket_info.discussion_group_id or channel_id)
+        except Exception as e:
+            logger.error("Error closing forum topic %s: %s", ticket_info.topic_id, e)
+
+    if not (channel_id and channel_msg_id):
+        return
+
+    original_text = ticket_info.channel_text
+    has_media = ticket_info.media_type in CAPTIONED_MEDIA
+
+    if original_text is None:
+        # Tickets created before the channel text was cached in the record
+        channel_message = await send(client.get_messages, channel_id, channel_msg_id, priority=PRIORITY_RELAY)
+        original_text = channel_message.text or channel_message.caption or ""
+        has_media = bool(channel_message.media)
+
+    if "TICKET CLOSED" in original_text:
+        return
+
+    if reason:
+        closure_text = f"{original_text}\n\n🔒 TICKET CLOSED {reason} on {close_timestamp}"
+    elif is_staff:
+        closure_text = f"{original_text}\n\n🔒 TICKET CLOSED by staff {closer_name} on {close_timestamp}"
+    else:
+        closure_text = f"{original_text}\n\n🔒 TICKET CLOSED by user on {close_timestamp}"
+
+    if has_media:
+        await send(
+            client.edit_message_caption,
+            channel_id,
+            channel_msg_id,
+            caption=closure_text,
+            priority=PRIORITY_RELAY
+        )
+    else:
+        await send(
+            client.edit_message_text,
+            channel_id,
+            channel_msg_id,
+            closure_text,
+            priority=PRIORITY_RELAY
+        )
+    logger.info("Edited channel message %s to mark ticket as closed", channel_msg_id)
+
+def enqueue_closure_jobs(user_id, ticket_info, closer_name, close_timestamp, is_staff=False, reason=None,
+                         user_notification=None, staff_notification=None, exclude_id=None):
+    """Queue the follow-up work of a committed closure in the outbox: the
+    channel edit, the notice to the user and the staff notification. Each
+    gets its own key so they are delivered in parallel, and all of them
+    survive a restart"""
+    outbox.enqueue("mark_ticket_closed", {
+        "ticket": ticket_info.to_dict(),
+        "closer_name": closer_name,
+        "close_timestamp": close_timestamp,
+        "is_staff": is_staff,
+        "reason": reason
+    }, key=f"{user_id}:closed")
+
+    if user_notification:
+        outbox.enqueue("closure_notice", {
+            "user_id": str(user_id),
+            "notification": user_notification
+        }, key=f"{user_id}:notice")
+
+    if staff_notification:
+        outbox.enqueue("closure_staff_notification", {
+            "text": staff_notification,
+            "exclude_id": exclude_id
+        }, key=f"{user_id}:staff")
+
+@outbox.job("mark_ticket_closed")
+async def deliver_ticket_closed_marker(client, payload):
+    await mark_channel_ticket_closed(
+        client,
+        Ticket.from_dict(payload["ticket"]),
+        payload["closer_name"],
+        payload["close_timestamp"],
+        is_staff=payload["is_staff"],
+        reason=payload["reason"]
+    )
+
+@outbox.job("closure_notice")
+async def deliver_closure_notice(client, payload):
+    await send(
+        client.send_message,
+        int(payload["user_id"]),
+        payload["notification"],
+        disable_web_page_preview=True,
+        parse_mode=ParseMode.MARKDOWN
+    )
+    logger.info("Sent ticket closure notification to user %s", payload["user_id"])
+
+@outbox.job("closure_staff_notification")
+async def deliver_closure_staff_notification(client, payload):
+    await send_to_support_staff(
+        client, payload["text"], exclude_id=payload["exclude_id"], description="ticket closure notification"
+    )
@@ -0,0 +1,323 @@
+import asyncio
+import time
+from config import STORE_FLUSH_DELAY
+from utils.data_manager import get_backend
+from utils.models import Ticket, ConversationEntry, Sender, as_ticket, as_entry
+from utils.search import search_index
+from utils.archive import archive
+from utils.metrics import registry, timer, STORAGE_SECONDS
+from helper import get_logger, set_ticket_resolver
+
+logger = get_logger(__name__)
+
+class TicketStore:
+    """In-memory ticket and conversation state with write-behind persistence.
+
+    Data is loaded once at startup and every read is served from memory.
+    Mutations are handed to the storage backend (see utils/data_manager.py)
+    and a single debounced flush is scheduled, so a burst of updates costs
+    one write instead of one full rewrite per update. Call flush() on
+    shutdown to persist the rest.
+
+    Reverse indexes map channel and discussion-group message ids back to
+    their ticket so replies and forwards resolve without scanning history.
+    Together with the private-chat index they form a bidirectional map
+    between the user's side and the staff side of every relayed message:
+    an entry records both ids, and each id resolves to the entry in O(1).
+    Private-chat message ids are unique across all of the bot's private
+    chats, so they can be looked up without knowing the chat.
+    """
+
+    def __init__(self, backend=None, flush_delay=STORE_FLUSH_DELAY):
+        self.backend = backend or get_backend()
+        self.flush_delay = flush_delay
+        self.tracking = {}
+        self.conversations = {}
+        self.states = {}
+        self._flush_handle = None
+        self.last_flush_at = None
+        self.dirty_since = None
+        self._last_ticket_number = None
+
+        self._user_by_channel_msg = {}
+        self._user_by_discussion_msg = {}
+        self._entry_by_discussion_msg = {}
+        self._user_by_topic = {}
+        self._user_by_private_msg = {}
+        self._entry_by_private_msg = {}
+
+    def load(self):
+        """Load tracking and conversation data from the storage backend"""
+        with timer(STORAGE_SECONDS, f"{self.backend.name}_load"):
+            tracking, conversations = self.backend.load()
+        self.tracking = {user_id: Ticket.from_dict(ticket) for user_id, ticket in tracking.items()}
+        self.conversations = {
+            user_id: [ConversationEntry.from_dict(entry) for entry in messages]
+            for user_id, messages in conversations.items()
+        }
+        self.states = self.backend.load_states()
+        self._rebuild_indexes()
+        logger.info("Ticket store loaded %s open tickets from %s backend", len(self.tracking), self.backend.name)
+
+    def _rebuild_indexes(self):
+        self._user_by_channel_msg.clear()
+        self._user_by_discussion_msg.clear()
+        self._entry_by_discussion_msg.clear()
+        self._user_by_topic.clear()
+        self._user_by_private_msg.clear()
+        self._entry_by_private_msg.clear()
+
+        for user_id, ticket in self.tracking.items():
+            self._index_ticket(user_id, ticket)
+
+        for user_id, messages in self.conversations.items():
+            for entry in messages:
+                self._index_entry(user_id, entry)
+
+    def _index_ticket(self, user_id, ticket):
+        channel_msg_id = ticket.channel_message_id
+        if channel_msg_id is not None:
+            self._user_by_channel_msg[channel_msg_id] = user_id
+
+        discussion_msg_id = ticket.discussion_message_id
+        if discussion_msg_id is not None:
+            self._user_by_discussion_msg[discussion_msg_id] = user_id
+
+        if ticket.topic_id is not None:
+            self._user_by_topic[ticket.topic_id] = user_id
+
+    def _index_entry(self, user_id, entry):
+        for discussion_msg_id in self._discussion_ids(entry):
+            self._user_by_discussion_msg[discussion_msg_id] = user_id
+            self._entry_by_discussion_msg[discussion_msg_id] = entry
+
+        for private_msg_id in self._private_ids(entry):
+            self._user_by_private_msg[private_msg_id] = user_id
+            self._entry_by_private_msg[private_msg_id] = entry
+
+    @staticmethod
+    def _discussion_ids(entry):
+        """Discussion group message ids of an entry (several for an album),
+        including the header a user's media was relayed below"""
+        if entry.discussion_message_ids:
+            ids = entry.discussion_message_ids
+        else:
+            discussion_msg_id = entry.discussion_message_id
+            ids = () if discussion_msg_id is None else (discussion_msg_id,)
+
+        if entry.header_message_id is not None and entry.sender == Sender.USER:
+            ids += (entry.header_message_id,)
+        return ids
+
+    @staticmethod
+    def _private_ids(entry):
+        """Message ids of an entry in the user's private chat (several for an
+        album), including the header a staff reply's media was relayed below"""
+        ids = entry.message_ids or (() if entry.message_id is None else (entry.message_id,))
+
+        if entry.header_message_id is not None and entry.sender == Sender.STAFF:
+            ids += (entry.header_message_id,)
+        return ids
+
+    def _unindex(self, ticket, conversation):
+        if ticket:
+            self._user_by_channel_msg.pop(ticket.channel_message_id, None)
+            self._user_by_discussion_msg.pop(ticket.discussion_message_id, None)
+            self._user_by_topic.pop(ticket.topic_id, None)
+
+        for entry in conversation or []:
+            for discussion_msg_id in self._discussion_ids(entry):
+                self._user_by_discussion_msg.pop(discussion_msg_id, None)
+                self._entry_by_discussion_msg.pop(discussion_msg_id, None)
+            for private_msg_id in self._private_ids(entry):
+                self._user_by_private_msg.pop(private_msg_id, None)
+                self._entry_by_private_msg.pop(private_msg_id, None)
+
+    def find_user_by_channel_message(self, channel_message_id):
+        """Return the user id (str) owning a support channel post, or None"""
+        return self._user_by_channel_msg.get(channel_message_id)
+
+    def find_user_by_discussion_message(self, discussion_message_id):
+        """Return the user id (str) owning a discussion group message, or None"""
+        return self._user_by_discussion_msg.get(discussion_message_id)
+
+    def find_user_by_topic(self, topic_id):
+        """Return the user id (str) owning a discussion group forum topic, or None"""
+        return self._user_by_topic.get(topic_id)
+
+    def get_entry_by_discussion_message(self, discussion_message_id):
+        """Return the conversation entry relayed as a discussion group message, or None"""
+        return self._entry_by_discussion_msg.get(discussion_message_id)
+
+    def find_entry_by_private_message(self, private_message_id):
+        """Return (user_id, entry) for a message in a user's private chat with
+        the bot, or (None, None)"""
+        return (
+            self._user_by_private_msg.get(private_message_id),
+            self._entry_by_private_msg.get(private_message_id)
+        )
+
+    def has_ticket(self, user_id):
+        return str(user_id) in self.tracking
+
+    def get_ticket(self, user_id):
+        return self.tracking.get(str(user_id))
+
+    def allocate_ticket_number(self):
+        """Next ticket number. Numbers continue above every open and archived
+        ticket id, including the message ids older tickets were known by, so
+        they never collide; the counter itself needs no storage"""
+        if self._last_ticket_number is None:
+            open_ids = (ticket.ticket_id or 0 for ticket in self.tracking.values())
+            self._last_ticket_number = max(archive.max_ticket_id(), *open_ids, 0)
+        self._last_ticket_number += 1
+        return self._last_ticket_number
+
+    def create_ticket(self, user_id, ticket_data, first_entry=None):
+        """Register a new ticket and, optionally, its first conversation entry.
+        Plain dicts in the JSON schema are converted to models"""
+        user_id_str = str(user_id)
+        ticket_data = as_ticket(ticket_data)
+        self.tracking[user_id_str] = ticket_data
+        self.conversations.setdefault(user_id_str, [])
+        self._index_ticket(user_id_str, ticket_data)
+        self.backend.put_ticket(user_id_str, ticket_data)
+        self._schedule_flush()
+
+        if first_entry is not None:
+            self.append_message(user_id_str, first_entry)
+
+    def update_ticket(self, user_id, **fields):
+        """Update fields of an open ticket. Returns the ticket or None"""
+        ticket = self.tracking.get(str(user_id))
+        if ticket is None:
+            return None
+
+        ticket.update(fields)
+        if "channel_message_id" in fields or "discussion_message_id" in fields or "topic_id" in fields:
+            self._index_ticket(str(user_id), ticket)
+        self.backend.put_ticket(str(user_id), ticket)
+        self._schedule_flush()
+        return ticket
+
+    def get_conversation(self, user_id):
+        return self.conversations.get(str(user_id), [])
+
+    def append_message(self, user_id, entry):
+        entry = as_entry(entry)
+        self.conversations.setdefault(str(user_id), []).append(entry)
+        self._index_entry(str(user_id), entry)
+        self.backend.append_message(str(user_id), entry)
+        search_index.add(user_id, self.tracking.get(str(user_id)), entry)
+        self._schedule_flush()
+
+    def update_message(self, user_id, entry, **fields):
+        """Update fields of a conversation entry in place (edits, deletions,
+        late relays) and keep its indexes and search index row in step"""
+        entry.update(fields)
+        if "discussion_message_id" in fields or "header_message_id" in fields:
+            self._index_entry(str(user_id), entry)
+        self.backend.replace_message(str(user_id), entry)
+        if "deleted_at" in fields:
+            search_index.remove(user_id, entry)
+        elif "text" in fields:
+            search_index.replace(user_id, self.tracking.get(str(user_id)), entry)
+        self._schedule_flush()
+        return entry
+
+    def remove_ticket(self, user_id):
+        """Drop a ticket and its conversation. Returns (ticket, conversation)"""
+        user_id_str = str(user_id)
+        ticket = self.tracking.pop(user_id_str, None)
+        conversation = self.conversations.pop(user_id_str, None)
+        self._unindex(ticket, conversation)
+
+        if ticket is not None or conversation is not None:
+            self.backend.remove_ticket(user_id_str, len(conversation or []))
+            self._schedule_flush()
+
+        return ticket, conversation
+
+    def get_state(self, user_id):
+        """Return the user's conversation state string, or None if unset or expired"""
+        state = self.states.get(str(user_id))
+        if state is None:
+            return None
+
+        expires_at = state.get("expires_at")
+        if expires_at is not None and expires_at <= time.time():
+            return None
+        return state["state"]
+
+    def set_state(self, user_id, state, expires_at=None):
+        """Persist a conversation state (e.g. awaiting_description:billing)"""
+        record = {"state": state, "expires_at": expires_at}
+        self.states[str(user_id)] = record
+        self.backend.put_state(str(user_id), record)
+        self._schedule_flush()
+
+    def clear_state(self, user_id):
+        if self.states.pop(str(user_id), None) is not None:
+            self.backend.delete_state(str(user_id))
+            self._schedule_flush()
+
+    def _schedule_flush(self):
+        if self.dirty_since is None:
+            self.dirty_since = time.time()
+        if self._flush_handle is not None:
+            return
+
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # No event loop (scripts, maintenance tools): persist right away
+            self.flush()
+            return
+
+        self._flush_handle = loop.call_later(self.flush_delay, self.flush)
+
+    def flush(self):
+        """Persist every pending change through the storage backend"""
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+
+        try:
+            with timer(STORAGE_SECONDS, f"{self.backend.name}_flush"):
+                self.backend.flush(self.tracking, self.conversations, self.states)
+        except Exception as e:
+            logger.error("Error flushing ticket store: %s", e)
+            return
+
+        self.last_flush_at = time.time()
+        self.dirty_since = None
+
+    @property
+    def unflushed_seconds(self):
+        """How long the oldest change not yet written to disk has been waiting"""
+        return 0.0 if self.dirty_since is None else time.time() - self.dirty_since
+
+    def close(self):
+        """Flush pending changes and release the storage backend"""
+        self.flush()
+        self.backend.close()
+
+    def conversation_sizes(self):
+        """(total entries, entries in the longest conversation) across open tickets"""
+        sizes = [len(messages) for messages in self.conversations.values()]
+        return sum(sizes), max(sizes, default=0)
+
+store = TicketStore()
+
+set_ticket_resolver(lambda user_id: getattr(store.get_ticket(user_id), "ticket_id", None))
+
+registry.gauge("support_bot_open_tickets", "Open tickets", lambda: len(store.tracking))
+registry.gauge(
+    "support_bot_conversation_entries", "Messages held in open conversations",
+    lambda: store.conversation_sizes()[0]
+)
+registry.gauge(
+    "support_bot_conversation_entries_max", "Messages in the longest open conversation",
+    lambda: store.conversation_sizes()[1]
+)
+registry.gauge("support_bot_unflushed_seconds", "Age of the oldest change not yet flushed", lambda: store.unflushed_seconds)
@@ -0,0 +1,133 @@
+import asyncio
+import heapq
+import itertools
+import time
+from helper import get_logger
+
+logger = get_logger(__name__)
+
+class TimerHeap:
+    """Runs keyed callbacks at wall-clock deadlines from a single task.
+
+    All deadlines live in one min-heap, so scheduling or rescheduling a key
+    is O(log n) and nothing sleeps per key. Rescheduling or cancelling only
+    invalidates the previous heap entry; stale entries are skipped when they
+    reach the top. Once stale entries outnumber live timers by more than
+    STALE_RATIO the heap is rebuilt from the live ones, so its size follows
+    the number of timers rather than the number of reschedules.
+    """
+
+    STALE_RATIO = 2
+    # Small heaps are not worth rebuilding
+    STALE_MINIMUM = 64
+
+    def __init__(self):
+        self._heap = []
+        self._current = {}
+        self._stale = 0
+        self._sequence = itertools.count()
+        self._wakeup = None
+        self._task = None
+
+    def __len__(self):
+        return len(self._current)
+
+    def schedule(self, key, deadline, callback, *args):
+        """Call callback(*args) at the epoch deadline, replacing any timer for key"""
+        sequence = next(self._sequence)
+        replaced = key in self._current
+        self._current[key] = sequence
+        heapq.heappush(self._heap, (deadline, sequence, key, callback, args))
+        if replaced:
+            self._mark_stale()
+        self._ensure_running()
+
+        if self._heap[0][1] == sequence:
+            self._wakeup.set()
+
+    def cancel(self, key):
+        if self._current.pop(key, None) is not None:
+            self._mark_stale()
+
+    def _mark_stale(self):
+        self._stale += 1
+        if self._stale > max(self.STALE_RATIO * len(self._current), self.STALE_MINIMUM):
+            self._heap = [entry for entry in self._heap if self._current.get(entry[2]) == entry[1]]
+            heapq.heapify(self._heap)
+            self._stale = 0
+
+    def pending(self, key):
+        """Whether a timer is scheduled for key"""
+        return key in self._current
+
+    def _ensure_running(self):
+        if self._task is None or self._task.done():
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def _run(self):
+        while True:
+            while self._heap and self._current.get(self._heap[0][2]) != self._heap[0][1]:
+                heapq.heappop(self._heap)
+                self._stale -= 1
+
+            self._wakeup.clear()
+            if not self._heap:
+                await self._wakeup.wait()
+                continue
+
+            delay = self._heap[0][0] - time.time()
+            if delay > 0:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            _, _, key, callback, args = heapq.heappop(self._heap)
+            del self._current[key]
+
+            try:
+                result = callback(*args)
+                if asyncio.iscoroutine(result):
+                    asyncio.get_running_loop().create_task(self._await(key, result))
+            except Exception as e:
+                logger.error("Error in timer callback for %s: %s", key, e)
+
+    async def _await(self, key, coroutine):
+        try:
+            await coroutine
+        except Exception as e:
+            logger.error("Error in timer callback for %s: %s", key, e)
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+timers = TimerHeap()
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Timer heap tools")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    check_parser = subparsers.add_parser("check", help="Reschedule keys many times and check the heap stays bounded")
+    check_parser.add_argument("--keys", type=int, default=1)
+    check_parser.add_argument("--reschedules", type=int, default=100000)
+    args = parser.parse_args()
+
+    if args.command == "check":
+        async def check():
+            heap = TimerHeap()
+            now = time.time()
+            for round_number in range(args.reschedules):
+                for key in range(args.keys):
+                    heap.schedule(key, now + 86400 + round_number, print)
+                bound = max(TimerHeap.STALE_RATIO * len(heap), TimerHeap.STALE_MINIMUM) + len(heap)
+                assert len(heap._heap) <= bound, f"heap grew to {len(heap._heap)} entries"
+            heap.stop()
+            return len(heap), len(heap._heap)
+
+        live, entries = asyncio.run(check())
+        print(f"{args.reschedules} reschedules of {live} keys left {entries} heap entries")
@@ -0,0 +1,70 @@
+from pyrogram.raw import functions, types
+from config import DISCUSSION_GROUP_ID, DISCUSSION_MODE
+from utils.ticket_store import store
+from utils.sender import scheduler, PRIORITY_RELAY
+from helper import get_logger
+
+logger = get_logger(__name__)
+
+# Telegram limits forum topic titles to 128 characters
+TOPIC_TITLE_LIMIT = 128
+
+def topics_enabled():
+    return DISCUSSION_MODE == "topics"
+
+def format_topic_title(ticket_id, user_name, issue_type):
+    return f"#{ticket_id} · {issue_type.capitalize()} · {user_name}"[:TOPIC_TITLE_LIMIT]
+
+async def create_ticket_topic(client, title, chat_id=DISCUSSION_GROUP_ID):
+    """Create a forum topic in the discussion group. Returns the topic id,
+    which is also the id of the topic's service message"""
+    request = functions.channels.CreateForumTopic(
+        channel=await client.resolve_peer(chat_id),
+        title=title,
+        random_id=client.rnd_id()
+    )
+    result = await scheduler.submit(chat_id, client.invoke, request, priority=PRIORITY_RELAY)
+
+    for update in result.updates:
+        if isinstance(update, (types.UpdateNewChannelMessage, types.UpdateNewMessage)):
+            logger.info("Created forum topic %s: %s", update.message.id, title)
+            return update.message.id
+
+    raise RuntimeError(f"Telegram did not return the new forum topic for {title!r}")
+
+async def close_ticket_topic(client, topic_id, chat_id=DISCUSSION_GROUP_ID, title=None):
+    """Close (and optionally rename) a ticket's forum topic"""
+    request = functions.channels.EditForumTopic(
+        channel=await client.resolve_peer(chat_id),
+        topic_id=topic_id,
+        title=title[:TOPIC_TITLE_LIMIT] if title else None,
+        closed=True
+    )
+    await scheduler.submit(chat_id, client.invoke, request, priority=PRIORITY_RELAY)
+    logger.info("Closed forum topic %s", topic_id)
+
+def topic_id_of(message):
+    """Forum topic a discussion group message was posted in, or None.
+
+    Messages written straight into a topic reply to the topic's service
+    message; replies inside a topic carry the topic as their top message.
+    """
+    return message.reply_to_top_message_id or message.reply_to_message_id
+
+def resolve_discussion_ticket(message):
+    """User id (str) of the ticket a discussion group message belongs to, or None.
+
+    A reply to a relayed message or to the ticket post wins; otherwise, in
+    topics mode, the message's forum topic decides, so staff can write in a
+    ticket's topic without replying to anything.
+    """
+    if message.reply_to_message_id:
+        user_id = store.find_user_by_discussion_message(message.reply_to_message_id)
+        if user_id:
+            return user_id
+
+    if topics_enabled():
+        topic_id = topic_id_of(message)
+        if topic_id:
+            return store.find_user_by_topic(topic_id)
+    return None
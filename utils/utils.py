@@ -1,12 +1,20 @@
+import functools
 from datetime import datetime, timezone, timedelta
 
+UTC7 = timezone(timedelta(hours=7))
+
 def get_timestamp():
     """Get current timestamp in UTC+7 timezone"""
-    utc7 = timezone(timedelta(hours=7))
-    now = datetime.now(timezone.utc).astimezone(utc7)
+    now = datetime.now(UTC7)
 
     return now.strftime("%d-%m-%Y %H:%M:%S UTC+7")
 
+@functools.lru_cache(maxsize=4096)
+def format_timestamp(epoch):
+    """Format an epoch timestamp the same way as get_timestamp(). Cached, so
+    models can store integer epochs and render them on demand"""
+    return datetime.fromtimestamp(epoch, UTC7).strftime("%d-%m-%Y %H:%M:%S UTC+7")
+
 def get_channel_message_url(channel_id, message_id):
     """Get URL for a message in a channel"""
     channel_id_str = str(channel_id)